@@ -0,0 +1,413 @@
+"""Headless HTTP API for the transcript pipeline.
+
+Runs the same extraction, post-processing and enrichment as the Streamlit
+app, but as a standalone service other systems (and the app itself, see the
+``pipeline_api_url`` secret) can call:
+
+    python api_server.py --port 8080 --workers 8
+
+    POST /v1/jobs?file_name=x.pdf   body: the PDF           -> 202 {"job_id", "status": "queued"}
+    GET  /v1/jobs/<id>[?wait=10]    status (queued, running, done, failed), timings, token usage and messages
+    GET  /v1/jobs/<id>/result       the enriched transcript JSON (409 until done)
+    GET  /v1/jobs/<id>/response     the raw model response text
+    GET  /healthz                   workers, queue depth and mapping data version
+
+Jobs run in a pool of worker processes, so throughput grows with the worker
+count; model calls are I/O bound, so more workers than cores is fine. The
+mapping sheets are loaded and prepared once in this process, and each
+worker receives its own pickled copy of the prepared data when the pool
+starts. Nothing is shared between processes: mapping memory grows with the
+worker count, and each worker builds its own title indexes. Workers come
+from a forkserver (spawn where there is none), never forked from this
+process, whose mapping refresh and request threads could hold locks at fork
+time.
+When the mapping data changes, the next submission starts a fresh pool and
+the old one finishes its jobs and exits. Each run is recorded in the audit
+store like the app's, so later versions of a transcript are processed
+incrementally. Secrets are read from .streamlit/secrets.toml like the app;
+set ``api_token`` to require ``Authorization: Bearer <token>``.
+Several instances can sit behind a load balancer as long as polls for a job
+go back to the instance that accepted it (job state is kept in memory).
+"""
+import argparse
+import hashlib
+import hmac
+import io
+import json
+import multiprocessing
+import os
+import re
+import sys
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import streamlit as st
+
+import testing
+
+API_MAX_UPLOAD_BYTES = 50 * 1024 * 1024
+API_MAX_QUEUED_JOBS = 200          # submissions beyond this are refused with 503
+API_JOB_TTL = 60 * 60              # seconds a finished job's result is kept
+API_MAX_WAIT = 30                  # longest ?wait= long-poll, in seconds
+
+
+# ---------------------------------------------------------------------------
+# Worker processes
+# ---------------------------------------------------------------------------
+
+class FixedMapping:
+    """Mapping source for a worker: the snapshot the pool was started with."""
+    def __init__(self, snapshot):
+        self._snapshot = snapshot
+
+    def current(self):
+        return self._snapshot
+
+    def snapshot(self):
+        return self._snapshot
+
+
+_worker_mapping = None
+
+
+def _picklable(snapshot):
+    """The snapshot without the CEP catalog's lock, which can't be pickled for a worker.
+
+    Every worker unpickles its own private copy of what is left.
+    """
+    if snapshot.cep_catalog is None:
+        return snapshot
+    return snapshot._replace(cep_catalog={key: value for key, value in snapshot.cep_catalog.items()
+                                          if key != "title_index_lock"})
+
+
+def _init_worker(snapshot):
+    global _worker_mapping
+    if snapshot.cep_catalog is not None:
+        snapshot.cep_catalog["title_index_lock"] = threading.Lock()
+    _worker_mapping = FixedMapping(snapshot)
+
+
+def _run_job(pdf_bytes, file_name):
+    """Run the pipeline on one PDF in a worker and record it; returns a picklable result dict.
+
+    Errors and warnings the pipeline would show on a page are collected into
+    the result instead.
+    """
+    started_at = time.time()
+    timings = {}
+    audit_run_id = None
+    with testing.collect_messages() as messages:
+        try:
+            json_data, claude_response, token_usage = testing.run_transcript_pipeline(
+                io.BytesIO(pdf_bytes), _worker_mapping, timings=timings
+            )
+        except Exception as e:
+            messages["errors"].append(f"Unexpected error: {str(e)}")
+            traceback.print_exc()
+            json_data = claude_response = token_usage = None
+        if json_data:
+            audit_run_id = testing.record_audit_run(
+                json_data, hashlib.sha256(pdf_bytes).hexdigest(), file_name, timings, token_usage,
+                mapping_snapshot=_worker_mapping.snapshot()
+            )
+    return {
+        "json_data": json_data,
+        "claude_response": claude_response,
+        "token_usage": token_usage,
+        "timings": timings,
+        "started_at": started_at,
+        "worker_pid": os.getpid(),
+        "audit_run_id": audit_run_id,
+        **messages,
+    }
+
+
+def _noop():
+    return os.getpid()
+
+
+class WorkerPool:
+    """Process pool tied to one mapping data version; replaced when the data changes."""
+    def __init__(self, workers, mapping_cache):
+        self.workers = workers
+        self.mapping_cache = mapping_cache
+        # Not fork: this process runs threads that may hold locks at fork time
+        self._context = multiprocessing.get_context(
+            "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        )
+        self._lock = threading.Lock()
+        self._executor = None
+        self.version = None
+
+    def _start_locked(self, snapshot):
+        executor = ProcessPoolExecutor(self.workers, mp_context=self._context,
+                                       initializer=_init_worker, initargs=(_picklable(snapshot),))
+        # Launch the workers now, while the snapshot is current
+        executor.submit(_noop).result()
+        if self._executor is not None:
+            # Queued and running jobs still finish on the old pool
+            self._executor.shutdown(wait=False)
+        self._executor = executor
+        self.version = snapshot.version
+
+    def ensure_current(self):
+        """Start the pool, or restart it if the mapping data changed; returns the executor."""
+        snapshot = self.mapping_cache.snapshot()
+        with self._lock:
+            if self._executor is None or snapshot.version != self.version:
+                self._start_locked(snapshot)
+            return self._executor
+
+    def submit(self, pdf_bytes, file_name):
+        return self.ensure_current().submit(_run_job, pdf_bytes, file_name)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+# ---------------------------------------------------------------------------
+# Jobs
+# ---------------------------------------------------------------------------
+
+class JobStore:
+    """In-memory job table; finished jobs are dropped ``ttl`` seconds after completion."""
+    def __init__(self, pool, ttl=API_JOB_TTL, max_queued=API_MAX_QUEUED_JOBS):
+        self.pool = pool
+        self.ttl = ttl
+        self.max_queued = max_queued
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def _expire_locked(self):
+        cutoff = time.time() - self.ttl
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job["finished_at"] is not None and job["finished_at"] < cutoff]:
+            del self._jobs[job_id]
+
+    def pending(self):
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job["finished_at"] is None)
+
+    def submit(self, pdf_bytes, file_name):
+        """Queue a PDF; returns the job id, or None when the queue is full."""
+        with self._lock:
+            self._expire_locked()
+            if sum(1 for job in self._jobs.values() if job["finished_at"] is None) >= self.max_queued:
+                return None
+            job_id = uuid.uuid4().hex
+            job = self._jobs[job_id] = {
+                "job_id": job_id,
+                "file_name": file_name,
+                "pdf_sha256": hashlib.sha256(pdf_bytes).hexdigest(),
+                "submitted_at": time.time(),
+                "finished_at": None,
+                "done": threading.Event(),
+                "future": None,
+                "result": None,
+            }
+        try:
+            future = self.pool.submit(pdf_bytes, file_name)
+        except Exception:
+            with self._lock:
+                del self._jobs[job_id]
+            raise
+        job["future"] = future
+        future.add_done_callback(lambda future: self._finish(job_id, future))
+        return job_id
+
+    def _finish(self, job_id, future):
+        try:
+            result = future.result()
+        except Exception as e:
+            # The worker died (or the pool was shut down) before returning
+            result = {"json_data": None, "claude_response": None, "token_usage": None, "timings": {},
+                      "started_at": None, "audit_run_id": None, "errors": [f"Worker failed: {str(e)}"],
+                      "warnings": []}
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job["result"] = result
+            job["finished_at"] = time.time()
+        job["done"].set()
+
+    def get(self, job_id, wait=0):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None and wait:
+            job["done"].wait(min(wait, API_MAX_WAIT))
+        return job
+
+
+def job_status(job):
+    """Public view of a job for GET /v1/jobs/<id>."""
+    result = job["result"]
+    status = {
+        "job_id": job["job_id"],
+        "file_name": job["file_name"],
+        "pdf_sha256": job["pdf_sha256"],
+        "submitted_at": job["submitted_at"],
+        "finished_at": job["finished_at"],
+    }
+    if result is None:
+        # A process pool marks a job running once it is handed to a worker's call queue
+        future = job["future"]
+        status["status"] = "running" if future is not None and future.running() else "queued"
+        return status
+    status.update({
+        "status": "done" if result["json_data"] else "failed",
+        "timings": dict(result["timings"], queued=(result["started_at"] or job["finished_at"]) - job["submitted_at"]),
+        "token_usage": result["token_usage"],
+        "audit_run_id": result["audit_run_id"],
+        "errors": result["errors"],
+        "warnings": result["warnings"],
+    })
+    return status
+
+
+# ---------------------------------------------------------------------------
+# HTTP
+# ---------------------------------------------------------------------------
+
+class ApiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "TranscriptAPI/1.0"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send(self, status, body, content_type="application/json", headers=None):
+        if content_type == "application/json":
+            body = json.dumps(body).encode("utf-8")
+        elif isinstance(body, str):
+            body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type if content_type != "text/plain" else "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status, message):
+        self._send(status, {"error": message})
+
+    def _authorized(self):
+        token = self.server.api_token
+        provided = self.headers.get("Authorization", "")
+        # Constant-time comparison so response timing doesn't reveal the token
+        if not token or hmac.compare_digest(provided.encode("utf-8"), f"Bearer {token}".encode("utf-8")):
+            return True
+        self._error(401, "missing or invalid bearer token")
+        return False
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        # A reply sent before the body is read ends the connection; on keep-alive
+        # the unread body would otherwise be parsed as the next request
+        close_connection, self.close_connection = self.close_connection, True
+        if url.path != "/v1/jobs":
+            return self._error(404, f"unknown path {url.path}")
+        if not self._authorized():
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > API_MAX_UPLOAD_BYTES:
+            return self._error(413, f"PDF larger than {API_MAX_UPLOAD_BYTES} bytes")
+        pdf_bytes = self.rfile.read(length) if length else b""
+        self.close_connection = close_connection
+        if not pdf_bytes.startswith(b"%PDF"):
+            return self._error(400, "request body must be a PDF")
+        file_name = parse_qs(url.query).get("file_name", ["transcript.pdf"])[0]
+        try:
+            job_id = self.server.jobs.submit(pdf_bytes, file_name)
+        except Exception as e:
+            return self._error(503, f"could not start a worker: {str(e)}")
+        if job_id is None:
+            return self._error(503, "too many jobs queued; retry later")
+        self._send(202, {"job_id": job_id, "status": "queued"}, headers={"Location": f"/v1/jobs/{job_id}"})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/healthz":
+            snapshot = self.server.mapping_cache.current()
+            return self._send(200, {
+                "status": "ok",
+                "workers": self.server.pool.workers,
+                "pending_jobs": self.server.jobs.pending(),
+                "mapping_version": snapshot.version if snapshot is not None else None,
+            })
+        match = re.fullmatch(r"/v1/jobs/([0-9a-f]{32})(/result|/response)?", url.path)
+        if not match:
+            return self._error(404, f"unknown path {url.path}")
+        if not self._authorized():
+            return
+        try:
+            wait = float(parse_qs(url.query).get("wait", ["0"])[0])
+        except ValueError:
+            return self._error(400, "wait must be a number of seconds")
+        job = self.server.jobs.get(match.group(1), wait=wait if not match.group(2) else 0)
+        if job is None:
+            return self._error(404, "unknown or expired job")
+        result = job["result"]
+        if match.group(2) is None:
+            return self._send(200, job_status(job))
+        if result is None:
+            return self._error(409, "job has not finished")
+        if match.group(2) == "/response":
+            if result["claude_response"] is None:
+                return self._error(404, "no model response for this job")
+            return self._send(200, result["claude_response"], content_type="text/plain")
+        if not result["json_data"]:
+            return self._error(422, "; ".join(result["errors"]) or "extraction failed")
+        self._send(200, result["json_data"])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="worker processes (default: CPU count)")
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    args = parser.parse_args(argv)
+
+    mapping_cache = testing.get_mapping_cache()
+    print("Loading mapping data...", flush=True)
+    snapshot = mapping_cache.snapshot()
+    for error in snapshot.errors:
+        print(f"Mapping data: {error}", flush=True)
+    pool = WorkerPool(args.workers, mapping_cache)
+    pool.ensure_current()
+
+    server = ThreadingHTTPServer((args.host, args.port), ApiHandler)
+    server.daemon_threads = True
+    server.verbose = args.verbose
+    server.api_token = st.secrets.get("api_token")
+    server.mapping_cache = mapping_cache
+    server.pool = pool
+    server.jobs = JobStore(pool)
+    print(f"Serving on http://{args.host}:{server.server_address[1]} with {args.workers} workers "
+          f"(mapping version {snapshot.version})", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        pool.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
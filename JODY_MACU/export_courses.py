@@ -0,0 +1,76 @@
+"""Bulk-export processed transcripts to one course-level table for SIS import.
+
+Reads the JSON files saved with "Download JSON Data" one at a time and
+streams their courses to Parquet or CSV in chunks:
+
+    python export_courses.py courses.parquet results/*.json
+    python export_courses.py --format csv courses.csv results/
+    python export_courses.py courses.parquet results/ --rollups credit_summary.csv
+
+The org_code column is filled from the SchoolInstitutions sheet, loaded with
+the app's Google credentials from .streamlit/secrets.toml; pass
+--no-org-codes to skip it and leave the column blank.
+"""
+import argparse
+import glob
+import os
+import sys
+
+import testing
+
+
+def expand_paths(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            yield from sorted(glob.glob(os.path.join(path, "**", "*.json"), recursive=True))
+        else:
+            yield path
+
+
+def load_institution_df():
+    """SchoolInstitutions sheet prepared for org code lookups, the way the app loads it."""
+    with testing.collect_messages() as messages:
+        institution_df = testing.prepare_institution_catalog(testing.load_institution_mappings())
+    for message in messages["errors"] + messages["warnings"]:
+        print(f"WARN: {message}", file=sys.stderr)
+    if institution_df.empty:
+        print("WARN: no institution mappings loaded; org_code will be blank", file=sys.stderr)
+    return institution_df
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("output", help="output file path")
+    parser.add_argument("inputs", nargs="+", help="processed JSON files or directories containing them")
+    parser.add_argument("--format", choices=["parquet", "csv"], default=None,
+                        help="output format (default: from the output file extension)")
+    parser.add_argument("--chunk-rows", type=int, default=testing.EXPORT_CHUNK_ROWS)
+    parser.add_argument("--rollups", default=None,
+                        help="also write per-transcript credit and GPA totals to this .csv or .parquet file")
+    parser.add_argument("--no-org-codes", action="store_true",
+                        help="don't load the SchoolInstitutions sheet; org_code is left blank")
+    args = parser.parse_args(argv)
+
+    fmt = args.format or ("csv" if args.output.lower().endswith(".csv") else "parquet")
+    row_count = testing.export_course_table(
+        testing.iter_transcript_files(expand_paths(args.inputs)),
+        args.output,
+        fmt=fmt,
+        institution_df=None if args.no_org_codes else load_institution_df(),
+        chunk_rows=args.chunk_rows,
+    )
+    print(f"Wrote {row_count} course rows to {args.output}")
+    
+    if args.rollups:
+        courses = testing.flatten_courses(testing.iter_transcript_files(expand_paths(args.inputs)))
+        _, transcripts = testing.compute_rollups(courses)
+        if args.rollups.lower().endswith(".csv"):
+            transcripts.to_csv(args.rollups, index=False)
+        else:
+            transcripts.to_parquet(args.rollups, index=False)
+        print(f"Wrote credit totals for {len(transcripts)} transcripts to {args.rollups}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,600 @@
+"""Concurrent-session load test for the transcript analyzer.
+
+Drives simulated advisors through the whole app flow (password, upload,
+Process Transcript, feedback with Drive upload, Sheet mirror and audit log).
+Each advisor is a Streamlit AppTest session, and all sessions run in this one
+process, the way they would share one Streamlit worker. The Anthropic API,
+Google Sheets, Google Drive and the OAuth token endpoint are replaced by a
+local fake server. It runs in a separate process and has configurable latency
+and error rates. The app is pointed at it through ANTHROPIC_BASE_URL and the
+``google_api_endpoint`` secret.
+
+Pass a list of concurrency levels to find the saturation point:
+
+    python load_test.py --sessions 1,2,4,8 --iterations 3 --anthropic-latency 4 --error-rate 0.02
+
+For each level the report lists throughput, p50/p95/p99 latency per stage,
+failures and process memory growth.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+APP_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "testing.py")
+APP_PASSWORD = "load-test"
+STAGES = ["open", "password", "upload", "process", "feedback"]
+
+# Spreadsheets the app reads and writes, by the ids hard-coded in testing.py
+SPREADSHEETS = {
+    "122e-sqnpQWkue_uGxLLrcc7nuwBWppzUeh9cdp6vpRY": "institutions",
+    "1p2_1E25dYfWWb2ugfsFSdDPss-ahzGBxaQ41YUkVRK4": "cep",
+    "12CpxGQMyTa_cwyY0B-iomDgflD24kjYFYPLWljD6Jgo": "ceqmacu",
+    "1n_jJ9Lq1lhNvQ6tWXZra4d4H_fLemXIqmHTyuWf4qEc": "feedback",
+}
+CEP_SHEETS = ["2020-2021", "2021-2022", "2022-2023", "2023-2024", "2024-2025", "2025-2026"]
+SUBJECTS = ["ENGL", "MATH", "BIOL", "CHEM", "HIST", "PSYC", "SOCI", "ACCT", "ECON", "PHYS", "MUSI", "SPCH"]
+TITLE_WORDS = ["Introduction", "Composition", "College", "Algebra", "General", "Principles", "American",
+               "History", "World", "Literature", "Survey", "Applied", "Biology", "Chemistry", "Public", "Speaking"]
+
+
+# ---------------------------------------------------------------------------
+# Synthetic data
+# ---------------------------------------------------------------------------
+
+def build_workbooks(institutions, catalog_rows, seed):
+    """Spreadsheet contents served by the fake Sheets API: {workbook: {sheet title: rows}}."""
+    rng = random.Random(seed)
+    names = [f"Fake Community College {i}" for i in range(institutions)]
+    workbooks = {
+        "institutions": {"SchoolInstitutions": [["ORG_NAME", "ORG_CDE"]] + [
+            [name, str(100000 + i)] for i, name in enumerate(names)
+        ]},
+        "cep": {},
+        "ceqmacu": {"CEQMACU": [["SendCourse1CourseCode", "SendEditionLowYear", "ReceiveCourse1CourseCode",
+                                 "ReceiveCourse1CourseTitle", "ReceiveCourse1Units"]]},
+        "feedback": {"Feedback": [["File URL", "JSON", "Comment"]]},
+    }
+    courses = {}
+    for sheet_name in CEP_SHEETS:
+        rows = [[f"CEP {sheet_name}"], ["Institution", "CourseCode", "CombineTitleCode", "CommonCode", "CommonCourseTitle"]]
+        for subject in SUBJECTS:
+            for number in range(1, 11):
+                rows.append(["MACU", f"{subject} {1000 + number}", f"{subject} {1000 + number} {subject.title()} {number}",
+                             f"{subject}{number}", f"{subject.title()} {number}"])
+        for _ in range(catalog_rows):
+            institution = rng.choice(names)
+            subject = rng.choice(SUBJECTS)
+            code = f"{subject} {rng.randint(1000, 2999)}"
+            title = " ".join(rng.sample(TITLE_WORDS, rng.randint(2, 4)))
+            rows.append([institution, code, f"{code} {title}", f"{subject}{rng.randint(1, 10)}", title])
+            courses.setdefault(institution, []).append((code, title))
+        workbooks["cep"][sheet_name] = rows
+    for _ in range(max(catalog_rows // 5, 1)):
+        subject = rng.choice(SUBJECTS)
+        workbooks["ceqmacu"]["CEQMACU"].append([
+            f"{subject}{rng.randint(1000, 2999)}", str(rng.choice([2015, 2019, 2022])),
+            f"{subject} {rng.randint(1001, 1010)}", "Transfer equivalent", "3",
+        ])
+    return workbooks, courses
+
+
+def build_transcript(rng, courses_by_institution, terms=6, courses_per_term=5):
+    """A model response payload: mostly catalog courses from one institution, a few unknown ones."""
+    institution = rng.choice(sorted(courses_by_institution))
+    catalog = courses_by_institution[institution]
+    transcript = []
+    year = 2021
+    for index in range(terms):
+        term = ["Fall", "Spring", "Summer"][index % 3]
+        if term == "Spring":
+            year += 1
+        courses = []
+        for _ in range(courses_per_term):
+            if rng.random() < 0.8:
+                code, title = rng.choice(catalog)
+            else:
+                code, title = f"{rng.choice(SUBJECTS)} {rng.randint(3000, 3999)}", "Special Topics"
+            grade = rng.choice(["A", "A-", "B+", "B", "C", "P", "W"])
+            credits = rng.choice([3, 3, 4, 1])
+            courses.append({"course_code": code, "title": title, "division": "UNDG", "credits": credits,
+                            "grade": grade, "points": ""})
+        transcript.append({"institution": institution, "term": term, "year": str(year), "courses": courses})
+    return transcript
+
+
+def make_transcript_pdf(pages=3, lines_per_page=45):
+    """A small PDF with a real text layer, so the app's size estimate sees text pages."""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_refs = []
+    for page in range(pages):
+        lines = [f"TERM {page + 1}  COURSE {n:03d}  INTRODUCTION TO SUBJECT  3.00  A  12.00"
+                 for n in range(lines_per_page)]
+        stream = "BT /F1 9 Tf 40 760 Td 15 TL " + " ".join(f"({line}) Tj T*" for line in lines) + " ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+        page_refs.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(page_refs)}] /Count {pages} >>"
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(output)
+    output += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    for offset in offsets:
+        output += f"{offset:010d} 00000 n \n".encode("latin-1")
+    output += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1")
+    return bytes(output)
+
+
+def make_service_account(token_uri):
+    """Service account info with a freshly generated key, whose token_uri is the fake server."""
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private_key = key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ).decode("ascii")
+    return {
+        "type": "service_account",
+        "project_id": "load-test",
+        "private_key_id": "load-test",
+        "private_key": private_key,
+        "client_email": "load-test@load-test.iam.gserviceaccount.com",
+        "client_id": "1",
+        "token_uri": token_uri,
+    }
+
+
+# ---------------------------------------------------------------------------
+# Fake Anthropic / Google server
+# ---------------------------------------------------------------------------
+
+class FakeServiceHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _simulate(self, service):
+        """Apply the configured latency; returns True when this call should fail."""
+        config = self.server.config
+        latency = config["latency"][service]
+        if latency:
+            time.sleep(random.uniform(0.5 * latency, 1.5 * latency))
+        self.server.count(service)
+        if random.random() < config["error_rate"][service]:
+            self.server.count(f"{service}_errors")
+            return True
+        return False
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/__stats":
+            return self._send_json(200, self.server.snapshot_counts())
+        match = re.match(r"^/v4/spreadsheets/([^/]+)(/values/(.+))?$", path)
+        if not match:
+            return self._send_json(404, {"error": {"code": 404, "message": f"unknown path {path}"}})
+        if self._simulate("sheets"):
+            return self._send_json(503, {"error": {"code": 503, "message": "backendError", "status": "UNAVAILABLE"}})
+        workbook = self.server.workbook(match.group(1))
+        if match.group(3) is None:
+            return self._send_json(200, {
+                "spreadsheetId": match.group(1),
+                "properties": {"title": SPREADSHEETS.get(match.group(1), "unknown"), "locale": "en_US", "timeZone": "UTC"},
+                "sheets": [
+                    {"properties": {"sheetId": index, "title": title, "index": index, "sheetType": "GRID",
+                                    "gridProperties": {"rowCount": len(rows) + 100, "columnCount": 26}}}
+                    for index, (title, rows) in enumerate(workbook.items())
+                ],
+            })
+        title = unquote(match.group(3)).split("!")[0].strip("'")
+        with self.server.lock:
+            rows = [list(row) for row in workbook.get(title, [])]
+        return self._send_json(200, {"range": f"'{title}'!A1:Z{len(rows)}", "majorDimension": "ROWS", "values": rows})
+
+    def do_POST(self):
+        parsed = urlparse(self.path)
+        body = self._read_body()
+        if parsed.path == "/token":
+            self.server.count("token")
+            return self._send_json(200, {"access_token": "load-test-token", "expires_in": 3600, "token_type": "Bearer"})
+        if parsed.path == "/v1/messages":
+            return self._anthropic(body)
+        match = re.match(r"^/v4/spreadsheets/([^/]+)/values/(.+):append$", parsed.path)
+        if match:
+            if self._simulate("sheets"):
+                return self._send_json(503, {"error": {"code": 503, "message": "backendError", "status": "UNAVAILABLE"}})
+            title = unquote(match.group(2)).split("!")[0].strip("'")
+            with self.server.lock:
+                sheet = self.server.workbook(match.group(1)).setdefault(title, [])
+                sheet.extend(json.loads(body or b"{}").get("values", []))
+            return self._send_json(200, {"spreadsheetId": match.group(1), "updates": {"updatedRows": 1}})
+        if parsed.path == "/upload/drive/v3/files":
+            # Resumable upload, step 1: metadata in, session URL out
+            if self._simulate("drive"):
+                return self._send_json(503, {"error": {"code": 503, "message": "backendError"}})
+            upload_id = self.server.start_upload(json.loads(body or b"{}"))
+            location = f"http://{self.headers['Host']}/upload/drive/v3/files?upload_id={upload_id}"
+            return self._send_json(200, {}, headers={"Location": location})
+        match = re.match(r"^/drive/v3/files/([^/]+)/permissions$", parsed.path)
+        if match:
+            return self._send_json(200, {"id": "anyone", "type": "anyone", "role": "reader"})
+        return self._send_json(404, {"error": {"code": 404, "message": f"unknown path {parsed.path}"}})
+
+    def do_PUT(self):
+        # Resumable upload, step 2: chunks until the last byte arrives
+        parsed = urlparse(self.path)
+        body = self._read_body()
+        upload_id = parse_qs(parsed.query).get("upload_id", [""])[0]
+        content_range = self.headers.get("Content-Range", "")
+        match = re.match(r"bytes (\d+)-(\d+)/(\d+|\*)", content_range)
+        metadata = self.server.uploads.get(upload_id)
+        if metadata is None:
+            return self._send_json(404, {"error": {"code": 404, "message": "unknown upload"}})
+        if match and match.group(3) != "*" and int(match.group(2)) + 1 < int(match.group(3)):
+            self.send_response(308)
+            self.send_header("Range", f"bytes=0-{match.group(2)}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.server.uploads.pop(upload_id, None)
+        self.server.count("drive_bytes", len(body))
+        return self._send_json(200, {
+            "id": upload_id,
+            "name": metadata.get("name", "transcript.pdf"),
+            "webViewLink": f"https://drive.google.com/file/d/{upload_id}/view",
+        })
+
+    def _anthropic(self, body):
+        if self._simulate("anthropic"):
+            return self._send_json(529, {"type": "error", "error": {"type": "overloaded_error", "message": "Overloaded"}})
+        request = json.loads(body)
+        transcript = build_transcript(random.Random(), self.server.courses, **self.server.config["transcript"])
+        text = "Step 1 done.\n```json\n" + json.dumps(transcript, indent=2) + "\n```"
+        return self._send_json(200, {
+            "id": f"msg_{random.getrandbits(48):x}",
+            "type": "message",
+            "role": "assistant",
+            "model": request.get("model", "fake"),
+            "content": [{"type": "text", "text": text}],
+            "stop_reason": "end_turn",
+            "stop_sequence": None,
+            "usage": {"input_tokens": len(body) // 4, "output_tokens": len(text) // 4,
+                      "cache_creation_input_tokens": 0, "cache_read_input_tokens": 0},
+        })
+
+
+class FakeServiceServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, config):
+        super().__init__(address, FakeServiceHandler)
+        self.config = config
+        self.workbooks, self.courses = build_workbooks(config["institutions"], config["catalog_rows"], config["seed"])
+        self.uploads = {}
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    def workbook(self, spreadsheet_id):
+        return self.workbooks.setdefault(SPREADSHEETS.get(spreadsheet_id, spreadsheet_id), {"Sheet1": []})
+
+    def start_upload(self, metadata):
+        upload_id = f"{random.getrandbits(64):x}"
+        self.uploads[upload_id] = metadata
+        return upload_id
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + amount
+
+    def snapshot_counts(self):
+        with self.lock:
+            return dict(self.counts)
+
+
+def serve_fakes(config, ready):
+    server = FakeServiceServer(("127.0.0.1", 0), config)
+    ready.put(server.server_address[1])
+    server.serve_forever()
+
+
+def start_fake_services(config):
+    """Run the fake server in its own process (so it doesn't skew the app's memory or GIL); returns (process, base_url)."""
+    ready = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve_fakes, args=(config, ready), daemon=True)
+    process.start()
+    port = ready.get(timeout=60)
+    return process, f"http://127.0.0.1:{port}"
+
+
+def fetch_service_counts(base_url):
+    from urllib.request import urlopen
+    with urlopen(f"{base_url}/__stats", timeout=10) as response:
+        return json.loads(response.read())
+
+
+# ---------------------------------------------------------------------------
+# Simulated sessions
+# ---------------------------------------------------------------------------
+
+def rss_bytes():
+    """Current resident set size of this process (Linux), or 0 when unavailable."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+def _failure(at):
+    """First exception or error message the app rendered, if any."""
+    if len(at.exception):
+        return at.exception[0].value
+    if len(at.error):
+        return at.error[0].value
+    return None
+
+
+def install_shared_runtime(secrets):
+    """Give every AppTest run one process-wide runtime, script cache and st.secrets.
+
+    AppTest builds a mock runtime (media files, st.cache_data store) and a
+    script cache afresh for each run, and swaps the runtime singleton, the
+    "global.appTest" option and st.secrets in and out around it. That is fine
+    for one test at a time, but concurrent sessions tear each other's state
+    down mid-run. A real Streamlit server keeps one of each per process, so
+    pin them once here. Without this the load test would also re-compile the
+    app on every rerun (concurrent compiles trip a CPython 3.11 ast bug) and
+    never hit st.cache_data.
+    """
+    from contextlib import nullcontext
+    from unittest.mock import MagicMock
+
+    import streamlit as st
+    from streamlit import config
+    from streamlit.components.v2.component_manager import BidiComponentManager
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.dataframe_source_manager import DataframeSourceManager
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.runtime.secrets import Secrets
+    from streamlit.testing.v1 import app_test, local_script_runner
+
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.dataframe_source_mgr = DataframeSourceManager()
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    runtime.bidi_component_registry = BidiComponentManager()
+    Runtime.instance = classmethod(lambda cls: runtime)
+    Runtime.exists = classmethod(lambda cls: True)
+
+    script_cache = ScriptCache()
+    app_test.ScriptCache = local_script_runner.ScriptCache = lambda: script_cache
+    config.set_option("global.appTest", True)
+    app_test.patch_config_options = lambda overrides: nullcontext()
+
+    shared_secrets = Secrets()
+    shared_secrets._secrets = secrets
+    st.secrets = shared_secrets
+
+
+def _button(at, label):
+    return next((button for button in at.button if button.label == label), None)
+
+
+def run_session(pdf_bytes, timeout):
+    """One advisor: password, upload, process, feedback. Returns (stage timings, failure or None)."""
+    from streamlit.testing.v1 import AppTest
+
+    timings = {}
+
+    def timed(stage, action):
+        start = time.perf_counter()
+        action()
+        timings[stage] = time.perf_counter() - start
+        return _failure(at)
+
+    at = AppTest.from_file(APP_FILE, default_timeout=timeout)
+    failure = timed("open", at.run)
+    if failure:
+        return timings, f"open: {failure}"
+    failure = timed("password", lambda: at.text_input(key="password").input(APP_PASSWORD).run())
+    if failure:
+        return timings, f"password: {failure}"
+    failure = timed("upload", lambda: at.file_uploader[0].set_value(("transcript.pdf", pdf_bytes, "application/pdf")).run())
+    if failure:
+        return timings, f"upload: {failure}"
+    process_button = _button(at, "Process Transcript")
+    if process_button is None:
+        return timings, f"upload: no Process Transcript button ({[w.value for w in at.warning] or 'no warnings'})"
+    failure = timed("process", lambda: process_button.click().run())
+    if failure or not at.session_state["pdf_processed"]:
+        return timings, f"process: {failure or 'no result'}"
+
+    def submit_feedback():
+        at.text_area[0].input("Load test feedback")
+        _button(at, "Submit Feedback").click().run()
+    failure = timed("feedback", submit_feedback)
+    if failure or at.session_state["drive_upload_status"] != "success":
+        return timings, f"feedback: {failure or 'PDF not saved to Drive'}"
+    return timings, None
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return float("nan")
+    return ordered[min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)]
+
+
+def run_level(concurrency, iterations, pdf_bytes, timeout):
+    """Run ``concurrency`` advisors for ``iterations`` sessions each; returns the level's report dict."""
+    results = []
+    results_lock = threading.Lock()
+    samples = []
+    stop = threading.Event()
+
+    def sample_memory():
+        while not stop.wait(0.25):
+            samples.append(rss_bytes())
+
+    def advisor():
+        for _ in range(iterations):
+            outcome = run_session(pdf_bytes, timeout)
+            with results_lock:
+                results.append(outcome)
+
+    rss_start = rss_bytes()
+    sampler = threading.Thread(target=sample_memory, daemon=True)
+    sampler.start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(advisor) for _ in range(concurrency)]:
+            future.result()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    sampler.join()
+    rss_end = rss_bytes()
+
+    completed = [timings for timings, failure in results if failure is None]
+    failures = [failure for _, failure in results if failure is not None]
+    stages = {}
+    for stage in STAGES:
+        values = [timings[stage] for timings, _ in results if stage in timings]
+        stages[stage] = {
+            "count": len(values),
+            "p50": percentile(values, 0.50),
+            "p95": percentile(values, 0.95),
+            "p99": percentile(values, 0.99),
+        }
+    return {
+        "concurrency": concurrency,
+        "sessions": len(results),
+        "completed": len(completed),
+        "failed": len(failures),
+        "failures": failures[:10],
+        "elapsed_s": elapsed,
+        "throughput_per_min": len(completed) / elapsed * 60 if elapsed else 0.0,
+        "stages": stages,
+        "rss_start_mb": rss_start / 1024 / 1024,
+        "rss_end_mb": rss_end / 1024 / 1024,
+        "rss_peak_mb": max(samples + [rss_end]) / 1024 / 1024,
+        "rss_growth_per_session_kb": (rss_end - rss_start) / 1024 / max(len(results), 1),
+    }
+
+
+def print_level(report):
+    print(f"\n== {report['concurrency']} concurrent advisors: {report['completed']}/{report['sessions']} sessions "
+          f"completed in {report['elapsed_s']:.1f}s ({report['throughput_per_min']:.1f} sessions/min)")
+    print(f"   {'stage':<10}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for stage, stats in report["stages"].items():
+        if stats["count"]:
+            print(f"   {stage:<10}{stats['p50']:>8.2f}s{stats['p95']:>8.2f}s{stats['p99']:>8.2f}s")
+    print(f"   memory: {report['rss_start_mb']:.0f} MB -> {report['rss_end_mb']:.0f} MB "
+          f"(peak {report['rss_peak_mb']:.0f} MB, {report['rss_growth_per_session_kb']:+.0f} KB/session)")
+    for failure in report["failures"]:
+        print(f"   failure: {str(failure)[:200]}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", default="1,2,4,8",
+                        help="comma-separated concurrency levels (simultaneous advisors)")
+    parser.add_argument("--iterations", type=int, default=2, help="sessions per advisor at each level")
+    parser.add_argument("--anthropic-latency", type=float, default=2.0, help="mean model latency in seconds")
+    parser.add_argument("--sheets-latency", type=float, default=0.15, help="mean Sheets API latency in seconds")
+    parser.add_argument("--drive-latency", type=float, default=0.3, help="mean Drive API latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="error rate for every fake service")
+    parser.add_argument("--anthropic-error-rate", type=float, default=None)
+    parser.add_argument("--sheets-error-rate", type=float, default=None)
+    parser.add_argument("--drive-error-rate", type=float, default=None)
+    parser.add_argument("--catalog-rows", type=int, default=2000, help="CEP rows per academic-year sheet")
+    parser.add_argument("--institutions", type=int, default=50)
+    parser.add_argument("--pdf-pages", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=300, help="seconds allowed per script run")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", default=None, help="also write the report to this file")
+    args = parser.parse_args(argv)
+
+    def error_rate(specific):
+        return args.error_rate if specific is None else specific
+
+    config = {
+        "latency": {"anthropic": args.anthropic_latency, "sheets": args.sheets_latency, "drive": args.drive_latency},
+        "error_rate": {"anthropic": error_rate(args.anthropic_error_rate), "sheets": error_rate(args.sheets_error_rate),
+                       "drive": error_rate(args.drive_error_rate)},
+        "institutions": args.institutions,
+        "catalog_rows": args.catalog_rows,
+        "seed": args.seed,
+        "transcript": {"terms": 6, "courses_per_term": 5},
+    }
+    process, base_url = start_fake_services(config)
+    workdir = tempfile.mkdtemp(prefix="transcript-load-test-")
+    # The Anthropic SDK reads its base URL from the environment
+    os.environ["ANTHROPIC_BASE_URL"] = base_url
+    secrets = {
+        "app_password": APP_PASSWORD,
+        "anthropic_api_key": "load-test",
+        "gcp_service_account": make_service_account(f"{base_url}/token"),
+        "google_api_endpoint": base_url,
+        "audit_db_path": os.path.join(workdir, "audit.db"),
+        "profile_dir": os.path.join(workdir, "profiles"),
+    }
+    pdf_bytes = make_transcript_pdf(args.pdf_pages)
+    install_shared_runtime(secrets)
+    try:
+        print(f"Fake services at {base_url}; work directory {workdir}")
+        # One unmeasured session loads the mapping data and warms the shared caches
+        warmup_timings, warmup_failure = run_session(pdf_bytes, args.timeout)
+        if warmup_failure:
+            print(f"Warm-up session failed: {warmup_failure}")
+            return 1
+        print("Warm-up session: " + ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in warmup_timings.items()))
+
+        reports = []
+        for concurrency in [int(level) for level in args.sessions.split(",") if level.strip()]:
+            report = run_level(concurrency, args.iterations, pdf_bytes, args.timeout)
+            print_level(report)
+            reports.append(report)
+        counts = fetch_service_counts(base_url)
+        print("\nFake service calls: " + ", ".join(f"{name} {count}" for name, count in sorted(counts.items())))
+        if args.json:
+            with open(args.json, "w") as output:
+                json.dump({"config": config, "levels": reports, "service_calls": counts}, output, indent=2)
+        return 0 if all(report["failed"] == 0 for report in reports) else 1
+    finally:
+        process.terminate()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
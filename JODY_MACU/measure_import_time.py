@@ -0,0 +1,106 @@
+"""Measure the cold-start import cost of the transcript analyzer.
+
+Imports ``testing`` in a fresh interpreter under ``python -X importtime`` and
+reports the slowest imports, the total wall time and any heavy stacks that
+were loaded eagerly. Exits non-zero when a heavy module leaks into the cold
+start or the import exceeds the budget, so it can guard against regressions:
+
+    python measure_import_time.py --budget-ms 1500 --runs 5
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+APP_MODULE = "testing"
+
+# Modules that must only be loaded on first use, never by importing the app
+HEAVY_MODULES = [
+    "pandas",
+    "numpy",
+    "anthropic",
+    "googleapiclient",
+    "google.oauth2",
+    "google.auth",
+    "gspread",
+    "PyPDF2",
+    "pyarrow",
+]
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"elapsed": elapsed, "modules": sorted(sys.modules)}}))
+"""
+
+
+def run_once(app_dir, module=APP_MODULE):
+    """Import a module once in a fresh interpreter; return (elapsed_s, modules, importtime rows)."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE.format(module=module)],
+        cwd=app_dir,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr}")
+    payload = json.loads(result.stdout.strip().splitlines()[-1])
+
+    rows = []
+    for line in result.stderr.splitlines():
+        # Format: "import time:   self [us] |  cumulative | imported package"
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        try:
+            _, self_us, cumulative_us, name = [part.strip() for part in line.replace("import time:", "|", 1).split("|")]
+            rows.append((name.strip(), int(self_us), int(cumulative_us)))
+        except ValueError:
+            continue
+    return payload["elapsed"], payload["modules"], rows
+
+
+def leaked_heavy_modules(modules, baseline_modules=()):
+    """Heavy modules loaded by the app itself (not already pulled in by streamlit)."""
+    loaded = set(modules) - set(baseline_modules)
+    return [name for name in HEAVY_MODULES if name in loaded]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3, help="number of cold imports; the fastest one is reported")
+    parser.add_argument("--budget-ms", type=float, default=None, help="fail if the fastest import exceeds this")
+    parser.add_argument("--top", type=int, default=15, help="number of slowest imports to list")
+    args = parser.parse_args(argv)
+
+    app_dir = os.path.dirname(os.path.abspath(__file__))
+    best = None
+    for _ in range(max(args.runs, 1)):
+        elapsed, modules, rows = run_once(app_dir)
+        if best is None or elapsed < best[0]:
+            best = (elapsed, modules, rows)
+    elapsed, modules, rows = best
+    _, baseline_modules, _ = run_once(app_dir, module="streamlit")
+
+    print(f"Cold import of '{APP_MODULE}': {elapsed * 1000:.1f} ms ({len(modules)} modules loaded)")
+    print(f"\nSlowest {args.top} imports (cumulative):")
+    for name, self_us, cumulative_us in sorted(rows, key=lambda r: r[2], reverse=True)[:args.top]:
+        print(f"  {cumulative_us / 1000:9.1f} ms  {self_us / 1000:8.1f} ms self  {name.strip()}")
+
+    failed = False
+    leaked = leaked_heavy_modules(modules, baseline_modules)
+    if leaked:
+        failed = True
+        print(f"\nFAIL: heavy modules loaded at import time: {', '.join(leaked)}")
+    if args.budget_ms is not None and elapsed * 1000 > args.budget_ms:
+        failed = True
+        print(f"\nFAIL: import took {elapsed * 1000:.1f} ms, budget is {args.budget_ms:.1f} ms")
+    if not failed:
+        print("\nOK: no heavy modules loaded at import time")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
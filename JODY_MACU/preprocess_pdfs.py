@@ -0,0 +1,84 @@
+"""Check local PDF preprocessing against a set of fixture transcripts.
+
+Runs preprocess_pdf over each PDF and reports the pages and bytes it would
+save. Every page with a text layer must still be covered by a page that is
+sent to the model, either the page itself or a duplicate of it. Exits
+non-zero when any page's text would be lost, so it can guard changes to the
+pruning rules:
+
+    python preprocess_pdfs.py fixtures/*.pdf
+    python preprocess_pdfs.py --target-dpi 200 fixtures/
+"""
+import argparse
+import glob
+import io
+import os
+import sys
+
+import testing
+
+
+def expand_paths(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            yield from sorted(glob.glob(os.path.join(path, "**", "*.pdf"), recursive=True))
+        else:
+            yield path
+
+
+def page_texts(reader):
+    return [testing._normalize_page_text(page.extract_text()) for page in reader.pages]
+
+
+def lost_pages(original_texts, kept_texts):
+    """1-based numbers of original text pages that no kept page covers."""
+    kept_words = [set(text.split()) for text in kept_texts]
+    lost = []
+    for number, text in enumerate(original_texts, start=1):
+        if not text or len(text) < 80 and any(marker in text for marker in testing.BLANK_PAGE_MARKERS):
+            continue
+        words = set(text.split())
+        if not any(len(words & kept) / len(words | kept) >= testing.EXPLANATION_PAGE_SIMILARITY
+                   for kept in kept_words):
+            lost.append(number)
+    return lost
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("inputs", nargs="+", help="PDF files or directories containing them")
+    parser.add_argument("--target-dpi", type=int, default=testing.PDF_TARGET_DPI)
+    parser.add_argument("--no-prune", action="store_true", help="only downsample images")
+    args = parser.parse_args(argv)
+
+    from PyPDF2 import PdfReader
+    failed = False
+    totals = {"pages_in": 0, "pages_out": 0, "bytes_in": 0, "bytes_out": 0}
+    for path in expand_paths(args.inputs):
+        with open(path, "rb") as pdf_file:
+            original = pdf_file.read()
+        output, report = testing.preprocess_pdf(io.BytesIO(original), target_dpi=args.target_dpi,
+                                                prune_pages=not args.no_prune)
+        for key in totals:
+            totals[key] += report[key]
+        dropped = ", ".join(f"p{page['page']} {page['reason']}" for page in report["dropped"]) or "none"
+        print(f"{path}: {report['pages_out']}/{report['pages_in']} pages, "
+              f"{report['bytes_in'] / 1e6:.2f} -> {report['bytes_out'] / 1e6:.2f} MB, "
+              f"{report['images_downsampled']} images downsampled; dropped: {dropped}")
+        if "error" in report:
+            print(f"  WARN: preprocessing failed, original sent: {report['error']}")
+            continue
+        lost = lost_pages(page_texts(PdfReader(io.BytesIO(original))), page_texts(PdfReader(output)))
+        if lost:
+            failed = True
+            print(f"  FAIL: text of page(s) {', '.join(map(str, lost))} is no longer sent")
+
+    if totals["pages_in"]:
+        print(f"\nTotal: {totals['pages_out']}/{totals['pages_in']} pages, "
+              f"{totals['bytes_in'] / 1e6:.2f} -> {totals['bytes_out'] / 1e6:.2f} MB")
+    print("\nFAIL: page text lost" if failed else "\nOK: no page text lost")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
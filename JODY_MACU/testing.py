@@ -1,19 +1,305 @@
 import streamlit as st
 import os
+import sys
 import json
-import pandas as pd
-import base64
-import anthropic
+import importlib
 import re
-from io import BytesIO
 import io
+import uuid
+import atexit
 import shutil
+import binascii
+import threading
+import contextvars
 import tempfile
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload
-from googleapiclient.http import MediaFileUpload
+import time
+import hashlib
+import sqlite3
+from datetime import datetime, timezone
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager, nullcontext
+import difflib
 SCOPES = ["https://www.googleapis.com/auth/drive"]
+READONLY_SCOPES = [
+    'https://www.googleapis.com/auth/spreadsheets.readonly',
+    'https://www.googleapis.com/auth/drive.readonly'
+]
+
+class _LazyModule:
+    """Stand-in for a heavy module that is only imported on first attribute access.
+
+    Keeps the password screen free of the pandas / Anthropic stacks; the real
+    module is cached in sys.modules after the first touch, so later lookups
+    are a plain getattr.
+    """
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = sys.modules.get(self._name) or importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+# st.fragment is Streamlit >= 1.37; older releases only have the experimental name
+fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None) or (lambda func: func)
+
+pd = _LazyModule("pandas")
+np = _LazyModule("numpy")
+anthropic = _LazyModule("anthropic")
+
+def _service_account_credentials(scopes):
+    """Build service account credentials for the given scopes (loads google-auth lazily)."""
+    from google.oauth2 import service_account
+    return service_account.Credentials.from_service_account_info(
+        st.secrets["gcp_service_account"], scopes=scopes
+    )
+
+# Public API hosts that the optional ``google_api_endpoint`` secret replaces
+GOOGLE_API_HOSTS = ("https://sheets.googleapis.com", "https://www.googleapis.com")
+
+def _endpoint_session(credentials, endpoint):
+    """Authorized requests session that sends Google API calls to ``endpoint`` instead."""
+    from google.auth.transport.requests import AuthorizedSession
+    endpoint = endpoint.rstrip("/")
+    
+    class EndpointSession(AuthorizedSession):
+        def request(self, method, url, *args, **kwargs):
+            for host in GOOGLE_API_HOSTS:
+                if url.startswith(host):
+                    url = endpoint + url[len(host):]
+                    break
+            return super().request(method, url, *args, **kwargs)
+    return EndpointSession(credentials)
+
+def _gspread_client(scopes):
+    """Authorize a gspread client for the given scopes."""
+    import gspread
+    credentials = _service_account_credentials(scopes)
+    # Private API endpoint or local stand-in (see load_test.py)
+    endpoint = st.secrets.get("google_api_endpoint")
+    if endpoint:
+        return gspread.Client(credentials, session=_endpoint_session(credentials, endpoint))
+    return gspread.authorize(credentials)
+
+@st.cache_resource(show_spinner=False)
+def _drive_discovery_document():
+    """Parsed Drive v3 discovery document, loaded once per process from the copy
+    bundled with google-api-python-client instead of being fetched per upload."""
+    from googleapiclient import discovery_cache
+    document = discovery_cache.get_static_doc("drive", "v3")
+    if document is None:
+        raise RuntimeError("Bundled Drive v3 discovery document not found; upgrade google-api-python-client")
+    return json.loads(document)
+
+def _drive_service(scopes):
+    """Build a Drive v3 client from the cached static discovery document."""
+    from googleapiclient.discovery import build_from_document
+    document = _drive_discovery_document()
+    endpoint = st.secrets.get("google_api_endpoint")
+    if endpoint:
+        # rootUrl also drives the media upload URL, which client_options.api_endpoint doesn't cover
+        document = dict(document, rootUrl=endpoint.rstrip("/") + "/")
+    return build_from_document(document, credentials=_service_account_credentials(scopes))
+
+# Session artifact limits: uploaded PDFs and results live in one process-wide
+# store; session state only keeps handles into it.
+ARTIFACT_MEMORY_BUDGET = 64 * 1024 * 1024      # bytes kept in RAM across all sessions
+ARTIFACT_SPILL_THRESHOLD = 4 * 1024 * 1024     # single artifacts larger than this go straight to disk
+ARTIFACT_TOTAL_BUDGET = 2 * 1024 * 1024 * 1024 # memory + spilled bytes before LRU eviction
+ARTIFACT_MAX_AGE = 4 * 60 * 60                 # seconds an untouched artifact is kept
+ARTIFACT_CHUNK_SIZE = 3 * 256 * 1024           # multiple of 3 so base64 chunks concatenate cleanly
+
+class ArtifactStore:
+    """Size-bounded, thread-safe store for per-session artifacts.
+
+    Small artifacts are held in memory; large ones, and the least recently used
+    ones once the memory budget is exceeded, are spilled to temp files. Entries
+    not read for ``max_age`` and, past ``total_budget``, the least recently
+    used entries are evicted. Lookups of an evicted handle return None. A single
+    artifact larger than ``total_budget`` is rejected with ValueError rather
+    than evicting everything else to make room for it.
+    """
+    def __init__(self, memory_budget=ARTIFACT_MEMORY_BUDGET, spill_threshold=ARTIFACT_SPILL_THRESHOLD,
+                 total_budget=ARTIFACT_TOTAL_BUDGET, max_age=ARTIFACT_MAX_AGE, spill_dir=None):
+        self.memory_budget = memory_budget
+        self.spill_threshold = spill_threshold
+        self.total_budget = total_budget
+        self.max_age = max_age
+        self.spill_dir = spill_dir or tempfile.mkdtemp(prefix="transcript_artifacts_")
+        self._entries = OrderedDict()  # handle -> entry dict, least recently used first
+        self._memory_bytes = 0
+        self._disk_bytes = 0
+        self._lock = threading.RLock()
+        atexit.register(shutil.rmtree, self.spill_dir, ignore_errors=True)
+
+    def put_bytes(self, data, kind=""):
+        """Store a bytes-like object and return its handle."""
+        return self.put_stream(io.BytesIO(data), kind=kind)
+
+    def put_json(self, obj, kind="json"):
+        return self.put_bytes(json.dumps(obj).encode("utf-8"), kind=kind)
+
+    def put_stream(self, stream, kind=""):
+        """Copy a binary stream into the store in chunks and return its handle.
+
+        Raises ValueError if the stream alone is larger than ``total_budget``.
+        """
+        handle = uuid.uuid4().hex
+        stream.seek(0, os.SEEK_END)
+        size = stream.tell()
+        stream.seek(0)
+        if size > self.total_budget:
+            raise ValueError(
+                f"Artifact of {size} bytes exceeds the {self.total_budget}-byte artifact storage budget"
+            )
+        entry = {"kind": kind, "size": size, "data": None, "path": None,
+                 "created": time.time(), "accessed": time.time()}
+        if size > self.spill_threshold:
+            entry["path"] = self._spill_path(handle)
+            with open(entry["path"], "wb") as out:
+                shutil.copyfileobj(stream, out, ARTIFACT_CHUNK_SIZE)
+        else:
+            entry["data"] = stream.read()
+        with self._lock:
+            self._entries[handle] = entry
+            if entry["path"]:
+                self._disk_bytes += size
+            else:
+                self._memory_bytes += size
+            self._enforce_budgets(keep=handle)
+        return handle
+
+    def open(self, handle):
+        """Return a readable binary file object for the artifact, or None if it was evicted."""
+        with self._lock:
+            entry = self._touch(handle)
+            if entry is None:
+                return None
+            if entry["data"] is not None:
+                return io.BytesIO(entry["data"])
+            path = entry["path"]
+        try:
+            return open(path, "rb")
+        except FileNotFoundError:
+            # Evicted by another session between the lookup and the open
+            return None
+
+    def get_bytes(self, handle):
+        stream = self.open(handle)
+        if stream is None:
+            return None
+        with stream:
+            return stream.read()
+
+    def get_json(self, handle):
+        data = self.get_bytes(handle)
+        return json.loads(data) if data is not None else None
+
+    def size(self, handle):
+        with self._lock:
+            entry = self._entries.get(handle)
+            return entry["size"] if entry else None
+
+    def discard(self, handle):
+        with self._lock:
+            entry = self._entries.pop(handle, None)
+            if entry is not None:
+                self._release(entry)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "memory_bytes": self._memory_bytes,
+                "disk_bytes": self._disk_bytes,
+            }
+
+    def _spill_path(self, handle):
+        return os.path.join(self.spill_dir, f"{handle}.bin")
+
+    def _touch(self, handle):
+        entry = self._entries.get(handle)
+        if entry is None:
+            return None
+        if time.time() - entry["accessed"] > self.max_age:
+            self.discard(handle)
+            return None
+        entry["accessed"] = time.time()
+        self._entries.move_to_end(handle)
+        return entry
+
+    def _release(self, entry):
+        if entry["path"]:
+            self._disk_bytes -= entry["size"]
+            try:
+                os.remove(entry["path"])
+            except OSError:
+                pass
+        else:
+            self._memory_bytes -= entry["size"]
+
+    def _spill(self, handle, entry):
+        entry["path"] = self._spill_path(handle)
+        with open(entry["path"], "wb") as out:
+            out.write(entry["data"])
+        entry["data"] = None
+        self._memory_bytes -= entry["size"]
+        self._disk_bytes += entry["size"]
+
+    def _enforce_budgets(self, keep=None):
+        now = time.time()
+        for handle, entry in list(self._entries.items()):
+            if now - entry["accessed"] > self.max_age and handle != keep:
+                self.discard(handle)
+        # Spill least recently used in-memory entries until RAM fits the budget
+        for handle, entry in list(self._entries.items()):
+            if self._memory_bytes <= self.memory_budget:
+                break
+            if entry["data"] is not None:
+                self._spill(handle, entry)
+        # Evict least recently used entries until everything fits the total budget
+        for handle in list(self._entries):
+            if self._memory_bytes + self._disk_bytes <= self.total_budget:
+                break
+            if handle != keep:
+                self.discard(handle)
+
+@st.cache_resource(show_spinner=False)
+def get_artifact_store():
+    """The process-wide artifact store shared by every session."""
+    return ArtifactStore()
+
+def base64_encode_stream(stream, chunk_size=ARTIFACT_CHUNK_SIZE):
+    """Base64-encode a binary stream into a single preallocated buffer.
+
+    Reads through one reusable chunk buffer, so the only full-size copies are
+    the encoded buffer and the final ASCII string handed to the API client.
+    """
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    encoded = bytearray(4 * ((size + 2) // 3))
+    chunk = bytearray(chunk_size)
+    chunk_view = memoryview(chunk)
+    position = 0
+    while True:
+        # Fill the whole chunk so every encoded piece except the last is padding-free
+        filled = 0
+        while filled < chunk_size:
+            read = stream.readinto(chunk_view[filled:])
+            if not read:
+                break
+            filled += read
+        if not filled:
+            break
+        piece = binascii.b2a_base64(chunk_view[:filled], newline=False)
+        encoded[position:position + len(piece)] = piece
+        position += len(piece)
+        if filled < chunk_size:
+            break
+    return encoded.decode("ascii")
+
 def check_password():
     """Returns True if the user entered the correct password."""
     def password_entered():
@@ -58,9 +344,58 @@ def grade_to_points(grade):
         
     return base_value
 
-def analyze_pdf(pdf_data_bytes, user_prompt: str):
+# Where pipeline errors and warnings go: None shows them on the page, a
+# {"errors": [...], "warnings": [...]} dict set by collect_messages() gathers them
+_pipeline_messages = contextvars.ContextVar("pipeline_messages", default=None)
+
+@contextmanager
+def collect_messages():
+    """Gather pipeline errors and warnings raised in this block instead of showing them; yields the dict."""
+    messages = {"errors": [], "warnings": []}
+    token = _pipeline_messages.set(messages)
+    try:
+        yield messages
+    finally:
+        _pipeline_messages.reset(token)
+
+def report_error(message):
+    messages = _pipeline_messages.get()
+    if messages is None:
+        st.error(message)
+    else:
+        messages["errors"].append(str(message))
+
+def report_warning(message):
+    messages = _pipeline_messages.get()
+    if messages is None:
+        st.warning(message)
+    else:
+        messages["warnings"].append(str(message))
+
+# Model tiers for routing; prices are USD per million tokens
+MODEL_TIERS = {
+    "fast": {
+        "model": "claude-3-5-haiku-latest",
+        "input": 0.80, "cache_write": 1.00, "cache_read": 0.08, "output": 4.00,
+    },
+    "full": {
+        "model": "claude-3-7-sonnet-latest",
+        "input": 3.00, "cache_write": 3.75, "cache_read": 0.30, "output": 15.00,
+    },
+}
+DEFAULT_MAX_TOKENS = 8000
+
+def analyze_pdf(pdf_data_bytes, user_prompt: str, tier="full", max_tokens=DEFAULT_MAX_TOKENS):
+    """Send a PDF (bytes or a binary file object) to Claude with the given prompt.
+
+    Returns (response_text, usage) where usage is a dict with the model, token
+    counts, cost breakdown and stop reason; (None, None) on API errors.
+    """
     client = anthropic.Anthropic(api_key=st.secrets["anthropic_api_key"])
-    pdf_data = base64.b64encode(pdf_data_bytes).decode("utf-8")
+    if isinstance(pdf_data_bytes, (bytes, bytearray, memoryview)):
+        pdf_data_bytes = io.BytesIO(pdf_data_bytes)
+    pdf_data = base64_encode_stream(pdf_data_bytes)
+    pricing = MODEL_TIERS[tier]
     messages_payload = [
         {
             "role": "user",
@@ -84,77 +419,794 @@ def analyze_pdf(pdf_data_bytes, user_prompt: str):
     try:
         with st.spinner("Analyzing transcript... This may take a moment."):
             message = client.messages.create(
-                model="claude-3-7-sonnet-latest",
-                max_tokens=8000,
+                model=pricing["model"],
+                max_tokens=max_tokens,
                 messages=messages_payload
             )
 
-        # Calculate and display token usage
-        cache_creation_input_tokens = message.usage.cache_creation_input_tokens
-        cache_read_input_tokens = message.usage.cache_read_input_tokens
+        # Calculate token usage
+        cache_creation_input_tokens = message.usage.cache_creation_input_tokens or 0
+        cache_read_input_tokens = message.usage.cache_read_input_tokens or 0
         input_tokens = message.usage.input_tokens
         output_tokens = message.usage.output_tokens
         # Calculate pricing based on tokens usage (price per million tokens)
-        base_input_cost = input_tokens * 3.00 / 1e6
-        cache_writes_cost = cache_creation_input_tokens * 3.75 / 1e6
-        cache_hits_cost = cache_read_input_tokens * 0.30 / 1e6
-        output_cost = output_tokens * 15.00 / 1e6
-        total_cost = base_input_cost + cache_writes_cost + cache_hits_cost + output_cost
-
-        # Create token usage message for display in an expander
-        token_usage = f"""
-        **Tokens Used:** {input_tokens + output_tokens}
-        
-        **Pricing Breakdown:**
-        - Base Input Cost: ${base_input_cost:.6f}
-        - Cache Writes Cost: ${cache_writes_cost:.6f}
-        - Cache Hits Cost: ${cache_hits_cost:.6f}
-        - Output Cost: ${output_cost:.6f}
-        - **Total Cost:** ${total_cost:.6f}
-        """
+        base_input_cost = input_tokens * pricing["input"] / 1e6
+        cache_writes_cost = cache_creation_input_tokens * pricing["cache_write"] / 1e6
+        cache_hits_cost = cache_read_input_tokens * pricing["cache_read"] / 1e6
+        output_cost = output_tokens * pricing["output"] / 1e6
+        usage = {
+            "tier": tier,
+            "model": pricing["model"],
+            "max_tokens": max_tokens,
+            "stop_reason": message.stop_reason,
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "cache_creation_input_tokens": cache_creation_input_tokens,
+            "cache_read_input_tokens": cache_read_input_tokens,
+            "base_input_cost": base_input_cost,
+            "cache_writes_cost": cache_writes_cost,
+            "cache_hits_cost": cache_hits_cost,
+            "output_cost": output_cost,
+            "total_cost": base_input_cost + cache_writes_cost + cache_hits_cost + output_cost,
+        }
 
-        return message.content[0].text, token_usage
+        return message.content[0].text, usage
     
     except anthropic.APIStatusError as e:
         # Handle specific HTTP status codes
         if e.status_code == 529:
-            st.error("⚠️ Claude is currently experiencing high demand. Please try again in a few minutes.")
+            report_error("⚠️ Claude is currently experiencing high demand. Please try again in a few minutes.")
         elif e.status_code == 429:
-            st.error("⚠️ API rate limit exceeded. Please wait a moment before trying again.")
+            report_error("⚠️ API rate limit exceeded. Please wait a moment before trying again.")
         elif e.status_code >= 500:
-            st.error("⚠️ Claude service is temporarily unavailable. Please try again later.")
+            report_error("⚠️ Claude service is temporarily unavailable. Please try again later.")
         else:
-            st.error(f"⚠️ API Error: {str(e)}")
+            report_error(f"⚠️ API Error: {str(e)}")
         return None, None
         
     except anthropic.APIConnectionError:
-        st.error("⚠️ Connection to Claude API failed. Please check your internet connection and try again.")
+        report_error("⚠️ Connection to Claude API failed. Please check your internet connection and try again.")
         return None, None
         
     except anthropic.APITimeoutError:
-        st.error("⚠️ The request to Claude timed out. This PDF may be too complex or the service is busy. Please try again later.")
+        report_error("⚠️ The request to Claude timed out. This PDF may be too complex or the service is busy. Please try again later.")
         return None, None
         
     except anthropic.AuthenticationError:
-        st.error("⚠️ Authentication to Claude API failed. Please contact the administrator to check API credentials.")
+        report_error("⚠️ Authentication to Claude API failed. Please contact the administrator to check API credentials.")
         return None, None
         
     except Exception as e:
-        st.error(f"⚠️ An unexpected error occurred: {str(e)}")
+        report_error(f"⚠️ An unexpected error occurred: {str(e)}")
         return None, None
 
-def extract_json(text):
+def extract_json(text, report_errors=True):
     match = re.search(r'```json\n(.*?)\n```', text, re.DOTALL)
     if match:
         json_str = match.group(1).strip()
         try:
             return json.loads(json_str)
         except json.JSONDecodeError:
-            st.error("Failed to parse JSON output from Claude.")
+            if report_errors:
+                report_error("Failed to parse JSON output from Claude.")
             return None
-    st.error("Could not find JSON data in Claude's response.")
+    if report_errors:
+        report_error("Could not find JSON data in Claude's response.")
+    return None
+
+# Grades that legitimately carry no grade points (grade_to_points returns None)
+NON_POINT_GRADES = {"P", "S", "U", "W", "WP", "WF", "I", "IP", "CR", "NC", "AU", "NR", "Z", "X", "T", "TR", "N"}
+REQUIRED_COURSE_FIELDS = ["course_code", "title", "credits", "grade"]
+
+def grade_is_valid(grade):
+    """True for empty grades, letter grades grade_to_points understands and known non-point grades."""
+    grade = str(grade or "").upper().strip()
+    if not grade:
+        return True
+    if grade in NON_POINT_GRADES:
+        return True
+    return grade_to_points(grade) is not None and grade[1:] in ("", "+", "-")
+
+POINTS_TOLERANCE = 0.05  # share of points by which credits x grade value may miss them (at least 0.1)
+
+def _term_problems(term):
+    """(course index or None, problem) pairs for one extracted term; the index is None for term-level problems."""
+    if not isinstance(term, dict):
+        return [(None, "not an object")]
+    problems = [(None, f"missing '{field}'") for field in ("term", "year", "courses") if field not in term]
+    if not re.fullmatch(r"\d{4}", str(term.get("year", ""))):
+        problems.append((None, "year is not 4 digits"))
+    courses = term.get("courses", [])
+    if not isinstance(courses, list):
+        return problems + [(None, "courses is not a list")]
+    if not courses and "courses" in term:
+        problems.append((None, "no courses"))
+    for course_index, course in enumerate(courses):
+        if not isinstance(course, dict):
+            problems.append((course_index, "not an object"))
+            continue
+        missing = [field for field in REQUIRED_COURSE_FIELDS if field not in course]
+        if missing:
+            problems.append((course_index, f"missing {', '.join(missing)}"))
+        grade = str(course.get("grade") or "").upper().strip()
+        if not grade_is_valid(grade):
+            problems.append((course_index, f"unparseable grade '{course.get('grade')}'"))
+            continue
+        credits, points = _export_number(course.get("credits")), _export_number(course.get("points"))
+        value = grade_to_points(grade) if grade and grade not in NON_POINT_GRADES else None
+        if credits is not None and points is not None and value is not None:
+            # A+ counts as 4.3 at some schools
+            values = (value, 4.3) if grade == "A+" else (value,)
+            if all(abs(credits * grade_value - points) > max(0.1, POINTS_TOLERANCE * points) for grade_value in values):
+                problems.append((course_index, f"{credits:g} credits of {grade} don't give {points:g} points"))
+    return problems
+
+def score_term(term):
+    """(score, problems) for one term; the score is the share of sound courses, 0 for term-level problems."""
+    problems = _term_problems(term)
+    if any(course_index is None for course_index, _ in problems):
+        return 0.0, problems
+    courses = term["courses"]
+    return 1.0 - len({course_index for course_index, _ in problems}) / max(len(courses), 1), problems
+
+def validate_transcript_structure(json_data):
+    """Return a list of structural problems in an extraction (empty when it looks sound)."""
+    if not isinstance(json_data, list) or not json_data:
+        return ["extraction is not a non-empty list of terms"]
+    issues = []
+    for term_index, term in enumerate(json_data):
+        label = f"term {term_index}"
+        if isinstance(term, dict):
+            label += f" ({term.get('term', '?')} {term.get('year', '?')})"
+        for course_index, problem in _term_problems(term):
+            issues.append(f"{label}: {problem}" if course_index is None else f"{label} course {course_index}: {problem}")
+    return issues
+
+# Local PDF preprocessing before the model call
+PDF_TARGET_DPI = 150  # embedded page images above this resolution are downsampled; 0 disables
+PDF_JPEG_QUALITY = 80
+BLANK_PAGE_INK_RATIO = 0.001  # share of non-white pixels below which an image-only page counts as blank
+BLANK_PAGE_MAX_CONTENT_BYTES = 200  # a page with no text or XObjects and less drawing than this is blank
+BLANK_PAGE_MARKERS = ("intentionally left blank", "this page left blank")
+EXPLANATION_PAGE_MARKERS = ("transcript explanation", "explanation of transcript", "transcript legend",
+                            "key to transcript", "transcript key")
+EXPLANATION_PAGE_SIMILARITY = 0.8  # word-set overlap with the kept explanation page
+PAGE_NUMBER_PATTERN = re.compile(r"\bpage\s*\d+(\s*of\s*\d+)?\b")
+
+def _page_xobjects(page):
+    """XObject streams a page draws directly, keyed by resource name."""
+    resources = page.get("/Resources")
+    xobjects = resources.get_object().get("/XObject") if resources is not None else None
+    if xobjects is None:
+        return {}
+    xobjects = xobjects.get_object()
+    return {name: xobjects[name].get_object() for name in xobjects}
+
+def _stream_filters(stream):
+    filters = stream.get("/Filter")
+    if filters is None:
+        return []
+    filters = filters.get_object()
+    return [filters] if isinstance(filters, str) else list(filters)
+
+def _decode_page_image(stream):
+    """Decode an embedded 8-bit grey/RGB JPEG or Flate image with Pillow; None for anything else."""
+    from PIL import Image
+    if any(key in stream for key in ("/ImageMask", "/SMask", "/Mask", "/Decode")):
+        return None
+    filters = _stream_filters(stream)
+    if filters == ["/DCTDecode"]:
+        image = Image.open(io.BytesIO(stream._data))
+        return image if image.mode in ("L", "RGB") else None
+    if filters in ([], ["/FlateDecode"]) and stream.get("/BitsPerComponent") == 8:
+        color_space = stream.get("/ColorSpace")
+        mode = {"/DeviceGray": "L", "/DeviceRGB": "RGB"}.get(color_space.get_object() if color_space is not None else None)
+        if mode:
+            return Image.frombytes(mode, (int(stream["/Width"]), int(stream["/Height"])), stream.get_data())
     return None
 
+def _normalize_page_text(text):
+    text = re.sub(r"\s+", " ", (text or "").lower()).strip()
+    return PAGE_NUMBER_PATTERN.sub("", text).strip()
+
+def _classify_pages(reader):
+    """Decide which pages to keep; returns (kept page indexes, [{"page", "reason"}] for dropped ones)."""
+    kept, dropped = [], []
+    seen_texts = set()
+    seen_scans = set()
+    explanation_words = None
+    for index, page in enumerate(reader.pages):
+        text = _normalize_page_text(page.extract_text())
+        xobjects = _page_xobjects(page)
+        reason = None
+        if text:
+            words = set(text.split())
+            is_explanation = any(marker in text for marker in EXPLANATION_PAGE_MARKERS)
+            if len(text) < 80 and any(marker in text for marker in BLANK_PAGE_MARKERS):
+                reason = "blank"
+            elif is_explanation and explanation_words is not None and \
+                    len(words & explanation_words) / len(words | explanation_words) >= EXPLANATION_PAGE_SIMILARITY:
+                reason = "explanation"
+            elif text in seen_texts:
+                reason = "duplicate"
+            else:
+                seen_texts.add(text)
+                if is_explanation and explanation_words is None:
+                    explanation_words = words
+        elif not xobjects:
+            content = page.get_contents()
+            if content is None or len(content.get_data()) < BLANK_PAGE_MAX_CONTENT_BYTES:
+                reason = "blank"
+        elif all(stream.get("/Subtype") == "/Image" for stream in xobjects.values()):
+            # Image-only page (a scan): blank judged by its pixels
+            images = [_decode_page_image(stream) for stream in xobjects.values()]
+            if all(image is not None for image in images):
+                inks = []
+                for image in images:
+                    thumbnail = image.convert("L")
+                    thumbnail.thumbnail((1000, 1000))
+                    histogram = thumbnail.histogram()
+                    inks.append(sum(histogram[:200]) / max(sum(histogram), 1))
+                if all(ink < BLANK_PAGE_INK_RATIO for ink in inks):
+                    reason = "blank"
+            if reason is None:
+                # Duplicate only when the page draws byte-identical image data; pixel
+                # comparisons can't tell apart pages of small print, so re-scans are kept
+                content = page.get_contents()
+                digest = hashlib.sha256(b"".join(
+                    [xobjects[name]._data for name in sorted(xobjects)] + [content.get_data() if content is not None else b""]
+                )).hexdigest()
+                if digest in seen_scans:
+                    reason = "duplicate"
+                else:
+                    seen_scans.add(digest)
+        if reason is None:
+            kept.append(index)
+        else:
+            dropped.append({"page": index + 1, "reason": reason})
+    if not kept:
+        # Never send an empty document; let the model see the first page
+        kept, dropped = [0], dropped[1:]
+    return kept, dropped
+
+def _downsample_page_images(page, target_dpi, quality, done):
+    """Re-encode a page's oversized images as JPEG at ``target_dpi``; returns (images downsampled, bytes saved).
+
+    A page image's resolution is taken against the full page size, which is
+    exact for scans and understates it for smaller images, so those are left
+    alone rather than over-compressed.
+    """
+    from PIL import Image
+    from PyPDF2.generic import NameObject, NumberObject
+    page_width_in = float(page.mediabox.width) / 72
+    page_height_in = float(page.mediabox.height) / 72
+    count = saved = 0
+    for stream in _page_xobjects(page).values():
+        if stream.get("/Subtype") != "/Image" or id(stream) in done:
+            continue
+        done.add(id(stream))
+        dpi = max(int(stream["/Width"]) / page_width_in, int(stream["/Height"]) / page_height_in)
+        if dpi <= target_dpi * 1.1:
+            continue
+        image = _decode_page_image(stream)
+        if image is None:
+            continue
+        scale = target_dpi / dpi
+        image = image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))), Image.LANCZOS)
+        output = io.BytesIO()
+        image.save(output, format="JPEG", quality=quality, optimize=True)
+        data = output.getvalue()
+        if len(data) >= len(stream._data):
+            continue
+        saved += len(stream._data) - len(data)
+        count += 1
+        stream._data = data
+        stream.decoded_self = None
+        stream.pop(NameObject("/DecodeParms"), None)
+        stream[NameObject("/Filter")] = NameObject("/DCTDecode")
+        stream[NameObject("/Width")] = NumberObject(image.width)
+        stream[NameObject("/Height")] = NumberObject(image.height)
+        stream[NameObject("/BitsPerComponent")] = NumberObject(8)
+        stream[NameObject("/ColorSpace")] = NameObject("/DeviceGray" if image.mode == "L" else "/DeviceRGB")
+    return count, saved
+
+def preprocess_pdf(pdf_stream, target_dpi=PDF_TARGET_DPI, prune_pages=True, quality=PDF_JPEG_QUALITY):
+    """Shrink a transcript PDF locally before it is sent to the model.
+
+    Drops blank and duplicate pages (keeping the first "Transcript
+    Explanation" page, which the prompt relies on) and downsamples embedded
+    page images above ``target_dpi``. Returns (stream, report); the original
+    stream is returned unchanged when preprocessing fails or saves nothing.
+    """
+    from PyPDF2 import PdfReader, PdfWriter
+    pdf_stream.seek(0)
+    original = pdf_stream.read()
+    pdf_stream.seek(0)
+    report = {"pages_in": 0, "pages_out": 0, "pages_saved": 0, "dropped": [], "images_downsampled": 0,
+              "bytes_in": len(original), "bytes_out": len(original), "bytes_saved": 0, "target_dpi": target_dpi}
+    try:
+        reader = PdfReader(io.BytesIO(original))
+        report["pages_in"] = report["pages_out"] = len(reader.pages)
+        if prune_pages:
+            kept, report["dropped"] = _classify_pages(reader)
+        else:
+            kept = list(range(len(reader.pages)))
+        writer = PdfWriter()
+        for index in kept:
+            writer.add_page(reader.pages[index])
+        if target_dpi:
+            done = set()
+            for page in writer.pages:
+                count, _ = _downsample_page_images(page, target_dpi, quality, done)
+                report["images_downsampled"] += count
+        output = io.BytesIO()
+        writer.write(output)
+    except Exception as e:
+        report["error"] = str(e)
+        return pdf_stream, report
+    if output.tell() >= len(original) and not report["dropped"]:
+        return pdf_stream, report
+    output.seek(0)
+    report["pages_out"] = len(kept)
+    report["pages_saved"] = report["pages_in"] - len(kept)
+    report["bytes_out"] = output.getbuffer().nbytes
+    report["bytes_saved"] = len(original) - report["bytes_out"]
+    return output, report
+
+# Routing thresholds for the fast tier
+FAST_TIER_MAX_PAGES = 3
+FAST_TIER_MAX_OUTPUT_TOKENS = 3000
+MIN_TEXT_CHARS_PER_PAGE = 200  # below this a page is treated as scanned (no usable text layer)
+
+def estimate_transcript_size(pdf_stream):
+    """Preflight estimate of a transcript's size from its page count and text layer."""
+    from PyPDF2 import PdfReader
+    pdf_stream.seek(0)
+    estimate = {"pages": 0, "text_chars": 0, "text_pages": 0}
+    try:
+        reader = PdfReader(pdf_stream)
+        estimate["pages"] = len(reader.pages)
+        for page in reader.pages:
+            text = page.extract_text() or ""
+            estimate["text_chars"] += len(text)
+            if len(text.strip()) >= MIN_TEXT_CHARS_PER_PAGE:
+                estimate["text_pages"] += 1
+    except Exception as e:
+        estimate["error"] = str(e)
+    finally:
+        pdf_stream.seek(0)
+    
+    pages = max(estimate["pages"], 1)
+    estimate["has_text_layer"] = estimate["pages"] > 0 and estimate["text_pages"] == estimate["pages"]
+    # Each PDF page is sent as an image plus its text (~1,500 tokens per page image)
+    estimate["est_input_tokens"] = pages * 1500 + estimate["text_chars"] // 4
+    if estimate["has_text_layer"]:
+        # Roughly one course per ~80 characters of transcript text, ~60 output tokens per course
+        estimate["est_output_tokens"] = 300 + (estimate["text_chars"] // 80) * 60
+    else:
+        estimate["est_output_tokens"] = 300 + pages * 1200
+    return estimate
+
+def size_max_tokens(estimate):
+    """Output budget for the estimate: 50% headroom, clamped to [2048, DEFAULT_MAX_TOKENS]."""
+    return int(min(max(estimate["est_output_tokens"] * 1.5, 2048), DEFAULT_MAX_TOKENS))
+
+def route_transcript(estimate):
+    """Pick a model tier for a transcript; returns (tier, reason)."""
+    if "error" in estimate:
+        return "full", "could not read PDF for preflight"
+    if not estimate["has_text_layer"]:
+        return "full", "scanned or partially scanned PDF"
+    if estimate["pages"] > FAST_TIER_MAX_PAGES:
+        return "full", f"{estimate['pages']} pages (> {FAST_TIER_MAX_PAGES})"
+    if estimate["est_output_tokens"] > FAST_TIER_MAX_OUTPUT_TOKENS:
+        return "full", f"~{estimate['est_output_tokens']} output tokens expected"
+    return "fast", f"{estimate['pages']} page(s) with a clean text layer"
+
+class RoutingStats:
+    """Process-wide counters of routing decisions and escalations."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.routed = {tier: 0 for tier in MODEL_TIERS}
+        self.escalations = 0
+
+    def record(self, tier, escalated):
+        with self._lock:
+            self.routed[tier] += 1
+            if escalated:
+                self.escalations += 1
+
+    def snapshot(self):
+        with self._lock:
+            fast = self.routed.get("fast", 0)
+            return {
+                "routed": dict(self.routed),
+                "escalations": self.escalations,
+                "escalation_rate": self.escalations / fast if fast else 0.0,
+            }
+
+@st.cache_resource(show_spinner=False)
+def get_routing_stats():
+    return RoutingStats()
+
+# Term-level validation and targeted re-extraction
+MAX_REPAIR_PASSES = 2  # follow-up requests for terms that still fail validation
+MAX_REPAIR_TERMS = 6   # failing terms (lowest scores first) re-extracted per pass
+REPAIR_PROMPT_NOTE = """
+## **Targeted Re-extraction**
+A previous extraction of this transcript had problems in the term(s) listed below. These pages are the part of the
+transcript that holds them (plus its explanation page, if it has one). Extract ONLY these terms, carefully, using the
+same rules and output format as above:
+{targets}
+"""
+CONTINUATION_PROMPT_NOTE = """
+## **Continuation**
+A previous extraction stopped after the {last_term} term. These pages hold the rest of the transcript. Extract ONLY the
+terms that come after {last_term}, using the same rules and output format as above.
+"""
+
+def salvage_terms(text):
+    """Complete term objects from a response whose JSON array is cut off or malformed further on."""
+    start = text.find("```json")
+    body = text[start + len("```json"):] if start >= 0 else text
+    position = body.find("[")
+    if position < 0:
+        return []
+    decoder = json.JSONDecoder()
+    separator = re.compile(r"\s*,?\s*")
+    terms = []
+    position += 1
+    while True:
+        position = separator.match(body, position).end()
+        if body[position:position + 1] != "{":
+            break
+        try:
+            term, position = decoder.raw_decode(body, position)
+        except json.JSONDecodeError:
+            break
+        terms.append(term)
+    return terms
+
+def parse_extraction(text):
+    """(terms, complete) from a model response; terms is None when no term could be read at all."""
+    json_data = extract_json(text, report_errors=False)
+    if isinstance(json_data, list):
+        return json_data, True
+    return salvage_terms(text) or None, False
+
+def _term_label(term):
+    return f"{term.get('term', '?')} {term.get('year', '?')}" if isinstance(term, dict) else "?"
+
+def _term_course_codes(term):
+    courses = term.get("courses") if isinstance(term, dict) else None
+    if not isinstance(courses, list):
+        return set()
+    return {normalize_course_text(course.get("course_code", "")) for course in courses
+            if isinstance(course, dict) and course.get("course_code")}
+
+def _compact_page_texts(pdf_stream):
+    """Lower-cased page texts with everything but letters and digits removed; empty when unreadable."""
+    from PyPDF2 import PdfReader
+    pdf_stream.seek(0)
+    try:
+        return [re.sub(r"[^a-z0-9]", "", (page.extract_text() or "").lower()) for page in PdfReader(pdf_stream).pages]
+    except Exception:
+        return []
+    finally:
+        pdf_stream.seek(0)
+
+def _term_pages(page_texts, term):
+    """0-based pages holding a term, found through its heading and course codes; None when it can't be located.
+
+    The term runs from the first to the last page that carry its heading or
+    at least half as many of its course codes as the best page, so a course
+    repeated in another term doesn't stretch the range.
+    """
+    if not isinstance(term, dict) or not page_texts or not any(page_texts):
+        return None
+    name = re.sub(r"[^a-z0-9]", "", str(term.get("term", "")).lower())
+    year = re.sub(r"[^0-9]", "", str(term.get("year", "")))
+    heading = None
+    if name and len(year) == 4:
+        heading = re.compile(f"{name}[a-z]{{0,12}}{year}|{year}[a-z]{{0,12}}{name}")
+    codes = {re.sub(r"[^a-z0-9]", "", code) for code in _term_course_codes(term)} - {""}
+    hits = [sum(code in text for code in codes) for text in page_texts]
+    threshold = max(1, max(hits) / 2)
+    pages = [index for index, text in enumerate(page_texts)
+             if hits[index] >= threshold or heading is not None and heading.search(text)]
+    return list(range(pages[0], pages[-1] + 1)) if pages else None
+
+def _explanation_page(page_texts):
+    markers = [re.sub(r"[^a-z0-9]", "", marker) for marker in EXPLANATION_PAGE_MARKERS]
+    return next((index for index, text in enumerate(page_texts) if any(marker in text for marker in markers)), None)
+
+def _repair_pages(page_texts, terms, to_end=False):
+    """Sorted 0-based pages to send for the given terms plus the explanation page; None for the whole document."""
+    pages = set()
+    for term in terms:
+        term_pages = _term_pages(page_texts, term)
+        if term_pages is None:
+            return None
+        pages.update(range(term_pages[0], len(page_texts)) if to_end else term_pages)
+    explanation = _explanation_page(page_texts)
+    if explanation is not None:
+        pages.add(explanation)
+    return None if len(pages) >= len(page_texts) else sorted(pages)
+
+def _reextract(pdf_stream, pages, prompt, max_tokens, calls):
+    """Run the full model over some pages of a transcript; returns (terms it read, None) or (None, error).
+
+    The main extraction already succeeded, so a failed follow-up call is
+    only reported back to be recorded, never shown on the page.
+    """
+    source = select_pdf_pages(pdf_stream, pages) if pages is not None else pdf_stream
+    source.seek(0)
+    with collect_messages() as messages:
+        response, usage = analyze_pdf(source, prompt, tier="full", max_tokens=max_tokens)
+    pdf_stream.seek(0)
+    if response is None:
+        return None, "; ".join(messages["errors"]) or "model call failed"
+    calls.append(usage)
+    terms, _ = parse_extraction(response)
+    return [term for term in terms or [] if isinstance(term, dict)], None
+
+def _matching_term(term, candidates):
+    """The candidate that is the same term: same term and year, else the most shared course codes."""
+    key = _term_key(term) if isinstance(term, dict) else ("", "")
+    if all(key):
+        match = next((candidate for candidate in candidates if _term_key(candidate) == key), None)
+        if match is not None:
+            return match
+    codes = _term_course_codes(term)
+    best = max(candidates, key=lambda candidate: len(codes & _term_course_codes(candidate)), default=None)
+    return best if best is not None and codes & _term_course_codes(best) else None
+
+def _repaired_fields(old, new):
+    """Readable list of the fields a re-extraction changed, with courses matched by course code."""
+    old = old if isinstance(old, dict) else {}
+    changes = [f"{field}: {old.get(field)!r} -> {new.get(field)!r}"
+               for field in ("term", "year") if old.get(field) != new.get(field)]
+    old_courses = {}
+    for course in old.get("courses") if isinstance(old.get("courses"), list) else []:
+        if isinstance(course, dict):
+            old_courses.setdefault(normalize_course_text(course.get("course_code", "")), []).append(course)
+    for course in new.get("courses", []):
+        code = normalize_course_text(course.get("course_code", ""))
+        previous = old_courses.get(code)
+        if not previous:
+            changes.append(f"added {course.get('course_code', '?')}")
+            continue
+        before = previous.pop(0)
+        for field in REQUIRED_COURSE_FIELDS[1:] + ["points", "division"]:
+            if before.get(field) != course.get(field):
+                changes.append(f"{course.get('course_code')} {field}: {before.get(field)!r} -> {course.get(field)!r}")
+    changes += [f"removed {course.get('course_code', '?')}" for courses in old_courses.values() for course in courses]
+    return changes
+
+def _repair_is_better(old, candidate):
+    """Whether a re-extracted term should replace the stored one.
+
+    It must have fewer problems and no lower score, and, unless the old term
+    was structurally invalid, list every course code the old term listed, so
+    a repair can't silently drop courses.
+    """
+    old_score, old_problems = score_term(old)
+    new_score, new_problems = score_term(candidate)
+    if len(new_problems) >= len(old_problems) or new_score < old_score:
+        return False
+    structurally_invalid = any(course_index is None for course_index, _ in old_problems)
+    return structurally_invalid or _term_course_codes(old) <= _term_course_codes(candidate)
+
+def validate_and_repair(pdf_stream, json_data, prompt, calls, complete=True):
+    """Score each extracted term and re-extract only what failed.
+
+    A response cut off partway (``complete`` False) is continued from the last
+    term it holds. Terms that fail validation are then re-extracted from just
+    their pages, up to MAX_REPAIR_PASSES times, and each one is replaced in
+    place when the new version is better (see _repair_is_better). Follow-up
+    calls are added to ``calls``. Returns (json_data, validation) where
+    validation records the passes, per-term scores and the fields each repair
+    changed.
+    """
+    validation = {"passes": 1, "repairs": []}
+    page_texts = None
+    
+    if not complete:
+        page_texts = _compact_page_texts(pdf_stream)
+        last = json_data[-1]
+        pages = _repair_pages(page_texts, [last], to_end=True)
+        note = CONTINUATION_PROMPT_NOTE.format(last_term=_term_label(last))
+        terms, error = _reextract(pdf_stream, pages, prompt + note, DEFAULT_MAX_TOKENS, calls)
+        validation["passes"] += 1
+        known = {_term_key(term) for term in json_data if isinstance(term, dict)}
+        added = [term for term in terms or [] if _term_key(term) not in known]
+        json_data.extend(added)
+        validation["repairs"].append({
+            "pass": validation["passes"],
+            "kind": "continuation",
+            "after": _term_label(last),
+            "pages": [index + 1 for index in pages] if pages is not None else "all",
+            "terms": [_term_label(term) for term in added],
+            "status": "failed" if terms is None else "added" if added else "no new terms",
+        })
+        if error:
+            validation["repairs"][-1]["error"] = error
+    
+    initial_scores = [score_term(term)[0] for term in json_data]
+    given_up = set()
+    for _ in range(MAX_REPAIR_PASSES):
+        scores = {index: score for index, (score, problems) in enumerate(map(score_term, json_data))
+                  if problems and index not in given_up}
+        if not scores:
+            break
+        failing = sorted(sorted(scores, key=scores.get)[:MAX_REPAIR_TERMS])
+        if page_texts is None:
+            page_texts = _compact_page_texts(pdf_stream)
+        targets = "\n".join(
+            f"- {_term_label(json_data[index])}: "
+            + "; ".join(problem if course_index is None else f"course {course_index}: {problem}"
+                        for course_index, problem in _term_problems(json_data[index])[:5])
+            for index in failing
+        )
+        pages = _repair_pages(page_texts, [json_data[index] for index in failing])
+        course_count = sum(len(json_data[index].get("courses") or []) if isinstance(json_data[index], dict) else 0
+                           for index in failing)
+        terms, error = _reextract(pdf_stream, pages, prompt + REPAIR_PROMPT_NOTE.format(targets=targets),
+                                  size_max_tokens({"est_output_tokens": 300 + course_count * 60}), calls)
+        validation["passes"] += 1
+        repair = {
+            "pass": validation["passes"],
+            "kind": "terms",
+            "terms": [_term_label(json_data[index]) for index in failing],
+            "pages": [index + 1 for index in pages] if pages is not None else "all",
+            "repaired_fields": {},
+        }
+        for index in failing:
+            old = json_data[index]
+            candidate = _matching_term(old, terms or [])
+            if candidate is None or not _repair_is_better(old, candidate):
+                given_up.add(index)
+                continue
+            if isinstance(old, dict) and old.get("institution") and not candidate.get("institution"):
+                candidate["institution"] = old["institution"]
+            repair["repaired_fields"][_term_label(candidate)] = _repaired_fields(old, candidate)
+            json_data[index] = candidate
+        repair["status"] = "failed" if terms is None else "repaired" if repair["repaired_fields"] else "no improvement"
+        if error:
+            repair["error"] = error
+        validation["repairs"].append(repair)
+        if terms is None:
+            break
+    
+    validation["terms"] = []
+    for index, term in enumerate(json_data):
+        score, problems = score_term(term)
+        validation["terms"].append({
+            "term": _term_label(term),
+            "score": round(score, 2),
+            "initial_score": round(initial_scores[index], 2),
+            "issues": [problem if course_index is None else f"course {course_index}: {problem}"
+                       for course_index, problem in problems][:10],
+        })
+    return json_data, validation
+
+def extract_transcript(pdf_stream, prompt):
+    """Route a transcript to a model tier, then validate it term by term.
+
+    The fast tier escalates to the full model only when its response holds
+    no readable terms; truncated output and terms that fail validation are
+    fixed with targeted follow-up requests (see validate_and_repair).
+    Returns (json_data, claude_response, token_usage) where token_usage holds
+    the per-call usage, the routing decision and the validation outcome,
+    which is also stored as ``validation`` on the first term.
+    """
+    estimate = estimate_transcript_size(pdf_stream)
+    tier, reason = route_transcript(estimate)
+    routing = {"tier": tier, "reason": reason, "estimate": estimate, "escalated": False}
+    calls = []
+    
+    max_tokens = size_max_tokens(estimate)
+    claude_response, usage = analyze_pdf(pdf_stream, prompt, tier=tier, max_tokens=max_tokens)
+    if claude_response is None:
+        return None, None, None
+    calls.append(usage)
+    json_data, complete = parse_extraction(claude_response)
+    
+    if tier == "fast" and json_data is None:
+        routing["escalated"] = True
+        routing["escalation_issues"] = ["no parseable JSON"]
+        if usage["stop_reason"] == "max_tokens":
+            routing["escalation_issues"].insert(0, "response truncated at max_tokens")
+        pdf_stream.seek(0)
+        escalated_response, escalated_usage = analyze_pdf(pdf_stream, prompt, tier="full", max_tokens=DEFAULT_MAX_TOKENS)
+        if escalated_response is not None:
+            calls.append(escalated_usage)
+            claude_response = escalated_response
+            json_data, complete = parse_extraction(claude_response)
+    
+    validation = None
+    if json_data is None:
+        if extract_json(claude_response) is not None:
+            report_error("Claude's response is not a list of terms.")
+    elif json_data:
+        json_data, validation = validate_and_repair(pdf_stream, json_data, prompt, calls, complete=complete)
+        if isinstance(json_data[0], dict):
+            json_data[0]["validation"] = validation
+    
+    get_routing_stats().record(tier, routing["escalated"])
+    token_usage = {
+        "calls": calls,
+        "routing": routing,
+        "validation": validation,
+        "total_tokens": sum(call["input_tokens"] + call["output_tokens"] for call in calls),
+        "total_cost": sum(call["total_cost"] for call in calls),
+    }
+    return json_data, claude_response, token_usage
+
+def format_token_usage(token_usage):
+    """Markdown report of token usage, cost and routing for the usage expander."""
+    if not token_usage:
+        return ""
+    if isinstance(token_usage, str):
+        return token_usage
+    routing = token_usage["routing"]
+    estimate = routing["estimate"]
+    lines = [
+        f"**Tokens Used:** {token_usage['total_tokens']}",
+        "",
+        f"**Routing:** {routing['tier']} tier ({routing['reason']}); "
+        f"preflight: {estimate['pages']} pages, ~{estimate['est_input_tokens']} input / "
+        f"~{estimate['est_output_tokens']} output tokens",
+    ]
+    if routing["escalated"]:
+        lines.append(f"**Escalated to full model:** {'; '.join(routing.get('escalation_issues', []))}")
+    incremental = token_usage.get("incremental")
+    if incremental:
+        pages = ", ".join(map(str, incremental["pages_sent"])) or "none"
+        lines.append(
+            f"**Incremental update** of run #{incremental['previous_run_id']}: sent page(s) {pages} of "
+            f"{incremental['total_pages']}; reused {incremental['reused_terms']} stored term(s)"
+        )
+    validation = token_usage.get("validation")
+    if validation and validation["repairs"]:
+        repairs = "; ".join(
+            f"pass {repair['pass']} "
+            + (f"continued after {repair['after']}" if repair["kind"] == "continuation"
+               else f"re-extracted {', '.join(repair['terms'])}")
+            + f" from page(s) {', '.join(map(str, repair['pages'])) if isinstance(repair['pages'], list) else 'all'}"
+            + f": {repair['status']}" + (f" ({repair['error']})" if "error" in repair else "")
+            for repair in validation["repairs"]
+        )
+        failing = sum(1 for term in validation["terms"] if term["issues"])
+        lines.append(f"**Validation:** {validation['passes']} passes, {failing} term(s) still failing; {repairs}")
+    preprocessing = token_usage.get("preprocessing")
+    if preprocessing:
+        dropped = ", ".join(f"p{page['page']} {page['reason']}" for page in preprocessing["dropped"]) or "none"
+        lines.append(
+            f"**Preprocessing:** sent {preprocessing['pages_out']} of {preprocessing['pages_in']} pages "
+            f"(dropped: {dropped}); {preprocessing['images_downsampled']} images downsampled to "
+            f"{preprocessing['target_dpi']} DPI; {preprocessing['bytes_in'] / 1e6:.2f} MB -> "
+            f"{preprocessing['bytes_out'] / 1e6:.2f} MB"
+            + (f" (failed: {preprocessing['error']})" if "error" in preprocessing else "")
+        )
+    for call in token_usage["calls"]:
+        lines += [
+            "",
+            f"**{call['model']}** (max_tokens {call['max_tokens']}, stop: {call['stop_reason']}):",
+            f"- Base Input Cost: ${call['base_input_cost']:.6f}",
+            f"- Cache Writes Cost: ${call['cache_writes_cost']:.6f}",
+            f"- Cache Hits Cost: ${call['cache_hits_cost']:.6f}",
+            f"- Output Cost: ${call['output_cost']:.6f}",
+        ]
+    lines += ["", f"- **Total Cost:** ${token_usage['total_cost']:.6f}"]
+    stats = get_routing_stats().snapshot()
+    lines += [
+        "",
+        f"*Routing on this server: {stats['routed'].get('fast', 0)} fast / {stats['routed'].get('full', 0)} full, "
+        f"{stats['escalations']} escalations ({stats['escalation_rate']:.0%} of fast-tier runs)*",
+    ]
+    return "\n".join(lines)
+
 def post_process_transcript_data(json_data):
     # Ensure json_data is a list and not empty before accessing elements
     if json_data and isinstance(json_data, list) and len(json_data) > 0:
@@ -166,45 +1218,156 @@ def post_process_transcript_data(json_data):
                 if "institution" not in term:
                     term["institution"] = institution_name
                 
-    # Process each term's courses        
-    for term in json_data or []:
-        for course in term.get("courses", []):
-            # If credits are missing but points and grade are available
-            if (not course.get("credits") or course["credits"] == "") and course.get("points") and course.get("grade"):
-                grade_value = grade_to_points(course["grade"])
-                if grade_value:  # Only calculate if we have a valid grade value
-                    try:
-                        points = float(course["points"])
-                        course["credits"] = round(points / grade_value, 1)
-                    except (ValueError, ZeroDivisionError):
-                        # Handle cases where conversion fails
-                        pass
+    # Back-fill missing credits from points / grade value in one pass over all courses
+    if json_data:
+        courses = flatten_courses([(0, json_data)])
+        for course, credits in zip(courses["course"][courses["backfilled_credits"].notna()],
+                                   courses["backfilled_credits"].dropna()):
+            course["credits"] = float(credits)
+    return json_data
+
+# Grade value for every letter grade grade_to_points understands; other grades are looked up once per batch
+GRADE_POINTS = {grade: grade_to_points(grade) for base in "ABCDF" for grade in (base, base + "+", base + "-")}
+# Grades that earn credit without grade points / that are not counted as attempted
+PASSING_NON_POINT_GRADES = {"P", "S", "CR", "T", "TR"}
+NOT_ATTEMPTED_GRADES = {"W", "WP", "I", "IP", "AU", "NR", "X", "Z", ""}
+
+def _grade_table(grades):
+    """Map distinct normalized grade strings to their grade value (None for non-point grades)."""
+    table = {}
+    for grade in grades:
+        if grade in GRADE_POINTS:
+            table[grade] = GRADE_POINTS[grade]
+        else:
+            table[grade] = grade_to_points(grade) if grade else None
+    return table
+
+def flatten_courses(transcripts):
+    """Flatten (key, json_data) pairs into one course frame for the vectorized rollups.
+
+    Each row keeps a reference to its course dict (``course``) plus the
+    transcript key, term position and numeric grade / credit columns;
+    ``backfilled_credits`` is set where credits are missing and can be
+    derived as points / grade value.
+    """
+    records = []
+    for key, json_data in transcripts:
+        for term_index, term in enumerate(json_data or []):
+            for course in term.get("courses", []):
+                records.append((key, term_index, course, course.get("credits"), course.get("points"),
+                                course.get("grade") or "", course.get("macu_credits"), course.get("data_from", "")))
+    courses = pd.DataFrame(records, columns=["transcript", "term_index", "course", "credits_raw", "points_raw",
+                                             "grade_raw", "macu_credits_raw", "data_from"])
+    grades = courses["grade_raw"].astype(str).str.upper().str.strip()
+    courses["grade"] = grades
+    courses["grade_value"] = pd.to_numeric(grades.map(_grade_table(grades.unique())), errors="coerce")
+    courses["credits"] = pd.to_numeric(courses["credits_raw"], errors="coerce")
+    courses["points"] = pd.to_numeric(courses["points_raw"], errors="coerce")
+    courses["macu_credits"] = pd.to_numeric(courses["macu_credits_raw"], errors="coerce")
+    courses["data_from"] = courses["data_from"].astype(str).str.strip()
+    
+    # Same rule as the extraction prompt: credits = points / grade value, when credits are missing
+    missing_credits = courses["credits_raw"].map(lambda value: not value)
+    has_points = courses["points_raw"].map(bool) & (courses["grade_raw"] != "")
+    backfill = missing_credits & has_points & (courses["grade_value"] > 0) & courses["points"].notna()
+    courses["backfilled_credits"] = (courses["points"] / courses["grade_value"]).round(1).where(backfill)
+    courses["credits"] = courses["credits"].where(~backfill, courses["backfilled_credits"])
+    return courses
+
+ROLLUP_COLUMNS = ["attempted_credits", "earned_credits", "gpa_credits", "quality_points"]
+
+def compute_rollups(courses):
+    """Term and transcript credit / GPA totals for a frame from flatten_courses.
+
+    Returns (terms, transcripts): per (transcript, term_index) totals with the
+    term and cumulative GPA, and per transcript totals with the transferable
+    credits for each ``data_from`` source. Everything is computed with
+    grouped column operations, so one call covers any number of transcripts.
+    """
+    credits = courses["credits"].fillna(0.0)
+    grade_value = courses["grade_value"]
+    in_gpa = grade_value.notna()
+    attempted = ~courses["grade"].isin(NOT_ATTEMPTED_GRADES)
+    earned = (in_gpa & (grade_value > 0)) | courses["grade"].isin(PASSING_NON_POINT_GRADES)
+    frame = pd.DataFrame({
+        "transcript": courses["transcript"],
+        "term_index": courses["term_index"],
+        "attempted_credits": credits.where(attempted, 0.0),
+        "earned_credits": credits.where(earned, 0.0),
+        "gpa_credits": credits.where(in_gpa, 0.0),
+        "quality_points": (credits * grade_value).where(in_gpa, 0.0),
+    })
+    
+    terms = frame.groupby(["transcript", "term_index"], sort=True)[ROLLUP_COLUMNS].sum().reset_index()
+    cumulative = terms.groupby("transcript", sort=False)[ROLLUP_COLUMNS].cumsum()
+    for column in ROLLUP_COLUMNS:
+        terms[f"cumulative_{column}"] = cumulative[column]
+    terms["term_gpa"] = (terms["quality_points"] / terms["gpa_credits"].where(terms["gpa_credits"] > 0)).round(2)
+    terms["cumulative_gpa"] = (
+        terms["cumulative_quality_points"]
+        / terms["cumulative_gpa_credits"].where(terms["cumulative_gpa_credits"] > 0)
+    ).round(2)
+    
+    transcripts = frame.groupby("transcript", sort=False)[ROLLUP_COLUMNS].sum()
+    transcripts["cumulative_gpa"] = (
+        transcripts["quality_points"] / transcripts["gpa_credits"].where(transcripts["gpa_credits"] > 0)
+    ).round(2)
+    # Transferable credits: MACU credits (course credits when missing) of earned courses, per match source
+    transfer = pd.DataFrame({
+        "transcript": courses["transcript"],
+        "source": courses["data_from"].where(courses["data_from"].isin(["CEP", "CEQMACU"]), "unmatched"),
+        "credits": courses["macu_credits"].fillna(credits).where(earned, 0.0),
+    })
+    transfer_credits = transfer.pivot_table(index="transcript", columns="source", values="credits",
+                                            aggfunc="sum", fill_value=0.0)
+    transcripts = transcripts.join(transfer_credits.add_prefix("transfer_credits_"))
+    return terms.round(2), transcripts.round(2).reset_index()
+
+def _rollup_value(value):
+    return None if value is None or pd.isna(value) else round(float(value), 2)
+
+def add_transcript_rollups(json_data):
+    """Add ``term_rollup`` to every term and ``credit_summary`` to the first term."""
+    if not json_data:
+        return json_data
+    terms, transcripts = compute_rollups(flatten_courses([(0, json_data)]))
+    term_columns = ROLLUP_COLUMNS + ["term_gpa"] + [f"cumulative_{column}" for column in ROLLUP_COLUMNS] + ["cumulative_gpa"]
+    term_rows = {row["term_index"]: row for row in terms.to_dict("records")}
+    previous = {}
+    for term_index, term in enumerate(json_data):
+        row = term_rows.get(term_index)
+        if row is None:
+            # Terms without courses carry the cumulative totals of the terms before them
+            row = {column: previous.get(column) if column.startswith("cumulative_") else None for column in term_columns}
+        term["term_rollup"] = {column: _rollup_value(row[column]) for column in term_columns}
+        previous = row
+    summary = transcripts.iloc[0].to_dict() if not transcripts.empty else {}
+    json_data[0]["credit_summary"] = {
+        **{column: _rollup_value(summary.get(column, 0.0)) for column in ROLLUP_COLUMNS},
+        "cumulative_gpa": _rollup_value(summary.get("cumulative_gpa")),
+        "transfer_credits": {
+            source: _rollup_value(summary.get(f"transfer_credits_{source}", 0.0)) or 0.0
+            for source in ["CEP", "CEQMACU", "unmatched"]
+        },
+    }
     return json_data
+
 def load_institution_mappings():
     """Load institution name to code mappings from Google Sheet."""
     try:
-        import gspread
-        credentials = service_account.Credentials.from_service_account_info(
-            st.secrets["gcp_service_account"],
-            scopes=[
-                'https://www.googleapis.com/auth/spreadsheets.readonly',
-                'https://www.googleapis.com/auth/drive.readonly'
-            ]
-        )
-        
-        gc = gspread.authorize(credentials)
+        gc = _gspread_client(READONLY_SCOPES)
         spreadsheet_id = "122e-sqnpQWkue_uGxLLrcc7nuwBWppzUeh9cdp6vpRY"
         
         try:
             spreadsheet = gc.open_by_key(spreadsheet_id)
         except Exception as e:
-            st.error(f"Failed to open SchoolInstitutions spreadsheet: {str(e)}")
+            report_error(f"Failed to open SchoolInstitutions spreadsheet: {str(e)}")
             return pd.DataFrame()
         
         worksheet = spreadsheet.sheet1  # Using the first sheet
         sheet_values = worksheet.get_all_values()
         if not sheet_values or len(sheet_values) <= 1:
-            st.error("SchoolInstitutions sheet is empty or contains insufficient data")
+            report_error("SchoolInstitutions sheet is empty or contains insufficient data")
             return pd.DataFrame()
         
         headers = sheet_values[0]
@@ -213,15 +1376,13 @@ def load_institution_mappings():
         
         # Ensure the required columns exist
         if "ORG_NAME" not in df.columns or "ORG_CDE" not in df.columns:
-            st.error("Required columns 'ORG_NAME' or 'ORG_CDE' not found in SchoolInstitutions sheet")
+            report_error("Required columns 'ORG_NAME' or 'ORG_CDE' not found in SchoolInstitutions sheet")
             return pd.DataFrame()
         
         return df
         
     except Exception as e:
-        st.error(f"Error loading institution mappings from Google Sheets: {str(e)}")
-        import traceback
-        st.error(traceback.format_exc())
+        report_error(f"Error loading institution mappings from Google Sheets: {str(e)}")
         return pd.DataFrame()
 def match_institution_code(institution_name, institution_df):
 
@@ -230,7 +1391,9 @@ def match_institution_code(institution_name, institution_df):
     
     # Normalize institution names for matching
     institution_name = institution_name.lower().strip()
-    institution_df['ORG_NAME_NORMALIZED'] = institution_df['ORG_NAME'].str.lower().str.strip()
+    if 'ORG_NAME_NORMALIZED' not in institution_df.columns:
+        # Shared (cached) frames are prepared up front; never mutate them here
+        institution_df = prepare_institution_catalog(institution_df)
     
     # Try exact match first
     exact_matches = institution_df[institution_df['ORG_NAME_NORMALIZED'] == institution_name]
@@ -239,7 +1402,6 @@ def match_institution_code(institution_name, institution_df):
         org_code = exact_matches.iloc[0]['ORG_CDE']
     else:
         # Try fuzzy matching if no exact match
-        import difflib
         best_matches = difflib.get_close_matches(
             institution_name, 
             institution_df['ORG_NAME_NORMALIZED'].tolist(),
@@ -266,69 +1428,60 @@ def match_institution_code(institution_name, institution_df):
         # If conversion fails (e.g., non-numeric code), return as is
         return org_code
 
-def enrich_with_macu_data(json_data, macu_df, ceqmacu_df=None):
-    if macu_df.empty:
-        st.warning("No CEP mapping data available.")
-        return json_data
-    import re
-    
-    def normalize(text):
-        if pd.isna(text) or text is None:
-            return ""
-        # Replace hyphens with spaces in the text
-        text = str(text).strip().lower().replace('-', ' ')
-        # Add space between letters and numbers for consistent matching
-        text = re.sub(r'([a-zA-Z])(\d)', r'\1 \2', text)
-        return text
+def normalize_course_text(text):
+    if pd.isna(text) or text is None:
+        return ""
+    # Replace hyphens with spaces in the text
+    text = str(text).strip().lower().replace('-', ' ')
+    # Add space between letters and numbers for consistent matching
+    text = re.sub(r'([a-zA-Z])(\d)', r'\1 \2', text)
+    return text
+
+# Improved extract_course_code function
+def extract_course_code(combined_text):
+    normalize = normalize_course_text
+    if pd.isna(combined_text) or combined_text is None:
+        return ""
     
-    # Determine which academic year sheet to use for each term
-    def get_academic_year_sheet(term, year):
-        year = int(year) if year.isdigit() else 0
-        term = term.lower()
-        
-        # Map the term and year to appropriate academic year
-        if "fall" in term:
-            # Fall term is in the first year of an academic year span
-            academic_year = f"{year}-{year+1}"
-        elif "spring" in term or "summer" in term:
-            # Spring and Summer terms are in the second year of an academic year span
-            academic_year = f"{year-1}-{year}"
-        else:
-            # Default case if term is unrecognized
-            academic_year = f"{year}-{year+1}"
-            
-        return academic_year
+    # First try a more robust pattern that looks for a subject code followed by a course number
+    # This captures patterns like "COMM 1313", "ENGL 101", "BIO 2010", etc.
+    match = re.match(r'^([A-Za-z]+)\s*(\d+)', str(combined_text), re.IGNORECASE)
+    if match:
+        subject = match.group(1).strip()
+        number = match.group(2).strip()
+        return normalize(f"{subject} {number}")
     
-    # Improved extract_course_code function
-    def extract_course_code(combined_text):
-        if pd.isna(combined_text) or combined_text is None:
-            return ""
-        
-        # First try a more robust pattern that looks for a subject code followed by a course number
-        # This captures patterns like "COMM 1313", "ENGL 101", "BIO 2010", etc.
-        match = re.match(r'^([A-Za-z]+)\s*(\d+)', str(combined_text), re.IGNORECASE)
-        if match:
-            subject = match.group(1).strip()
-            number = match.group(2).strip()
-            return normalize(f"{subject} {number}")
+    # Fallback to the original pattern
+    match = re.match(r'^([A-Za-z0-9\s\.]+?)(?:\s{2,}|\s+[^A-Za-z0-9\s\.])', str(combined_text))
+    if match:
+        return normalize(match.group(1))
+    else:
+        # Final fallback: try to get the first word with numbers (likely the course code)
+        words = str(combined_text).split()
+        for i, word in enumerate(words):
+            if any(c.isdigit() for c in word) and i > 0:
+                return normalize(f"{words[i-1]} {word}")  # Subject code + course number
         
-        # Fallback to the original pattern
-        match = re.match(r'^([A-Za-z0-9\s\.]+?)(?:\s{2,}|\s+[^A-Za-z0-9\s\.])', str(combined_text))
-        if match:
-            return normalize(match.group(1))
-        else:
-            # Final fallback: try to get the first word with numbers (likely the course code)
-            words = str(combined_text).split()
-            for i, word in enumerate(words):
-                if any(c.isdigit() for c in word) and i > 0:
-                    return normalize(f"{words[i-1]} {word}")  # Subject code + course number
-            
-            # If nothing else works, just take the first two words if available
-            if len(words) >= 2:
-                return normalize(f"{words[0]} {words[1]}")
-            return normalize(str(combined_text).split()[0]) if words else ""
-    
-    # Create a more efficient structure for course code lookup
+        # If nothing else works, just take the first two words if available
+        if len(words) >= 2:
+            return normalize(f"{words[0]} {words[1]}")
+        return normalize(str(combined_text).split()[0]) if words else ""
+
+CEP_SHEETS = ['2020-2021', '2021-2022', '2022-2023', '2023-2024', '2024-2025', '2025-2026']
+
+def normalize_institution_name(name):
+    return re.sub(r'\s+', ' ', str(name or "")).strip().lower()
+
+def prepare_cep_catalog(macu_df, institution_df=None):
+    """Normalize the CEP sheets once and split them by academic year.
+
+    Returns a dict holding the prepared frame, its per-sheet / MACU views and
+    the same per-sheet views partitioned by institution, or None when no
+    combined code-and-title column exists. Partitions are keyed by the
+    normalized ``Institution`` value; with ``institution_df`` each value is
+    also resolved to its org code. The input frame is not modified, so the
+    result can be shared read-only across sessions.
+    """
     # Use the CombineTitleCode column for matching
     combine_column = 'CombineTitleCode'
     if combine_column not in macu_df.columns:
@@ -339,55 +1492,349 @@ def enrich_with_macu_data(json_data, macu_df, ceqmacu_df=None):
                 combine_column = col
                 break
         else:
-            st.error("No suitable column found for combined course code and title matching")
-            return json_data
+            return None
     
+    macu_df = macu_df.copy()
     # Create normalized columns for matching
-    macu_df['combine_normalized'] = macu_df[combine_column].apply(normalize)
-    macu_df['common_code_normalized'] = macu_df['CommonCode'].apply(normalize)
+    macu_df['combine_normalized'] = macu_df[combine_column].apply(normalize_course_text)
+    macu_df['common_code_normalized'] = macu_df['CommonCode'].apply(normalize_course_text)
     macu_df['course_code_extracted'] = macu_df[combine_column].apply(extract_course_code)
     
     # Create a column with just the course code for secondary matching
     if 'CourseCode' in macu_df.columns:
-        macu_df['course_code_normalized'] = macu_df['CourseCode'].apply(normalize)
-    
-    # Create course code lookup dictionary for faster matching
-    course_code_lookup = {}
+        macu_df['course_code_normalized'] = macu_df['CourseCode'].apply(normalize_course_text)
     
     # Create filtered dataframes for each academic year
-    academic_year_dfs = {}
-    available_sheets = ['2020-2021', '2021-2022', '2022-2023', '2023-2024', '2024-2025', '2025-2026']
+    academic_year_dfs = {
+        sheet_name: macu_df[macu_df['source_sheet'] == sheet_name]
+        for sheet_name in CEP_SHEETS
+    }
+    
+    # Partition every sheet by institution so a transcript only searches its own college
+    macu_df['institution_normalized'] = macu_df['Institution'].map(normalize_institution_name)
+    partition_dfs = {}
+    for (institution_key, sheet_name), group in macu_df.groupby(['institution_normalized', 'source_sheet'], sort=False):
+        partition_dfs.setdefault(institution_key, {})[sheet_name] = group
+    partition_by_org_code = {}
+    if institution_df is not None and not institution_df.empty:
+        for institution_key in partition_dfs:
+            org_code = match_institution_code(institution_key, institution_df)
+            if org_code:
+                partition_by_org_code.setdefault(org_code, institution_key)
+    
+    return {
+        "df": macu_df,
+        "combine_column": combine_column,
+        "academic_year_dfs": academic_year_dfs,
+        "partition_dfs": partition_dfs,
+        "partition_by_org_code": partition_by_org_code,
+        # MACU institution rows for the CommonCode -> MACU course lookup
+        "macu_institution_df": macu_df[macu_df['Institution'] == 'MACU'],
+        # Approximate-match indexes per partition (None = whole catalog), see cep_title_index
+        "title_indexes": {},
+        "title_index_lock": threading.Lock(),
+    }
+
+def resolve_cep_partition(cep_catalog, institution_name, institution_df=None):
+    """Return the CEP partition key for a transcript's institution, or None."""
+    institution_key = normalize_institution_name(institution_name)
+    if not institution_key:
+        return None
+    if institution_key in cep_catalog["partition_dfs"]:
+        return institution_key
+    if institution_df is not None and not institution_df.empty:
+        org_code = match_institution_code(institution_name, institution_df)
+        if org_code:
+            return cep_catalog["partition_by_org_code"].get(org_code)
+    return None
+
+def prepare_ceqmacu_catalog(ceqmacu_df):
+    """Return a copy of the CEQMACU frame with its normalized lookup column."""
+    if ceqmacu_df is None or ceqmacu_df.empty:
+        return ceqmacu_df
+    ceqmacu_df = ceqmacu_df.copy()
+    ceqmacu_df['send_course_code_normalized'] = ceqmacu_df['SendCourse1CourseCode'].apply(normalize_course_text)
+    return ceqmacu_df
+
+def prepare_institution_catalog(institution_df):
+    """Return a copy of the SchoolInstitutions frame with normalized names."""
+    if institution_df.empty:
+        return institution_df
+    institution_df = institution_df.copy()
+    institution_df['ORG_NAME_NORMALIZED'] = institution_df['ORG_NAME'].str.lower().str.strip()
+    return institution_df
+
+TITLE_INDEX_NGRAM = 3
+TITLE_INDEX_CANDIDATE_GRAMS = 6  # rarest n-grams per query used to find candidate rows
+TITLE_INDEX_CANDIDATES = 32      # candidates per query rescored with the exact similarity
+APPROXIMATE_MATCH_THRESHOLD = 0.6  # minimum cosine similarity for a combined_text_approximate match
+
+def _char_ngram_counts(texts, n):
+    """Count the byte n-grams of each space-padded text.
+
+    Returns (row_ids, gram_codes, counts) sorted by row then n-gram, where a
+    gram code packs the n bytes into one integer. Computed on one concatenated
+    buffer, so there is no per-character Python loop.
+    """
+    empty = np.zeros(0, dtype=np.int64)
+    if len(texts) == 0:
+        return empty, empty, empty
+    encoded = [f" {text} ".encode("utf-8") for text in texts]
+    lengths = np.fromiter((len(chunk) for chunk in encoded), dtype=np.int64, count=len(encoded))
+    buffer = np.frombuffer(b"".join(encoded), dtype=np.uint8).astype(np.int64)
+    text_starts = np.cumsum(lengths) - lengths
+    # Only windows that stay inside their own text
+    windows = np.maximum(lengths - n + 1, 0)
+    row_ids = np.repeat(np.arange(len(texts), dtype=np.int64), windows)
+    positions = np.arange(windows.sum(), dtype=np.int64) + np.repeat(text_starts - (np.cumsum(windows) - windows), windows)
+    codes = np.zeros(len(positions), dtype=np.int64)
+    for offset in range(n):
+        codes = (codes << 8) | buffer[positions + offset]
+    keys, counts = np.unique((row_ids << (8 * n)) | codes, return_counts=True)
+    return keys >> (8 * n), keys & ((1 << (8 * n)) - 1), counts
+
+class TitleIndex:
+    """Character n-gram TF-IDF index for approximate course title matching.
+
+    Rows are L2-normalized sublinear TF-IDF vectors, stored both row-major and
+    as an inverted index (postings grouped by n-gram). A batch of queries is
+    answered with a few NumPy operations: candidates come from the postings of
+    each query's rarest n-grams, and the best candidates are then rescored
+    with the exact cosine similarity. Common n-grams such as " in" would touch
+    most of a large catalog, so they only count in the rescoring step.
+    """
+    def __init__(self, texts, ngram=TITLE_INDEX_NGRAM, candidate_grams=TITLE_INDEX_CANDIDATE_GRAMS,
+                 candidates=TITLE_INDEX_CANDIDATES):
+        self.ngram = ngram
+        self.candidate_grams = candidate_grams
+        self.candidates = candidates
+        self.size = len(texts)
+        rows, grams, counts = _char_ngram_counts(texts, ngram)
+        self.grams, gram_ids = np.unique(grams, return_inverse=True)
+        self.document_frequency = np.bincount(gram_ids, minlength=len(self.grams))
+        self.idf = np.log((1 + self.size) / (1 + self.document_frequency)) + 1
+        weights = (1 + np.log(counts)) * self.idf[gram_ids]
+        weights /= np.sqrt(np.bincount(rows, weights=weights ** 2, minlength=self.size))[rows]
+        # Row-major vectors (already sorted by row) for rescoring
+        self.row_indptr = np.concatenate(([0], np.cumsum(np.bincount(rows, minlength=self.size))))
+        self.row_gram_ids = gram_ids
+        self.row_weights = weights
+        # Inverted index for candidate generation
+        order = np.argsort(gram_ids, kind="stable")
+        self.posting_rows = rows[order]
+        self.posting_weights = weights[order]
+        self.indptr = np.concatenate(([0], np.cumsum(self.document_frequency)))
+
+    def best_matches(self, texts):
+        """Return (rows, scores): the most similar indexed row per query and its cosine similarity.
+
+        The row is -1 for queries that share no n-gram with the index.
+        """
+        best_rows = np.full(len(texts), -1, dtype=np.int64)
+        best_scores = np.zeros(len(texts))
+        if len(texts) == 0 or len(self.grams) == 0:
+            return best_rows, best_scores
+        
+        rows, grams, counts = _char_ngram_counts(texts, self.ngram)
+        gram_ids = np.minimum(np.searchsorted(self.grams, grams), len(self.grams) - 1)
+        known = self.grams[gram_ids] == grams  # n-grams absent from the catalog can't contribute
+        rows, gram_ids, counts = rows[known], gram_ids[known], counts[known]
+        if len(rows) == 0:
+            return best_rows, best_scores
+        weights = (1 + np.log(counts)) * self.idf[gram_ids]
+        weights /= np.sqrt(np.bincount(rows, weights=weights ** 2, minlength=len(texts)))[rows]
+        
+        # Candidate generation: postings of each query's rarest n-grams only
+        by_rarity = np.lexsort((self.document_frequency[gram_ids], rows))
+        query_starts = np.searchsorted(rows[by_rarity], rows[by_rarity], side="left")
+        rare = by_rarity[np.arange(len(by_rarity)) - query_starts < self.candidate_grams]
+        starts = self.indptr[gram_ids[rare]]
+        lengths = self.indptr[gram_ids[rare] + 1] - starts
+        posting_index = np.arange(lengths.sum(), dtype=np.int64) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+        pair_keys, pair_ids = np.unique(
+            np.repeat(rows[rare], lengths) * self.size + self.posting_rows[posting_index], return_inverse=True
+        )
+        partial_scores = np.bincount(
+            pair_ids, weights=np.repeat(weights[rare], lengths) * self.posting_weights[posting_index]
+        )
+        pair_queries, pair_rows = pair_keys // self.size, pair_keys % self.size
+        
+        # Keep the top candidates per query by partial score
+        order = np.lexsort((-partial_scores, pair_queries))
+        pair_queries, pair_rows = pair_queries[order], pair_rows[order]
+        rank = np.arange(len(order)) - np.searchsorted(pair_queries, pair_queries, side="left")
+        keep = rank < self.candidates
+        pair_queries, pair_rows = pair_queries[keep], pair_rows[keep]
+        
+        # Exact cosine for the kept candidates: look up each candidate n-gram in its query's vector
+        lengths = self.row_indptr[pair_rows + 1] - self.row_indptr[pair_rows]
+        element_index = np.arange(lengths.sum(), dtype=np.int64) + np.repeat(
+            self.row_indptr[pair_rows] - (np.cumsum(lengths) - lengths), lengths
+        )
+        element_pairs = np.repeat(np.arange(len(pair_rows)), lengths)
+        query_keys = rows * len(self.grams) + gram_ids  # sorted: rows then n-grams
+        lookup = np.repeat(pair_queries, lengths) * len(self.grams) + self.row_gram_ids[element_index]
+        found = np.minimum(np.searchsorted(query_keys, lookup), len(query_keys) - 1)
+        shared = query_keys[found] == lookup
+        exact_scores = np.bincount(
+            element_pairs[shared],
+            weights=self.row_weights[element_index[shared]] * weights[found[shared]],
+            minlength=len(pair_rows)
+        )
+        
+        order = np.lexsort((-exact_scores, pair_queries))
+        first = order[np.r_[True, pair_queries[order][1:] != pair_queries[order][:-1]]]
+        best_rows[pair_queries[first]] = pair_rows[first]
+        best_scores[pair_queries[first]] = exact_scores[first]
+        return best_rows, best_scores
+
+def cep_title_index(cep_catalog, partition=None):
+    """Return (TitleIndex, rows) over one institution partition's CEP rows, or every row for None.
+
+    Built on first use and kept on the catalog, which is replaced whenever the
+    mapping data changes.
+    """
+    title_indexes = cep_catalog["title_indexes"]
+    entry = title_indexes.get(partition)
+    if entry is None:
+        with cep_catalog["title_index_lock"]:
+            entry = title_indexes.get(partition)
+            if entry is None:
+                sheet_dfs = cep_catalog["academic_year_dfs"] if partition is None else cep_catalog["partition_dfs"][partition]
+                frames = [sheet_dfs[sheet_name] for sheet_name in CEP_SHEETS if sheet_name in sheet_dfs]
+                rows = pd.concat(frames) if frames else pd.DataFrame(columns=cep_catalog["df"].columns)
+                # Rows without a common code can never produce a match
+                rows = rows[(rows['common_code_normalized'] != "") & (rows['combine_normalized'] != "")]
+                rows = rows.reset_index(drop=True)
+                entry = (TitleIndex(rows['combine_normalized'].tolist()), rows)
+                title_indexes[partition] = entry
+    return entry
+
+# Placeholders in memoized match outcomes for values taken from the course itself.
+# Plain strings, not object() sentinels: the memo outlives script reruns, which
+# re-execute this module and would mint new sentinels each time.
+_COURSE_CREDITS = "\x00course_credits"
+_COURSE_DIVISION = "\x00course_division"
+# Course fields written by enrich_with_macu_data; cleared before a course is matched again
+MATCH_FIELDS = (
+    "cep_match", "ceqmacu_match", "macu_division", "CombineTitleCode", "term_academic_year", "older_than_data",
+    "data_from", "no_match_reason", "common_code", "source_sheet", "matched_on", "match_scope", "match_confidence",
+    "macu_course_code", "macu_course_title", "macu_credits",
+)
+
+def enrich_with_macu_data(json_data, macu_df, ceqmacu_df=None, cep_catalog=None,
+                          match_memo=None, mapping_version=None,
+                          institution_df=None, global_fallback=False,
+                          approximate_threshold=None):
+    """Attach MACU equivalents to every course.
+
+    Pass ``cep_catalog`` (from prepare_cep_catalog) to reuse an already
+    prepared CEP catalog; otherwise ``macu_df`` is prepared on the fly.
+    CEP matching is limited to the transcript institution's rows when they can
+    be identified (by name, or by org code via ``institution_df``);
+    ``global_fallback`` also searches every institution when that fails.
+    With ``match_memo`` and ``mapping_version`` set, per-course match outcomes
+    are reused across transcripts for as long as the mapping data is unchanged.
+    With ``approximate_threshold`` set, courses the exact tiers leave
+    unmatched are scored against a character n-gram TF-IDF index of the CEP
+    titles in one batch per transcript, and the best row at or above the
+    threshold is taken as a ``combined_text_approximate`` match with its
+    ``match_confidence``.
+    """
+    if cep_catalog is None:
+        if macu_df is None or macu_df.empty:
+            report_warning("No CEP mapping data available.")
+            return json_data
+        cep_catalog = prepare_cep_catalog(macu_df)
+        if cep_catalog is None:
+            report_error("No suitable column found for combined course code and title matching")
+            return json_data
+    if institution_df is None:
+        institution_df = pd.DataFrame()
+    
+    normalize = normalize_course_text
     
-    for sheet_name in available_sheets:
-        sheet_df = macu_df[macu_df['source_sheet'] == sheet_name].copy()
-        academic_year_dfs[sheet_name] = sheet_df
+    # Determine which academic year sheet to use for each term
+    def get_academic_year_sheet(term, year):
+        year = int(year) if year.isdigit() else 0
+        term = term.lower()
         
-        # Create a lookup dictionary for course codes in this sheet
-        for _, row in sheet_df.iterrows():
-            code = row['course_code_extracted']
-            if code and code not in course_code_lookup:
-                course_code_lookup[code] = sheet_name
+        # Map the term and year to appropriate academic year
+        if "fall" in term:
+            # Fall term is in the first year of an academic year span
+            academic_year = f"{year}-{year+1}"
+        elif "spring" in term or "summer" in term:
+            # Spring and Summer terms are in the second year of an academic year span
+            academic_year = f"{year-1}-{year}"
+        else:
+            # Default case if term is unrecognized
+            academic_year = f"{year}-{year+1}"
+            
+        return academic_year
+    
+    available_sheets = CEP_SHEETS
+    macu_institution_df = cep_catalog["macu_institution_df"]
     
-    # Create a specific dataframe for MACU institution rows for the second lookup
-    macu_institution_df = macu_df[macu_df['Institution'] == 'MACU'].copy()
+    # Search the transcript's own institution first; the whole catalog is used
+    # when the institution can't be resolved, or as a fallback if configured
+    institution_name = json_data[0].get("institution", "") if json_data else ""
+    partition = resolve_cep_partition(cep_catalog, institution_name, institution_df)
+    if partition is None:
+        cep_scopes = [("global", cep_catalog["academic_year_dfs"])]
+    else:
+        cep_scopes = [("institution", cep_catalog["partition_dfs"][partition])]
+        if global_fallback:
+            cep_scopes.append(("global", cep_catalog["academic_year_dfs"]))
     
     # Phase 2: Setup for CEQMACU data
     ceqmacu_available = False
     if ceqmacu_df is not None and not ceqmacu_df.empty:
         ceqmacu_available = True
-        ceqmacu_df['send_course_code_normalized'] = ceqmacu_df['SendCourse1CourseCode'].apply(normalize)
+        if 'send_course_code_normalized' not in ceqmacu_df.columns:
+            ceqmacu_df = prepare_ceqmacu_catalog(ceqmacu_df)
     
     # Count variables for tracking matches
     total_courses = 0
-    cep_matches = 0
-    macu_matches = 0
-    ceqmacu_matches = 0
-    sheet_matches = {'2020-2021': 0, '2021-2022': 0, '2022-2023': 0, '2023-2024': 0, '2024-2025': 0, '2025-2026': 0}
-    older_courses = 0  # Count courses older than our available data
+    counters = {"cep": 0, "macu": 0, "ceqmacu": 0, "older": 0, "approximate": 0}
+    sheet_matches = {sheet_name: 0 for sheet_name in available_sheets}
+    memo_hits = 0
     
-    for term in json_data:
-        term_name = term.get("term", "")
-        year = term.get("year", "")
+    def apply_macu_match(result, counts, common_code, missing_data_from):
+        # Find the MACU course with the same CommonCode
+        macu_matches_df = macu_institution_df[macu_institution_df['common_code_normalized'] == common_code]
+        if not macu_matches_df.empty:
+            # Found a MACU equivalent
+            macu_match = macu_matches_df.iloc[0]
+            result["macu_course_code"] = macu_match.get('CourseCode', '').replace(' ', '')
+            result["macu_course_title"] = macu_match.get('CommonCourseTitle', '')
+            result["macu_credits"] = _COURSE_CREDITS
+            result["data_from"] = "CEP"
+            result["macu_division"] = _COURSE_DIVISION
+            counts.append("macu")
+        else:
+            # Common code exists but no MACU institution match was found
+            result["data_from"] = missing_data_from
+            result["no_match_reason"] = "Common code found but no matching MACU course"
+    
+    def apply_cep_match(result, counts, match, sheet_name, match_type):
+        common_code = normalize(match.get('CommonCode', ''))
+        result["cep_match"] = True
+        result["common_code"] = common_code
+        result["source_sheet"] = sheet_name  # Use the actual sheet where match was found
+        result["matched_on"] = match_type
+        counts.append("cep")
+        counts.append(("sheet", sheet_name))
+        return common_code
+    
+    def match_course(course_code, title, term_name, year):
+        """Run the CEP -> other years -> CEQMACU cascade for one course.
+
+        Depends only on its arguments and the mapping data, so the outcome can
+        be memoized across transcripts. Values that come from the course itself
+        are left as _COURSE_CREDITS / _COURSE_DIVISION placeholders.
+        """
+        result = {}
+        counts = []
         year_int = int(year) if year.isdigit() else 0
         academic_year = get_academic_year_sheet(term_name, year)
         
@@ -403,262 +1850,297 @@ def enrich_with_macu_data(json_data, macu_df, ceqmacu_df=None):
             if year_int <= earliest_year:  # For spring/summer 2020, academic year would be 2019-2020 which we don't have
                 is_old_term = True
                 
-        # Get the appropriate academic year dataframe
-        current_academic_year_df = academic_year_dfs.get(academic_year, pd.DataFrame())
+        # Initialize match flags
+        result["cep_match"] = False
+        result["ceqmacu_match"] = False
+        result["macu_division"] = ""
+        combined_text = f"{course_code} {title}"
+        combined_normalized = normalize(combined_text)
+        course_code_normalized = normalize(course_code)
+        result["CombineTitleCode"] = combined_text
+        result["term_academic_year"] = academic_year
         
-        for course in term.get("courses", []):
-            total_courses += 1
+        def match_cep(sheet_dfs):
+            """Exact CEP tiers over one set of academic-year sheets; True once matched."""
+            cep_match_found = False
+            current_academic_year_df = sheet_dfs.get(academic_year, pd.DataFrame())
             
-            # Initialize match flags
-            course["cep_match"] = False
-            course["ceqmacu_match"] = False
-            course["macu_division"] = ""
-            course_code = course.get("course_code", "")
-            title = course.get("title", "")
-            combined_text = f"{course_code} {title}"
-            combined_normalized = normalize(combined_text)
-            course_code_normalized = normalize(course_code)
-            course["CombineTitleCode"] = combined_text
-            course["term_academic_year"] = academic_year
+            # MATCH METHOD 1: Try to find an exact match by course code only in the current academic year
+            if not current_academic_year_df.empty:
+                # First try an exact course code match
+                # Using both original and normalized course codes to increase matching chances
+                matching_rows = current_academic_year_df[
+                    (current_academic_year_df['course_code_extracted'] == course_code_normalized) |
+                    (current_academic_year_df['course_code_extracted'] == course_code.lower().strip())
+                ]
+                
+                if not matching_rows.empty:
+                    # We found a matching course in the expected academic year sheet by course code
+                    common_code = apply_cep_match(result, counts, matching_rows.iloc[0], academic_year, "course_code_exact")
+                    if common_code:
+                        apply_macu_match(result, counts, common_code, " ")
+                        cep_match_found = True  # A CEP match counts even without a MACU match
             
-            # DEBUG: Log the course being processed
-            # st.write(f"Processing course: {course_code} - {title}")
+            # If no match by course code, try the combined text approach for the current academic year
+            if not cep_match_found and not current_academic_year_df.empty:
+                matching_rows = current_academic_year_df[current_academic_year_df['combine_normalized'] == combined_normalized]
+                if not matching_rows.empty:
+                    # Found a matching course by combined text
+                    common_code = apply_cep_match(result, counts, matching_rows.iloc[0], academic_year, "combined_text_exact")
+                    if common_code:
+                        apply_macu_match(result, counts, common_code, "")
+                        cep_match_found = True
             
-            # Mark courses from older terms explicitly
-            if is_old_term:
-                older_courses += 1
-                course["older_than_data"] = True
-                # For older terms, skip CEP matching and try CEQMACU directly
-                cep_match_found = False
-                
-                # Add a note to indicate why no match was found in CEP
-                course["data_from"] = ""
-                course["no_match_reason"] = f"Term ({term_name} {year}) is before earliest available data (2020-2021)"
-            else:
-                course["older_than_data"] = False
-                cep_match_found = False
+            # If no match in the current academic year, try other sheets by course code first
+            if not cep_match_found:
+                # Sort available sheets to try the closest years first
+                # For example, if academic_year is "2023-2024", try "2022-2023" before "2020-2021"
+                try:
+                    target_year = int(academic_year.split('-')[0])
+                    sorted_sheets = sorted(available_sheets, 
+                                       key=lambda x: abs(int(x.split('-')[0]) - target_year))
+                except (ValueError, IndexError):
+                    # If parsing fails, use the default order
+                    sorted_sheets = available_sheets
                 
-                # MATCH METHOD 1: Try to find an exact match by course code only in the current academic year
-                if not current_academic_year_df.empty:
-                    # Print normalized course code for debugging
-                    # st.write(f"Looking for course code: {course_code_normalized}")
+                for sheet_name in sorted_sheets:
+                    # Skip if it's the same as the current academic year we already checked
+                    if sheet_name == academic_year:
+                        continue
+                        
+                    sheet_df = sheet_dfs.get(sheet_name, pd.DataFrame())
+                    if sheet_df.empty:
+                        continue
                     
-                    # First try an exact course code match
-                    # Using both original and normalized course codes to increase matching chances
-                    matching_rows = current_academic_year_df[
-                        (current_academic_year_df['course_code_extracted'] == course_code_normalized) |
-                        (current_academic_year_df['course_code_extracted'] == course_code.lower().strip())
+                    # First try to match by course code
+                    matching_rows = sheet_df[
+                        (sheet_df['course_code_extracted'] == course_code_normalized) |
+                        (sheet_df['course_code_extracted'] == course_code.lower().strip())
                     ]
+                    match_type = "course_code_exact_different_year"
+                    
+                    # If no match by course code, try combined text
+                    if matching_rows.empty:
+                        matching_rows = sheet_df[sheet_df['combine_normalized'] == combined_normalized]
+                        match_type = "combined_text_exact_different_year"
                     
                     if not matching_rows.empty:
-                        # We found a matching course in the expected academic year sheet by course code
-                        match = matching_rows.iloc[0]
-                        common_code = normalize(match.get('CommonCode', ''))
-                        course["cep_match"] = True
-                        course["common_code"] = common_code
-                        course["source_sheet"] = academic_year
-                        course["matched_on"] = "course_code_exact"
-                        cep_matches += 1
-                        sheet_matches[academic_year] += 1
-                        # Find the MACU course with the same CommonCode
-                        if common_code:
-                            # Look for rows where Institution = "MACU" and CommonCode matches
-                            macu_matches_df = macu_institution_df[macu_institution_df['common_code_normalized'] == common_code]
-                            if not macu_matches_df.empty:
-                                # Found a MACU equivalent
-                                macu_match = macu_matches_df.iloc[0]
-                                course["macu_course_code"] = macu_match.get('CourseCode', '').replace(' ', '')
-                                course["macu_course_title"] = macu_match.get('CommonCourseTitle', '')
-                                course["macu_credits"] = course.get("credits", "")
-                                course["data_from"] = "CEP"
-                                course["macu_division"] = "C" if course.get("division", "") == "UNDG" else ""
-                                macu_matches += 1
-                                cep_match_found = True
-                            else:
-                                # Common code exists but no MACU institution match was found
-                                course["data_from"] = " "
-                                course["no_match_reason"] = "Common code found but no matching MACU course"
-                                cep_match_found = True  # We did find a CEP match, just not a MACU match
-                
-                # If no match by course code, try the combined text approach for the current academic year
-                if not cep_match_found and not current_academic_year_df.empty:
-                    matching_rows = current_academic_year_df[current_academic_year_df['combine_normalized'] == combined_normalized]
-                    if not matching_rows.empty:
-                        # Found a matching course by combined text
-                        match = matching_rows.iloc[0]
-                        common_code = normalize(match.get('CommonCode', ''))
-                        course["cep_match"] = True
-                        course["common_code"] = common_code
-                        course["source_sheet"] = academic_year
-                        course["matched_on"] = "combined_text_exact"
-                        cep_matches += 1
-                        sheet_matches[academic_year] += 1
-                        
-                        # Find the MACU course with the same CommonCode
+                        # Found a match in another sheet
+                        common_code = apply_cep_match(result, counts, matching_rows.iloc[0], sheet_name, match_type)
                         if common_code:
-                            macu_matches_df = macu_institution_df[macu_institution_df['common_code_normalized'] == common_code]
-                            
-                            if not macu_matches_df.empty:
-                                macu_match = macu_matches_df.iloc[0]
-                                course["macu_course_code"] = macu_match.get('CourseCode', '').replace(' ', '')
-                                course["macu_course_title"] = macu_match.get('CommonCourseTitle', '')
-                                course["macu_credits"] = course.get("credits", "")
-                                course["data_from"] = "CEP"
-                                course["macu_division"] = "C" if course.get("division", "") == "UNDG" else ""
-                                macu_matches += 1
-                                cep_match_found = True
-                            else:
-                                course["data_from"] = ""
-                                course["no_match_reason"] = "Common code found but no matching MACU course"
-                                cep_match_found = True
-                
-                # If no match in the current academic year, try other sheets by course code first
-                if not cep_match_found:
-                    # Sort available sheets to try the closest years first
-                    # For example, if academic_year is "2023-2024", try "2022-2023" before "2020-2021"
-                    try:
-                        target_year = int(academic_year.split('-')[0])
-                        sorted_sheets = sorted(available_sheets, 
-                                           key=lambda x: abs(int(x.split('-')[0]) - target_year))
-                    except (ValueError, IndexError):
-                        # If parsing fails, use the default order
-                        sorted_sheets = available_sheets
-                    
-                    for sheet_name in sorted_sheets:
-                        # Skip if it's the same as the current academic year we already checked
-                        if sheet_name == academic_year:
-                            continue
-                            
-                        sheet_df = academic_year_dfs.get(sheet_name, pd.DataFrame())
-                        if sheet_df.empty:
-                            continue
-                        
-                        # First try to match by course code
-                        matching_rows = sheet_df[
-                            (sheet_df['course_code_extracted'] == course_code_normalized) |
-                            (sheet_df['course_code_extracted'] == course_code.lower().strip())
-                        ]
-                        match_type = "course_code_exact_different_year"
-                        
-                        # If no match by course code, try combined text
-                        if matching_rows.empty:
-                            matching_rows = sheet_df[sheet_df['combine_normalized'] == combined_normalized]
-                            match_type = "combined_text_exact_different_year"
-                        
-                        if not matching_rows.empty:
-                            # Found a match in another sheet
-                            match = matching_rows.iloc[0]
-                            common_code = normalize(match.get('CommonCode', ''))
-                            course["cep_match"] = True
-                            course["common_code"] = common_code
-                            course["source_sheet"] = sheet_name  # Use the actual sheet where match was found
-                            course["matched_on"] = match_type
-                            cep_matches += 1
-                            sheet_matches[sheet_name] += 1
-                            # Find the MACU course with the same CommonCode
-                            if common_code:
-                                macu_matches_df = macu_institution_df[macu_institution_df['common_code_normalized'] == common_code]
-                                
-                                if not macu_matches_df.empty:
-                                    macu_match = macu_matches_df.iloc[0]
-                                    course["macu_course_code"] = macu_match.get('CourseCode', '').replace(' ', '')
-                                    course["macu_course_title"] = macu_match.get('CommonCourseTitle', '')
-                                    course["macu_credits"] = course.get("credits", "")
-                                    course["data_from"] = "CEP"
-                                    course["macu_division"] = "C" if course.get("division", "") == "UNDG" else ""
-                                    macu_matches += 1
-                                    cep_match_found = True
-                                    break  # Exit the loop once match is found
-                                else:
-                                    course["data_from"] = "S"
-                                    course["no_match_reason"] = "Common code found but no matching MACU course"
-                                    cep_match_found = True
-                                    break  # Exit the loop once match is found
+                            apply_macu_match(result, counts, common_code, "S")
+                            cep_match_found = True
+                            break  # Exit the loop once match is found
+            return cep_match_found
+        
+        # Mark courses from older terms explicitly
+        if is_old_term:
+            counts.append("older")
+            result["older_than_data"] = True
+            # For older terms, skip CEP matching and try CEQMACU directly
+            cep_match_found = False
             
-            # MATCH METHOD 4: If no match in CEP data, try CEQMACU data
-            if not cep_match_found and ceqmacu_available:
-                # Try to match by exact course code first
-                ceqmacu_matches_df = ceqmacu_df[
-                    (ceqmacu_df['send_course_code_normalized'] == course_code_normalized) |
-                    (ceqmacu_df['send_course_code_normalized'] == course_code.lower().strip())
-                ]
+            # Add a note to indicate why no match was found in CEP
+            result["data_from"] = ""
+            result["no_match_reason"] = f"Term ({term_name} {year}) is before earliest available data (2020-2021)"
+        else:
+            result["older_than_data"] = False
+            cep_match_found = False
+            
+            for scope, sheet_dfs in cep_scopes:
+                cep_match_found = match_cep(sheet_dfs)
+                if result["cep_match"]:
+                    result["match_scope"] = scope
+                    break
+        
+        # MATCH METHOD 4: If no match in CEP data, try CEQMACU data
+        if not cep_match_found and ceqmacu_available:
+            # Try to match by exact course code first
+            ceqmacu_matches_df = ceqmacu_df[
+                (ceqmacu_df['send_course_code_normalized'] == course_code_normalized) |
+                (ceqmacu_df['send_course_code_normalized'] == course_code.lower().strip())
+            ]
+            
+            if not ceqmacu_matches_df.empty:
+                valid_year_matches = []
                 
-                if not ceqmacu_matches_df.empty:
-                    valid_year_matches = []
-                    
-                    for _, row in ceqmacu_matches_df.iterrows():
-                        try:
-                            low_year = int(row.get('SendEditionLowYear', 0))
-                            if int(year) >= low_year:
-                                valid_year_matches.append(row)
-                        except (ValueError, TypeError):
-                            # If year conversion fails, include the row anyway
+                for _, row in ceqmacu_matches_df.iterrows():
+                    try:
+                        low_year = int(row.get('SendEditionLowYear', 0))
+                        if int(year) >= low_year:
                             valid_year_matches.append(row)
-                    
-                    # If we have valid matches, use the first one
-                    if valid_year_matches:
-                        match = valid_year_matches[0]
-                        course["ceqmacu_match"] = True
-                        course["macu_course_code"] = match.get('ReceiveCourse1CourseCode', '').replace(' ', '')
-                        course["macu_course_title"] = match.get('ReceiveCourse1CourseTitle', '')
-                        course["macu_credits"] = match.get('ReceiveCourse1Units', '')
-                        course["data_from"] = "CEQMACU"
-                        course["matched_on"] = "ceqmacu_course_code"
-                        # Add MACU Division
-                        course["macu_division"] = "C" if course.get("division", "") == "UNDG" else ""
-                        ceqmacu_matches += 1
-                    elif is_old_term:
-                        # If this is an old term and we couldn't find a match in CEQMACU either
-                        course["no_match_reason"] = f"Term ({term_name} {year}) is before earliest available data (2020-2021) and no CEQMACU match found"
+                    except (ValueError, TypeError):
+                        # If year conversion fails, include the row anyway
+                        valid_year_matches.append(row)
+                
+                # If we have valid matches, use the first one
+                if valid_year_matches:
+                    match = valid_year_matches[0]
+                    result["ceqmacu_match"] = True
+                    result["macu_course_code"] = match.get('ReceiveCourse1CourseCode', '').replace(' ', '')
+                    result["macu_course_title"] = match.get('ReceiveCourse1CourseTitle', '')
+                    result["macu_credits"] = match.get('ReceiveCourse1Units', '')
+                    result["data_from"] = "CEQMACU"
+                    result["matched_on"] = "ceqmacu_course_code"
+                    # Add MACU Division
+                    result["macu_division"] = _COURSE_DIVISION
+                    counts.append("ceqmacu")
+                elif is_old_term:
+                    # If this is an old term and we couldn't find a match in CEQMACU either
+                    result["no_match_reason"] = f"Term ({term_name} {year}) is before earliest available data (2020-2021) and no CEQMACU match found"
+        
+        # Add "NO_MATCH" for data_from if we didn't find any match
+        if not result.get("data_from"):
+            result["data_from"] = " "
+            # If no explicit reason was set, add a generic one
+            if not result.get("no_match_reason"):
+                if is_old_term:
+                    result["no_match_reason"] = f"Term ({term_name} {year}) is before earliest available data (2020-2021)"
+                else:
+                    result["no_match_reason"] = "No matching course found in any available data source"
+        
+        return {"fields": result, "counts": tuple(counts)}
+    
+    def match_approximate(queued):
+        """Approximate tier for (outcome, combined_normalized) pairs the exact tiers left unmatched.
+
+        Each CEP scope is queried once for the whole batch; returns the
+        outcomes, replaced where a catalog row scored at or above the threshold.
+        """
+        outcomes = [outcome for outcome, _ in queued]
+        remaining = list(range(len(queued)))
+        for scope, _ in cep_scopes:
+            if not remaining:
+                break
+            index, index_rows = cep_title_index(cep_catalog, partition if scope == "institution" else None)
+            best_rows, best_scores = index.best_matches([queued[i][1] for i in remaining])
+            unmatched = []
+            for i, row, score in zip(remaining, best_rows, best_scores):
+                if row < 0 or score < approximate_threshold:
+                    unmatched.append(i)
+                    continue
+                result = dict(outcomes[i]["fields"])
+                counts = list(outcomes[i]["counts"])
+                result.pop("no_match_reason", None)
+                match = index_rows.iloc[int(row)]
+                common_code = apply_cep_match(result, counts, match, match['source_sheet'], "combined_text_approximate")
+                result["match_confidence"] = round(float(score), 3)
+                result["match_scope"] = scope
+                counts.append("approximate")
+                apply_macu_match(result, counts, common_code, " ")
+                outcomes[i] = {"fields": result, "counts": tuple(counts)}
+            remaining = unmatched
+        return outcomes
+    
+    use_memo = match_memo is not None and mapping_version is not None
+    matched_courses = []
+    approximate_queue = []
+    for term in json_data:
+        term_name = term.get("term", "")
+        year = term.get("year", "")
+        
+        for course in term.get("courses", []):
+            total_courses += 1
+            course_code = course.get("course_code", "")
+            title = course.get("title", "")
             
-            # Add "NO_MATCH" for data_from if we didn't find any match
-            if not course.get("data_from"):
-                course["data_from"] = " "
-                # If no explicit reason was set, add a generic one
-                if not course.get("no_match_reason"):
-                    if is_old_term:
-                        course["no_match_reason"] = f"Term ({term_name} {year}) is before earliest available data (2020-2021)"
-                    else:
-                        course["no_match_reason"] = "No matching course found in any available data source"
+            memo_key = (partition, global_fallback, approximate_threshold, course_code, title, term_name, year)
+            outcome = match_memo.get(mapping_version, memo_key) if use_memo else None
+            if outcome is None:
+                outcome = match_course(course_code, title, term_name, year)
+                fields = outcome["fields"]
+                if (approximate_threshold and not fields["cep_match"] and not fields["ceqmacu_match"]
+                        and not fields["older_than_data"]):
+                    # Scored with the rest of the transcript's near misses below
+                    approximate_queue.append((len(matched_courses), normalize(f"{course_code} {title}")))
+                elif use_memo:
+                    match_memo.put(mapping_version, memo_key, outcome)
+            else:
+                memo_hits += 1
+            matched_courses.append([course, memo_key, outcome])
+    
+    if approximate_queue:
+        approximate_outcomes = match_approximate(
+            [(matched_courses[position][2], combined_normalized) for position, combined_normalized in approximate_queue]
+        )
+        for (position, _), outcome in zip(approximate_queue, approximate_outcomes):
+            matched_courses[position][2] = outcome
+            if use_memo:
+                match_memo.put(mapping_version, matched_courses[position][1], outcome)
+    
+    for course, _, outcome in matched_courses:
+        # A course matched before (e.g. a stored term under older mapping data)
+        # must not keep fields the new outcome doesn't set
+        for field in MATCH_FIELDS:
+            course.pop(field, None)
+        # Outcomes are shared between sessions; copy values onto the course
+        for field, value in outcome["fields"].items():
+            if value == _COURSE_CREDITS:
+                value = course.get("credits", "")
+            elif value == _COURSE_DIVISION:
+                value = "C" if course.get("division", "") == "UNDG" else ""
+            course[field] = value
+        for counter in outcome["counts"]:
+            if isinstance(counter, tuple):
+                sheet_matches[counter[1]] += 1
+            else:
+                counters[counter] += 1
     
     # Add match statistics as metadata
     match_stats = {
         "total_courses": total_courses,
-        "cep_matches": cep_matches,
-        "macu_matches": macu_matches,
-        "ceqmacu_matches": ceqmacu_matches,
-        "older_courses": older_courses,
-        "sheet_matches": sheet_matches
+        "cep_matches": counters["cep"],
+        "macu_matches": counters["macu"],
+        "ceqmacu_matches": counters["ceqmacu"],
+        "approximate_matches": counters["approximate"],
+        "older_courses": counters["older"],
+        "sheet_matches": sheet_matches,
+        "memo_hits": memo_hits,
+        "institution_partition": partition
     }
     
     if json_data and len(json_data) > 0:
         json_data[0]["match_statistics"] = match_stats
     
     return json_data
+
+def summarize_matches(json_data, memo_hits=0, partition=None):
+    """Match statistics recounted from the enriched course fields of every term.
+
+    Same counts as enrich_with_macu_data reports, for a transcript whose
+    terms were not all enriched in one call (an incremental update).
+    """
+    courses = [course for term in json_data for course in term.get("courses", [])]
+    sheet_matches = {sheet_name: 0 for sheet_name in CEP_SHEETS}
+    for course in courses:
+        if course.get("cep_match") and course.get("source_sheet") in sheet_matches:
+            sheet_matches[course["source_sheet"]] += 1
+    return {
+        "total_courses": len(courses),
+        "cep_matches": sum(1 for course in courses if course.get("cep_match")),
+        "macu_matches": sum(1 for course in courses if course.get("data_from") == "CEP"),
+        "ceqmacu_matches": sum(1 for course in courses if course.get("ceqmacu_match")),
+        "approximate_matches": sum(1 for course in courses if course.get("matched_on") == "combined_text_approximate"),
+        "older_courses": sum(1 for course in courses if course.get("older_than_data")),
+        "sheet_matches": sheet_matches,
+        "memo_hits": memo_hits,
+        "institution_partition": partition
+    }
 def load_ceqmacu_mappings():
     try:
-        import gspread
-        credentials = service_account.Credentials.from_service_account_info(
-            st.secrets["gcp_service_account"],
-            scopes=[
-                'https://www.googleapis.com/auth/spreadsheets.readonly',
-                'https://www.googleapis.com/auth/drive.readonly'
-            ]
-        )
-        
-        gc = gspread.authorize(credentials)
+        gc = _gspread_client(READONLY_SCOPES)
         spreadsheet_id = "12CpxGQMyTa_cwyY0B-iomDgflD24kjYFYPLWljD6Jgo"
         try:
             spreadsheet = gc.open_by_key(spreadsheet_id)
             # Removed success message
         except Exception as e:
-            st.error(f"Failed to open CEQMACU spreadsheet: {str(e)}")
+            report_error(f"Failed to open CEQMACU spreadsheet: {str(e)}")
             return pd.DataFrame()
         
         worksheet = spreadsheet.get_worksheet(0)  # Assuming data is in the first sheet
         sheet_values = worksheet.get_all_values()
         if not sheet_values or len(sheet_values) <= 1:
-            st.warning(f"CEQMACU sheet is empty or contains insufficient data")
+            report_warning(f"CEQMACU sheet is empty or contains insufficient data")
             return pd.DataFrame()
         
         headers = sheet_values[0]
@@ -667,9 +2149,7 @@ def load_ceqmacu_mappings():
         return df
         
     except Exception as e:
-        st.error(f"Error loading CEQMACU mappings from Google Sheets: {str(e)}")
-        import traceback
-        st.error(traceback.format_exc())
+        report_error(f"Error loading CEQMACU mappings from Google Sheets: {str(e)}")
         return pd.DataFrame()
 
 def get_term_code(term):
@@ -683,56 +2163,277 @@ def get_term_code(term):
         return "TU"
     return ""
 
-def display_transcript_data(json_data):
-    if not json_data or not isinstance(json_data, list) or len(json_data) == 0:
-        st.error("No data to display")
-        return
-    
-    # Use the institution dataframe from session state instead of loading it again
-    institution_df = st.session_state.get("institution_df", pd.DataFrame())
-    
-    # Get institution name from the first term
-    institution = json_data[0].get("institution", "")
+# Course-level export for SIS import: (column, pyarrow type name)
+EXPORT_COLUMNS = [
+    ("source", "string"),
+    ("institution", "string"),
+    ("org_code", "string"),
+    ("term", "string"),
+    ("year", "string"),
+    ("term_code", "string"),
+    ("course_code", "string"),
+    ("title", "string"),
+    ("division", "string"),
+    ("grade", "string"),
+    ("credits", "float64"),
+    ("macu_course_code", "string"),
+    ("macu_course_title", "string"),
+    ("macu_credits", "float64"),
+    ("macu_division", "string"),
+    ("data_from", "string"),
+    ("matched_on", "string"),
+    ("match_confidence", "float64"),
+]
+EXPORT_CHUNK_ROWS = 10000
+
+def _export_number(value):
+    try:
+        return float(value) if value not in (None, "") else None
+    except (TypeError, ValueError):
+        return None
+
+def iter_course_rows(transcripts, institution_df=None):
+    """Yield one flat row per course across many processed transcripts.
+
+    ``transcripts`` is an iterable of (source, json_data) pairs and is consumed
+    lazily, so it can stream from files or a database.
+    """
+    org_codes = {}
+    for source, json_data in transcripts:
+        if not json_data or not isinstance(json_data, list):
+            continue
+        institution = json_data[0].get("institution", "")
+        if institution not in org_codes:
+            org_codes[institution] = (
+                match_institution_code(institution, institution_df)
+                if institution_df is not None and institution else ""
+            )
+        for term in json_data:
+            term_name = term.get("term", "")
+            for course in term.get("courses", []):
+                yield {
+                    "source": source,
+                    "institution": term.get("institution", institution),
+                    "org_code": org_codes[institution],
+                    "term": term_name,
+                    "year": str(term.get("year", "")),
+                    "term_code": get_term_code(term_name),
+                    "course_code": course.get("course_code", ""),
+                    "title": course.get("title", ""),
+                    "division": course.get("division", ""),
+                    "grade": course.get("grade", ""),
+                    "credits": _export_number(course.get("credits")),
+                    "macu_course_code": course.get("macu_course_code", ""),
+                    "macu_course_title": course.get("macu_course_title", ""),
+                    "macu_credits": _export_number(course.get("macu_credits")),
+                    "macu_division": course.get("macu_division", ""),
+                    "data_from": str(course.get("data_from", "")).strip(),
+                    "matched_on": course.get("matched_on", ""),
+                    "match_confidence": _export_number(course.get("match_confidence")),
+                }
+
+def export_course_table(transcripts, output, fmt="parquet", institution_df=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Write the course-level table for many transcripts to Parquet or CSV.
+
+    Rows are written in chunks of ``chunk_rows`` (one Parquet row group per
+    chunk), so memory stays flat however many transcripts are exported.
+    ``output`` is a path or a writable binary file object. Returns the number
+    of rows written.
+    """
+    rows = iter_course_rows(transcripts, institution_df)
+    names = [name for name, _ in EXPORT_COLUMNS]
+    written = 0
+    if fmt == "csv":
+        import csv
+        handle = open(output, "wb") if isinstance(output, (str, os.PathLike)) else output
+        text = io.TextIOWrapper(handle, encoding="utf-8", newline="", write_through=True)
+        try:
+            writer = csv.DictWriter(text, fieldnames=names)
+            writer.writeheader()
+            for row in rows:
+                writer.writerow(row)
+                written += 1
+            text.flush()
+        finally:
+            # Leave caller-owned file objects open
+            text.detach()
+            if handle is not output:
+                handle.close()
+        return written
     
-    # Get institution code if institution name is available
-    institution_code = ""
-    if institution:
-        institution_code = match_institution_code(institution, institution_df)
-        
-    # Display institution name and code at the top
-    if institution:
-        if institution_code:
-            st.header(f"Institution: {institution} (Code: {institution_code})")
-        else:
-            st.header(f"Institution: {institution}")
-        
-    for term_data in json_data:
+    if fmt != "parquet":
+        raise ValueError(f"Unsupported export format: {fmt}")
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    schema = pa.schema([(name, getattr(pa, type_name)()) for name, type_name in EXPORT_COLUMNS])
+    with pq.ParquetWriter(output, schema, compression="zstd") as writer:
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= chunk_rows:
+                writer.write_table(pa.Table.from_pylist(chunk, schema=schema))
+                written += len(chunk)
+                chunk = []
+        if chunk or not written:
+            writer.write_table(pa.Table.from_pylist(chunk, schema=schema))
+            written += len(chunk)
+    return written
+
+def iter_transcript_files(files):
+    """Yield (name, json_data) from processed-JSON files (paths or uploaded files), one at a time."""
+    for item in files:
+        name = getattr(item, "name", None) or os.path.basename(str(item))
+        try:
+            if isinstance(item, (str, os.PathLike)):
+                with open(item, "rb") as handle:
+                    json_data = json.load(handle)
+            else:
+                json_data = json.load(item)
+        except (OSError, ValueError) as e:
+            st.warning(f"Skipping {name}: {str(e)}")
+            continue
+        yield name, json_data
+
+DISPLAY_COLUMNS = [
+    "Term", "Course Code", "Division", "Title", "Short Title", "Credit", "Grade",
+    "MACU Course Code", "MACU Course Title", "MACU Credits", "MACU Division", "Data From", "Match Confidence",
+]
+
+def json_data_digest(json_data):
+    """Stable hash of a processed transcript, used as the display cache key."""
+    return hashlib.sha256(json.dumps(json_data, sort_keys=True).encode("utf-8")).hexdigest()
+
+@st.cache_data(show_spinner=False, max_entries=256)
+def build_display_model(json_digest, mapping_version, _json_data, _institution_df):
+    """Flatten a processed transcript into one course table, once per result.
+
+    Cached on ``json_digest`` and ``mapping_version``; the underscore arguments
+    are not hashed by Streamlit.
+    """
+    institution = _json_data[0].get("institution", "")
+    # Get institution code if institution name is available
+    institution_code = match_institution_code(institution, _institution_df) if institution else ""
+    
+    terms = []
+    empty_terms = []
+    rows = []
+    rollup_rows = []
+    for term_data in _json_data:
         term = term_data.get("term", "")
         year = term_data.get("year", "")
-        term_code = get_term_code(term)
-        st.subheader(f"{term} - {year} [{term_code}]")
+        term_label = f"{term} - {year} [{get_term_code(term)}]"
+        terms.append(term_label)
+        rollup = term_data.get("term_rollup") or {}
+        rollup_rows.append({
+            "Term": term_label,
+            "Attempted": rollup.get("attempted_credits"),
+            "Earned": rollup.get("earned_credits"),
+            "GPA Credits": rollup.get("gpa_credits"),
+            "Term GPA": rollup.get("term_gpa"),
+            "Cumulative Earned": rollup.get("cumulative_earned_credits"),
+            "Cumulative GPA": rollup.get("cumulative_gpa"),
+        })
         courses = term_data.get("courses", [])
         if not courses:
-            st.write("No courses found for this term")
-            continue
-            
-        df = pd.DataFrame([
-            {
+            empty_terms.append(term_label)
+        for course in courses:
+            rows.append({
+                "Term": term_label,
                 "Course Code": course.get("course_code", ""),
                 "Division": course.get("division", ""),
                 "Title": course.get("title", ""),
                 "Short Title": course.get("short_title", ""),
-                "Credit": course.get("credits", ""),
+                "Credit": str(course.get("credits", "")),
                 "Grade": course.get("grade", ""),
                 "MACU Course Code": course.get("macu_course_code", ""),
                 "MACU Course Title": course.get("macu_course_title", ""),
-                "MACU Credits": course.get("macu_credits", ""),
+                "MACU Credits": str(course.get("macu_credits", "")),
                 "MACU Division": course.get("macu_division", ""),
-                "Data From": course.get("data_from", "")
-            }
-            for course in courses
-        ])
-        st.table(df)
+                "Data From": course.get("data_from", ""),
+                "Match Confidence": str(course.get("match_confidence", "")),
+                "Matched": course.get("data_from", "").strip() in ("CEP", "CEQMACU"),
+            })
+    courses_df = pd.DataFrame(rows, columns=DISPLAY_COLUMNS + ["Matched"])
+    # Categorical term keeps transcript order when sorting and filtering
+    courses_df["Term"] = pd.Categorical(courses_df["Term"], categories=list(dict.fromkeys(terms)), ordered=True)
+    return {
+        "institution": institution,
+        "institution_code": institution_code,
+        "terms": list(dict.fromkeys(terms)),
+        "empty_terms": empty_terms,
+        "courses": courses_df,
+        "term_rollups": pd.DataFrame(rollup_rows),
+        "credit_summary": _json_data[0].get("credit_summary"),
+    }
+
+def display_transcript_data(json_data, json_digest=None):
+    if not json_data or not isinstance(json_data, list) or len(json_data) == 0:
+        st.error("No data to display")
+        return
+    
+    # Use the shared, already prepared institution mappings
+    mapping_snapshot = get_mapping_cache().snapshot()
+    model = build_display_model(
+        json_digest or json_data_digest(json_data),
+        mapping_snapshot.version,
+        json_data,
+        mapping_snapshot.institution_df
+    )
+    institution = model["institution"]
+    institution_code = model["institution_code"]
+        
+    # Display institution name and code at the top
+    if institution:
+        if institution_code:
+            st.header(f"Institution: {institution} (Code: {institution_code})")
+        else:
+            st.header(f"Institution: {institution}")
+    
+    credit_summary = model["credit_summary"]
+    if credit_summary:
+        transfer_credits = credit_summary.get("transfer_credits", {})
+        gpa = credit_summary.get("cumulative_gpa")
+        metric_cols = st.columns(4)
+        metric_cols[0].metric("Cumulative GPA", f"{gpa:.2f}" if gpa is not None else "-")
+        metric_cols[1].metric("Credits attempted", credit_summary.get("attempted_credits"))
+        metric_cols[2].metric("Credits earned", credit_summary.get("earned_credits"))
+        metric_cols[3].metric("Transferable credits", round(transfer_credits.get("CEP", 0) + transfer_credits.get("CEQMACU", 0), 2),
+                              help=f"CEP {transfer_credits.get('CEP', 0)}, CEQMACU {transfer_credits.get('CEQMACU', 0)}; "
+                                   f"{transfer_credits.get('unmatched', 0)} earned credits are unmatched")
+        with st.expander("Term GPA and credits"):
+            st.dataframe(model["term_rollups"], hide_index=True, width="stretch")
+    
+    courses_df = model["courses"]
+    filter_col1, filter_col2, filter_col3 = st.columns([3, 1, 1])
+    with filter_col1:
+        selected_terms = st.multiselect("Terms", model["terms"], key="results_term_filter",
+                                        placeholder="All terms")
+    with filter_col2:
+        unmatched_only = st.checkbox("Unmatched only", key="results_unmatched_only")
+    with filter_col3:
+        group_by_term = st.toggle("Group by term", key="results_group_by_term")
+    
+    view = courses_df
+    if selected_terms:
+        view = view[view["Term"].isin(selected_terms)]
+    if unmatched_only:
+        view = view[~view["Matched"]]
+    
+    matched = int(courses_df["Matched"].sum())
+    st.caption(f"{len(model['terms'])} terms, {len(courses_df)} courses, {matched} matched, "
+               f"{len(courses_df) - matched} unmatched. Showing {len(view)}.")
+    if model["empty_terms"]:
+        st.caption("No courses found for: " + ", ".join(model["empty_terms"]))
+    if group_by_term:
+        # One collapsible grid per term that still has rows after filtering
+        for term_label, term_view in view.groupby("Term", observed=True, sort=True):
+            term_matched = int(term_view["Matched"].sum())
+            course_count = f"{len(term_view)} course" + ("" if len(term_view) == 1 else "s")
+            with st.expander(f"{term_label} ({course_count}, {len(term_view) - term_matched} unmatched)"):
+                st.dataframe(term_view[DISPLAY_COLUMNS].drop(columns="Term"), hide_index=True, width="stretch")
+    else:
+        # One virtualized grid instead of a static table per term
+        st.dataframe(view[DISPLAY_COLUMNS], hide_index=True, width="stretch")
 
 def show_feedback_dialog():
     with st.form(key="feedback_form"):
@@ -758,25 +2459,21 @@ def show_feedback_dialog():
             return "skipped", None
     return False, None
 
-def save_pdf_to_drive(pdf_bytes: bytes, filename: str):
-    temp_file = None
-    temp_file_path = None
+def save_pdf_to_drive(pdf_source, filename: str):
+    """Upload a PDF (bytes or a binary file object) to the shared Drive folder."""
     try:
-        SCOPES = ['https://www.googleapis.com/auth/drive']
-        credentials = service_account.Credentials.from_service_account_info(
-            st.secrets["gcp_service_account"], scopes=SCOPES
-        )
-        drive_service = build('drive', 'v3', credentials=credentials)
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp:
-            temp.write(pdf_bytes)
-            temp_file_path = temp.name
+        from googleapiclient.http import MediaIoBaseUpload
+        drive_service = _drive_service(SCOPES)
+        if isinstance(pdf_source, (bytes, bytearray, memoryview)):
+            pdf_source = io.BytesIO(pdf_source)
         
         file_metadata = {
             'name': filename,
             'mimeType': 'application/pdf',
             'parents': ['1z_N8QcDkRLbMjqvDDZtO1UX3sxCzx2Os']
         }
-        media = MediaFileUpload(temp_file_path, mimetype='application/pdf', resumable=True)
+        # Stream straight from the artifact store instead of copying to another temp file
+        media = MediaIoBaseUpload(pdf_source, mimetype='application/pdf', chunksize=ARTIFACT_CHUNK_SIZE * 4, resumable=True)
         
         file = drive_service.files().create(
             body=file_metadata,
@@ -785,34 +2482,23 @@ def save_pdf_to_drive(pdf_bytes: bytes, filename: str):
             supportsAllDrives=True
         ).execute()
         file_url = file.get('webViewLink', '')
-        import time
         time.sleep(0.5)
         return True, f"PDF uploaded successfully: {file.get('name')}", file_url
     
     except Exception as e:
-        return False, f"Failed to save PDF to Google Drive: {str(e)}"
+        return False, f"Failed to save PDF to Google Drive: {str(e)}", None
     
     finally:
-        if temp_file and os.path.exists(temp_file_path):
-            try:
-                # Try to close and delete the file
-                os.close(os.open(temp_file_path, os.O_RDONLY))
-                os.remove(temp_file_path)
-            except Exception as e:
-                print(f"Warning: Could not delete temporary file: {str(e)}")
+        if hasattr(pdf_source, "close"):
+            pdf_source.close()
                 
 def save_to_google_sheet(file_url, json_data, user_comment):
     try:
-        import gspread
-        credentials = service_account.Credentials.from_service_account_info(
-            st.secrets["gcp_service_account"],
-            scopes=[
-                'https://www.googleapis.com/auth/spreadsheets',
-                'https://www.googleapis.com/auth/drive'
-            ]
-        )
         # Create gspread client
-        gc = gspread.authorize(credentials)
+        gc = _gspread_client([
+            'https://www.googleapis.com/auth/spreadsheets',
+            'https://www.googleapis.com/auth/drive'
+        ])
         spreadsheet_id = "1n_jJ9Lq1lhNvQ6tWXZra4d4H_fLemXIqmHTyuWf4qEc"
         sheet = gc.open_by_key(spreadsheet_id).sheet1  # Using the first sheet
         json_str = json.dumps(json_data)
@@ -824,24 +2510,250 @@ def save_to_google_sheet(file_url, json_data, user_comment):
     except Exception as e:
         return False, f"Failed to save to Google Sheet: {str(e)}"
 
+AUDIT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at TEXT NOT NULL,
+    pdf_sha256 TEXT,
+    file_name TEXT,
+    institution TEXT,
+    institution_normalized TEXT,
+    org_code TEXT,
+    mapping_version TEXT,
+    match_statistics TEXT,
+    timings TEXT,
+    token_usage TEXT,
+    result TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_pdf_sha256 ON runs (pdf_sha256);
+CREATE INDEX IF NOT EXISTS runs_institution_created ON runs (institution_normalized, created_at);
+CREATE INDEX IF NOT EXISTS runs_created ON runs (created_at);
+
+CREATE TABLE IF NOT EXISTS course_results (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    created_at TEXT NOT NULL,
+    institution_normalized TEXT,
+    org_code TEXT,
+    term TEXT,
+    year TEXT,
+    term_code TEXT,
+    course_code TEXT,
+    title TEXT,
+    grade TEXT,
+    credits TEXT,
+    matched INTEGER NOT NULL,
+    data_from TEXT,
+    matched_on TEXT,
+    macu_course_code TEXT,
+    macu_course_title TEXT,
+    no_match_reason TEXT
+);
+CREATE INDEX IF NOT EXISTS course_results_run ON course_results (run_id);
+CREATE INDEX IF NOT EXISTS course_results_lookup ON course_results (institution_normalized, matched, year, term_code);
+CREATE INDEX IF NOT EXISTS course_results_created ON course_results (created_at);
+
+CREATE TABLE IF NOT EXISTS feedback (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    created_at TEXT NOT NULL,
+    status TEXT NOT NULL,
+    feedback TEXT,
+    file_url TEXT
+);
+CREATE INDEX IF NOT EXISTS feedback_run ON feedback (run_id);
+
+CREATE TABLE IF NOT EXISTS transcript_versions (
+    run_id INTEGER PRIMARY KEY REFERENCES runs (id),
+    student_key TEXT NOT NULL,
+    page_digests TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS transcript_versions_student ON transcript_versions (student_key, run_id);
+"""
+
+class AuditStore:
+    """Append-only SQLite log of processing runs, per-course match results and feedback.
+
+    Runs are indexed by PDF hash, institution and date and each course is a
+    row in course_results, so questions like "all unmatched courses from
+    institution X this term" are indexed queries. Runs of transcripts with a
+    recognizable student also store per-page digests in transcript_versions,
+    so a later version of the same transcript can reuse the stored terms.
+    Every call opens its own connection, so the store is safe to share
+    between sessions.
+    """
+    def __init__(self, path):
+        self.path = path
+        with self._connection() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(AUDIT_SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @contextmanager
+    def _connection(self):
+        """Connection that commits on success and is always closed."""
+        conn = self._connect()
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def record_run(self, json_data, pdf_sha256=None, file_name=None, org_code="", mapping_version=None,
+                   timings=None, token_usage=None):
+        """Store one processing run and its course rows; returns the run id."""
+        created_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        institution = json_data[0].get("institution", "") if json_data else ""
+        institution_normalized = normalize_institution_name(institution)
+        with self._connection() as conn:
+            cursor = conn.execute(
+                "INSERT INTO runs (created_at, pdf_sha256, file_name, institution, institution_normalized, org_code, "
+                "mapping_version, match_statistics, timings, token_usage, result) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (created_at, pdf_sha256, file_name, institution, institution_normalized, org_code, mapping_version,
+                 json.dumps(json_data[0].get("match_statistics") if json_data else None),
+                 json.dumps(timings), json.dumps(token_usage), json.dumps(json_data))
+            )
+            run_id = cursor.lastrowid
+            conn.executemany(
+                "INSERT INTO course_results (run_id, created_at, institution_normalized, org_code, term, year, term_code, "
+                "course_code, title, grade, credits, matched, data_from, matched_on, macu_course_code, "
+                "macu_course_title, no_match_reason) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (run_id, created_at, institution_normalized, org_code, term.get("term", ""), str(term.get("year", "")),
+                     get_term_code(term.get("term", "")), course.get("course_code", ""), course.get("title", ""),
+                     course.get("grade", ""), str(course.get("credits", "")),
+                     int(str(course.get("data_from", "")).strip() in ("CEP", "CEQMACU")),
+                     str(course.get("data_from", "")).strip(), course.get("matched_on", ""),
+                     course.get("macu_course_code", ""), course.get("macu_course_title", ""),
+                     course.get("no_match_reason", ""))
+                    for term in json_data for course in term.get("courses", [])
+                ]
+            )
+            version = json_data[0].get("transcript_version") if json_data else None
+            if version and version.get("student_key"):
+                conn.execute(
+                    "INSERT INTO transcript_versions (run_id, student_key, page_digests) VALUES (?, ?, ?)",
+                    (run_id, version["student_key"], json.dumps(version["page_digests"]))
+                )
+        return run_id
+
+    def record_feedback(self, run_id, status, feedback=None, file_url=None):
+        """Append a feedback event ('submitted' or 'skipped') for a run."""
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT INTO feedback (run_id, created_at, status, feedback, file_url) VALUES (?, ?, ?, ?, ?)",
+                (run_id, datetime.now(timezone.utc).isoformat(timespec="seconds"), status, feedback, file_url)
+            )
+
+    def runs_for_pdf(self, pdf_sha256):
+        with self._connection() as conn:
+            return [dict(row) for row in conn.execute(
+                "SELECT id, created_at, file_name, institution, org_code FROM runs WHERE pdf_sha256 = ? ORDER BY id",
+                (pdf_sha256,)
+            )]
+
+    def latest_version(self, student_key):
+        """Most recent run of a transcript with this student key: run id, page digests, result and mapping version."""
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT v.run_id, v.page_digests, r.result, r.mapping_version FROM transcript_versions v "
+                "JOIN runs r ON r.id = v.run_id WHERE v.student_key = ? ORDER BY v.run_id DESC LIMIT 1",
+                (student_key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "run_id": row["run_id"],
+            "page_digests": json.loads(row["page_digests"]),
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "mapping_version": row["mapping_version"],
+        }
+
+    def unmatched_courses(self, institution=None, year=None, term_code=None, since=None, limit=5000):
+        """Unmatched course rows, optionally filtered by institution, term and date (ISO)."""
+        clauses = ["matched = 0"]
+        params = []
+        if institution:
+            clauses.append("institution_normalized = ?")
+            params.append(normalize_institution_name(institution))
+        if year:
+            clauses.append("year = ?")
+            params.append(str(year))
+        if term_code:
+            clauses.append("term_code = ?")
+            params.append(term_code)
+        if since:
+            clauses.append("created_at >= ?")
+            params.append(since)
+        query = (
+            "SELECT run_id, created_at, institution_normalized AS institution, org_code, term, year, term_code, "
+            "course_code, title, grade, credits, data_from, no_match_reason FROM course_results WHERE "
+            + " AND ".join(clauses) + " ORDER BY created_at DESC LIMIT ?"
+        )
+        params.append(limit)
+        with self._connection() as conn:
+            return [dict(row) for row in conn.execute(query, params)]
+
+    def institutions(self):
+        with self._connection() as conn:
+            return [row[0] for row in conn.execute(
+                "SELECT DISTINCT institution_normalized FROM runs WHERE institution_normalized != '' ORDER BY 1"
+            )]
+
+    def iter_transcripts(self, institution=None, since=None):
+        """Yield (source, json_data) for stored runs, one at a time (for export_course_table)."""
+        clauses = ["1 = 1"]
+        params = []
+        if institution:
+            clauses.append("institution_normalized = ?")
+            params.append(normalize_institution_name(institution))
+        if since:
+            clauses.append("created_at >= ?")
+            params.append(since)
+        conn = self._connect()
+        try:
+            for row in conn.execute(
+                "SELECT id, file_name, result FROM runs WHERE " + " AND ".join(clauses) + " ORDER BY id", params
+            ):
+                yield f"{row['id']}:{row['file_name'] or ''}", json.loads(row["result"])
+        finally:
+            conn.close()
+
+def app_data_dir():
+    """Per-user directory for local app data (``data_dir`` secret), kept out of the source tree."""
+    default = os.path.join(os.environ.get("XDG_DATA_HOME") or os.path.join(os.path.expanduser("~"), ".local", "share"),
+                           "jody_macu")
+    path = st.secrets.get("data_dir", default)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+@st.cache_resource(show_spinner=False)
+def get_audit_store():
+    """The audit store shared by every session in this process (``audit_db_path`` secret)."""
+    path = st.secrets.get("audit_db_path") or os.path.join(app_data_dir(), "transcript_audit.db")
+    return AuditStore(path)
+
+def sha256_stream(stream, chunk_size=ARTIFACT_CHUNK_SIZE):
+    digest = hashlib.sha256()
+    stream.seek(0)
+    for chunk in iter(lambda: stream.read(chunk_size), b""):
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.hexdigest()
+
 def load_macu_mappings_from_sheets():
     try:
         import gspread
-        credentials = service_account.Credentials.from_service_account_info(
-            st.secrets["gcp_service_account"],
-            scopes=[
-                'https://www.googleapis.com/auth/spreadsheets.readonly',
-                'https://www.googleapis.com/auth/drive.readonly'
-            ]
-        )
-
-        gc = gspread.authorize(credentials)
+        gc = _gspread_client(READONLY_SCOPES)
         spreadsheet_id = "1p2_1E25dYfWWb2ugfsFSdDPss-ahzGBxaQ41YUkVRK4"
         try:
             spreadsheet = gc.open_by_key(spreadsheet_id)
 
         except Exception as e:
-            st.error(f"Failed to open spreadsheet: {str(e)}")
+            report_error(f"Failed to open spreadsheet: {str(e)}")
             return pd.DataFrame()
 
         target_sheets = ["2020-2021", "2021-2022", "2022-2023", "2023-2024", "2024-2025","2025-2026"]
@@ -852,13 +2764,13 @@ def load_macu_mappings_from_sheets():
                     sheet = spreadsheet.worksheet(sheet_name)
                     # Removed debug output
                 except gspread.exceptions.WorksheetNotFound:
-                    st.warning(f"Sheet '{sheet_name}' not found in spreadsheet")
+                    report_warning(f"Sheet '{sheet_name}' not found in spreadsheet")
                     continue
 
                 sheet_values = sheet.get_all_values()
                 # Skip empty sheets
                 if not sheet_values or len(sheet_values) <= 2:  # Need at least header row + column names + one data row
-                    st.warning(f"Sheet '{sheet_name}' is empty or contains insufficient data")
+                    report_warning(f"Sheet '{sheet_name}' is empty or contains insufficient data")
                     continue
                 headers = sheet_values[1]  # Second row as headers
                 data = sheet_values[2:]
@@ -868,19 +2780,388 @@ def load_macu_mappings_from_sheets():
                 all_data = pd.concat([all_data, df], ignore_index=True)
                 # Removed debug output
             except Exception as e:
-                st.error(f"Error loading data from sheet {sheet_name}: {str(e)}")
+                report_error(f"Error loading data from sheet {sheet_name}: {str(e)}")
                 continue
         # Check if we got any data
         if all_data.empty:
-            st.error("Failed to load any data from the spreadsheets")
+            report_error("Failed to load any data from the spreadsheets")
             return pd.DataFrame()
         
         # Removed success message and columns listing
         return all_data
     except Exception as e:
-        st.error(f"Error loading course mappings from Google Sheets: {str(e)}")
+        report_error(f"Error loading course mappings from Google Sheets: {str(e)}")
         return pd.DataFrame()
                     
+MAPPING_REFRESH_INTERVAL = 15 * 60  # seconds between background reloads of the mapping sheets
+
+MappingSnapshot = namedtuple(
+    "MappingSnapshot",
+    ["version", "loaded_at", "institution_df", "macu_df", "cep_catalog", "ceqmacu_df", "errors"],
+)
+
+def _frame_digest(df):
+    """Content hash of a DataFrame, used to version the mapping data."""
+    if df is None or df.empty:
+        return "empty"
+    digest = hashlib.sha1(",".join(map(str, df.columns)).encode("utf-8"))
+    digest.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return digest.hexdigest()
+
+def load_mapping_snapshot(previous=None):
+    """Load and prepare the SchoolInstitutions, CEP and CEQMACU sheets.
+
+    A dataset that fails to load keeps its copy from ``previous`` (serving
+    stale data beats serving none). This usually runs on the cache's
+    background thread, where nothing can be shown on a page, so the loaders'
+    errors and warnings are recorded in ``errors`` instead.
+    """
+    errors = []
+    frames = {}
+    for name, loader in [("institution_df", load_institution_mappings),
+                         ("macu_df", load_macu_mappings_from_sheets),
+                         ("ceqmacu_df", load_ceqmacu_mappings)]:
+        with collect_messages() as messages:
+            try:
+                df = loader()
+            except Exception as e:
+                df = pd.DataFrame()
+                messages["errors"].append(str(e))
+        errors += [f"{name}: {message}" for message in messages["errors"] + messages["warnings"]]
+        if df.empty and not messages["errors"]:
+            errors.append(f"{name}: no data loaded")
+        if df.empty and previous is not None and not getattr(previous, name).empty:
+            errors.append(f"{name}: keeping previously loaded version")
+            frames[name] = getattr(previous, name)
+        else:
+            frames[name] = df
+
+    version = hashlib.sha1("|".join(_frame_digest(frames[name]) for name in sorted(frames)).encode("utf-8")).hexdigest()[:12]
+    if previous is not None and previous.version == version:
+        # Nothing changed upstream; keep the already prepared catalogs
+        return previous._replace(loaded_at=time.time(), errors=errors)
+
+    macu_df = frames["macu_df"]
+    institution_df = prepare_institution_catalog(frames["institution_df"])
+    cep_catalog = None
+    if not macu_df.empty:
+        cep_catalog = prepare_cep_catalog(macu_df, institution_df)
+        if cep_catalog is None:
+            errors.append("macu_df: no suitable column found for combined course code and title matching")
+        else:
+            # Build the whole-catalog approximate index here, off the request path
+            cep_title_index(cep_catalog)
+    return MappingSnapshot(
+        version=version,
+        loaded_at=time.time(),
+        institution_df=institution_df,
+        macu_df=macu_df,
+        cep_catalog=cep_catalog,
+        ceqmacu_df=prepare_ceqmacu_catalog(frames["ceqmacu_df"]),
+        errors=errors,
+    )
+
+class MappingCache:
+    """Process-wide cache of the prepared mapping datasets.
+
+    Every session reads the current immutable MappingSnapshot. A daemon thread
+    performs the first load as soon as the cache is created, then reloads the
+    sheets every ``refresh_interval`` seconds and swaps the new snapshot in
+    with a single assignment, so readers never wait on a refresh; only callers
+    that need data before the first load has finished block.
+    """
+    def __init__(self, loader=load_mapping_snapshot, refresh_interval=MAPPING_REFRESH_INTERVAL):
+        self._loader = loader
+        self.refresh_interval = refresh_interval
+        self._snapshot = None
+        self._reload_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._first_load_done = threading.Event()
+        self.last_error = None
+        threading.Thread(target=self._refresh_loop, name="mapping-cache-refresh", daemon=True).start()
+
+    def current(self):
+        """Return the current snapshot without waiting; None until the first load finishes."""
+        return self._snapshot
+
+    def snapshot(self):
+        """Return the current snapshot, waiting for the first load if it is still in flight."""
+        snapshot = self._snapshot
+        if snapshot is None:
+            self._first_load_done.wait()
+            if self._snapshot is None:
+                # The background load failed; retry here so the error reaches the caller
+                with self._reload_lock:
+                    if self._snapshot is None:
+                        self._reload_locked()
+            snapshot = self._snapshot
+        return snapshot
+
+    def refresh(self, block=False):
+        """Reload the mapping data now; in the background unless ``block`` is set."""
+        if block:
+            with self._reload_lock:
+                self._reload_locked()
+        else:
+            self._wake.set()
+
+    def _refresh_loop(self):
+        first_load = True
+        while True:
+            if not first_load:
+                self._wake.wait(self.refresh_interval)
+                self._wake.clear()
+            try:
+                with self._reload_lock:
+                    self._reload_locked()
+            except Exception as e:
+                self.last_error = str(e)
+            finally:
+                if first_load:
+                    first_load = False
+                    self._first_load_done.set()
+
+    def _reload_locked(self):
+        snapshot = self._loader(self._snapshot)
+        self.last_error = "; ".join(snapshot.errors) or None
+        self._snapshot = snapshot
+
+MATCH_MEMO_SIZE = 50000  # course match outcomes kept across all sessions
+
+class MatchMemo:
+    """Bounded LRU of course match outcomes shared across transcripts.
+
+    Entries are tagged with the mapping data version they were computed
+    against; the first lookup with a different version clears the memo.
+    """
+    def __init__(self, maxsize=MATCH_MEMO_SIZE):
+        self.maxsize = maxsize
+        self.version = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _check_version(self, version):
+        if version != self.version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self.version = version
+
+    def get(self, version, key):
+        with self._lock:
+            self._check_version(version)
+            outcome = self._entries.get(key)
+            if outcome is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return outcome
+
+    def put(self, version, key, outcome):
+        with self._lock:
+            self._check_version(version)
+            self._entries[key] = outcome
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.version = None
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "version": self.version,
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+@st.cache_resource(show_spinner=False)
+def get_match_memo():
+    """The course match memo shared by every session in this process."""
+    return MatchMemo()
+
+@st.cache_resource(show_spinner=False)
+def get_mapping_cache():
+    """The mapping cache shared by every session in this process."""
+    return MappingCache(refresh_interval=st.secrets.get("mapping_refresh_seconds", MAPPING_REFRESH_INTERVAL))
+
+def is_admin():
+    """Sidebar admin login; admin tools are hidden unless ``admin_password`` is configured."""
+    if "admin_password" not in st.secrets:
+        return False
+    if not st.session_state.get("is_admin"):
+        with st.sidebar.expander("Administration"):
+            admin_password = st.text_input("Admin password:", type="password", key="admin_password_input")
+            if admin_password and admin_password == st.secrets["admin_password"]:
+                st.session_state["is_admin"] = True
+                del st.session_state["admin_password_input"]
+                st.rerun()
+            elif admin_password:
+                st.error("Incorrect admin password.")
+    return bool(st.session_state.get("is_admin"))
+
+def show_admin_tools():
+    """Admin-only sidebar panel for the shared caches."""
+    mapping_cache = get_mapping_cache()
+    snapshot = mapping_cache.current()
+    st.sidebar.subheader("Administration")
+    if snapshot is None:
+        st.sidebar.caption("Mapping data is still loading...")
+        return
+    st.sidebar.caption(
+        f"Mapping data version {snapshot.version}, loaded "
+        f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(snapshot.loaded_at))}"
+    )
+    st.sidebar.caption(
+        f"Institutions: {len(snapshot.institution_df)} | CEP rows: {len(snapshot.macu_df)} | "
+        f"CEQMACU rows: {len(snapshot.ceqmacu_df)}"
+    )
+    if mapping_cache.last_error:
+        st.sidebar.warning(f"Last mapping refresh: {mapping_cache.last_error}")
+    memo_stats = get_match_memo().stats()
+    st.sidebar.caption(
+        f"Match memo: {memo_stats['size']}/{memo_stats['maxsize']} entries, "
+        f"{memo_stats['hits']} hits / {memo_stats['misses']} misses "
+        f"({memo_stats['hit_rate']:.0%}), {memo_stats['evictions']} evictions, "
+        f"{memo_stats['invalidations']} invalidations"
+    )
+    st.sidebar.checkbox(
+        "Profile the next transcript run", key="profile_next_run",
+        help="CPU profile and allocation trace of extraction, mapping load, enrichment and rendering"
+    )
+    if st.sidebar.button("Reload mapping data"):
+        with st.spinner("Reloading mapping data..."):
+            mapping_cache.refresh(block=True)
+        st.sidebar.success(f"Mapping data reloaded (version {mapping_cache.snapshot().version})")
+
+PROFILE_TRACEBACK_FRAMES = 10    # frames kept per traced allocation
+PROFILE_TOP_ALLOCATIONS = 40
+PROFILE_TOP_FUNCTIONS = 60
+
+def get_profile_dir():
+    """Local directory for "profile this run" reports (``profile_dir`` secret), under app_data_dir by default."""
+    path = st.secrets.get("profile_dir") or os.path.join(app_data_dir(), "profiles")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+class RunProfiler:
+    """CPU profile and allocation trace of one transcript run, for the admin profile mode.
+
+    cProfile only sees the thread that enables it, so a profiled run reloads
+    the mapping data on its own thread instead of relying on the background
+    refresher. Stages can span Streamlit reruns (processing, then rendering).
+    tracemalloc is process-wide and slows every session, so it only traces
+    inside a stage and is stopped when the stage ends, however it ends.
+    Nothing here is imported or started unless a run is profiled.
+    """
+    def __init__(self, name):
+        import cProfile
+        self.name = name
+        self.stages = {}
+        self.allocations = {}
+        self._profile = cProfile.Profile()
+
+    @contextmanager
+    def stage(self, name):
+        """Profile the enclosed block, trace its allocations and record its wall time under ``name``."""
+        import tracemalloc
+        # Another admin's profile may already be tracing; leave it running then
+        owns_tracemalloc = not tracemalloc.is_tracing()
+        if owns_tracemalloc:
+            tracemalloc.start(PROFILE_TRACEBACK_FRAMES)
+        try:
+            start = time.perf_counter()
+            self._profile.enable()
+            try:
+                yield
+            finally:
+                self._profile.disable()
+                self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+                self._record_allocations(name)
+        finally:
+            if owns_tracemalloc:
+                tracemalloc.stop()
+
+    def _record_allocations(self, name):
+        """Keep the top allocations still live at the end of a stage (as text, so the snapshot can go)."""
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            return
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        ])
+        current_bytes, peak_bytes = tracemalloc.get_traced_memory()
+        self.allocations[name] = {
+            "current_bytes": current_bytes,
+            "peak_bytes": peak_bytes,
+            "lines": [str(stat) for stat in snapshot.statistics("lineno")[:PROFILE_TOP_ALLOCATIONS]],
+            "tracebacks": [(stat.size, stat.count, stat.traceback.format())
+                           for stat in snapshot.statistics("traceback")[:10]],
+        }
+
+    def finish(self, output_dir):
+        """Write the .prof file and a text report; returns both paths."""
+        import pstats
+        safe_name = re.sub(r"[^A-Za-z0-9_.-]+", "_", os.path.splitext(self.name)[0]) or "run"
+        base_path = os.path.join(output_dir, f"{time.strftime('%Y%m%d-%H%M%S')}_{safe_name}")
+        profile_path = base_path + ".prof"
+        report_path = base_path + "_report.txt"
+        self._profile.dump_stats(profile_path)
+        
+        with open(report_path, "w", encoding="utf-8") as report:
+            report.write(f"Profile of {self.name}\n\nStages (wall time):\n")
+            for stage, seconds in self.stages.items():
+                report.write(f"  {stage}: {seconds:.3f}s\n")
+            for stage, allocations in self.allocations.items():
+                report.write(
+                    f"\nStage {stage}: traced memory {allocations['current_bytes'] / 1024 / 1024:.1f} MB live, "
+                    f"{allocations['peak_bytes'] / 1024 / 1024:.1f} MB peak\n"
+                )
+                report.write(f"\nTop {PROFILE_TOP_ALLOCATIONS} allocations live at the end of {stage}, by line:\n")
+                for line in allocations["lines"]:
+                    report.write(f"  {line}\n")
+                report.write(f"\nTop 10 allocations live at the end of {stage}, by traceback:\n")
+                for size, count, traceback_lines in allocations["tracebacks"]:
+                    report.write(f"\n  {size / 1024:.1f} KiB in {count} blocks\n")
+                    for line in traceback_lines:
+                        report.write(f"    {line}\n")
+            report.write(f"\nTop {PROFILE_TOP_FUNCTIONS} functions by cumulative time:\n")
+            pstats.Stats(self._profile, stream=report).sort_stats("cumulative").print_stats(PROFILE_TOP_FUNCTIONS)
+        return [profile_path, report_path]
+
+def show_profile_reports():
+    """Download buttons for the reports of the last profiled run."""
+    with st.expander("Profile of the last run", expanded=True):
+        for path in st.session_state.get("profile_reports") or []:
+            if not os.path.exists(path):
+                continue
+            with open(path, "rb") as report_file:
+                st.download_button(
+                    f"Download {os.path.basename(path)}",
+                    data=report_file.read(),
+                    file_name=os.path.basename(path),
+                    mime="application/octet-stream" if path.endswith(".prof") else "text/plain",
+                    key=f"profile_download_{path}"
+                )
+        st.caption(f"Reports are kept in {get_profile_dir()}; open .prof files with snakeviz or pstats.")
+
 # Prompt template for Claude
 PROMPT = """
 # Transcript Data Extraction Prompt
@@ -978,41 +3259,459 @@ Return the extracted data in the following **JSON structure**:
 - If any required information is missing from a course, leave the value as an empty string ("") rather than omitting the field.
 - The institution name should be included at the term level in the JSON structure.
 """
-def main():
-    st.set_page_config(page_title="Transcript Analyzer", layout="wide")
-    st.title("🔍 Academic Transcript Analyzer")
+
+def record_audit_run(json_data, pdf_sha256, file_name, timings, token_usage, mapping_snapshot=None):
+    """Log a processing run to the audit store; returns the run id (None if logging failed).
+
+    ``mapping_snapshot`` is the mapping data the run was enriched with; the
+    shared cache's current one by default.
+    """
+    try:
+        if mapping_snapshot is None:
+            mapping_snapshot = get_mapping_cache().current()
+        org_code = ""
+        if mapping_snapshot is not None and json_data[0].get("institution"):
+            org_code = match_institution_code(json_data[0]["institution"], mapping_snapshot.institution_df)
+        return get_audit_store().record_run(
+            json_data,
+            pdf_sha256=pdf_sha256,
+            file_name=file_name,
+            org_code=org_code,
+            mapping_version=mapping_snapshot.version if mapping_snapshot is not None else None,
+            timings=timings,
+            token_usage=token_usage
+        )
+    except Exception as e:
+        report_warning(f"Could not record this run in the audit store: {str(e)}")
+        return None
+
+def record_audit_feedback(status, feedback=None, file_url=None):
+    run_id = st.session_state.get("audit_run_id")
+    if run_id is None:
+        return
+    try:
+        get_audit_store().record_feedback(run_id, status, feedback, file_url)
+    except Exception as e:
+        st.warning(f"Could not record feedback in the audit store: {str(e)}")
+
+# Recognizing an updated version of a transcript processed before
+STUDENT_ID_PATTERN = re.compile(
+    r"\bstudent\s*(?:id|number|no\.?|#)\s*[:#]?\s*([a-z0-9][a-z0-9-]{3,})"
+    r"|\bid\s*(?:number|no\.?|#)?\s*[:#]\s*([a-z0-9][a-z0-9-]{3,})"
+)
+# Issuing school in a transcript header: up to four words before "college" etc., plus an "of ..." tail
+_HEADER_WORD = r"(?!(?:official|transcript|student|name|id|page|term|date|record|of)\b)[a-z&'.-]+"
+INSTITUTION_NAME_PATTERN = re.compile(
+    rf"\b(?:{_HEADER_WORD} ){{0,4}}(?:college|university|institute|academy)\b(?: of(?: {_HEADER_WORD}){{1,3}})?"
+)
+# Print dates and times in headers would otherwise make every page look changed
+PRINT_DATE_PATTERN = re.compile(
+    r"\b\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4}\b|\b\d{4}-\d{2}-\d{2}\b"
+    r"|\b(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?\s+\d{1,2},?\s+\d{4}\b"
+    r"|\b\d{1,2}:\d{2}(?::\d{2})?\s*(?:am|pm)?\b"
+)
+# Term headings ("Fall 2023", "Spring Semester 2024", "2023 Summer") in normalized page text
+TERM_HEADING_PATTERN = re.compile(
+    r"\b(?:fall|spring|summer|winter)\b[a-z ]{0,20}?\b(?:19|20)\d{2}\b|\b(?:19|20)\d{2} ?(?:fall|spring|summer|winter)\b"
+)
+TERM_SEQUENCE = {"TS": 0, "TU": 1, "TF": 2}
+INCREMENTAL_PROMPT_NOTE = """
+## **Partial Transcript**
+These pages are an excerpt of a longer transcript (plus its explanation page, if it has one). Extract every term and
+course that appears on them, including terms that begin or end outside the excerpt, using the same rules and output
+format as above.
+"""
+
+def _student_key(first_page_text):
+    """Hash of the issuing school and student id on a normalized first page, or None.
+
+    Ids are only unique within a school, so both are required; names are not
+    unique enough to reuse another transcript's stored terms.
+    """
+    match = STUDENT_ID_PATTERN.search(first_page_text)
+    student_id = next((value for value in (match.groups() if match else ()) if value and re.search(r"\d", value)), None)
+    institution = INSTITUTION_NAME_PATTERN.search(first_page_text)
+    if not student_id or not institution:
+        return None
+    key = f"id:{normalize_institution_name(institution.group(0))}:{student_id}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+def transcript_fingerprint(pdf_stream):
+    """Student key and per-page text digests used to recognize a newer version of a transcript.
+
+    ``student_key`` (see _student_key) is None when the first page has no
+    student id and school name, or when any page is a scan without a text
+    layer (those can't be compared page by page).
+    """
+    from PyPDF2 import PdfReader
+    pdf_stream.seek(0)
+    try:
+        reader = PdfReader(pdf_stream)
+        texts = []
+        for page in reader.pages:
+            text = PRINT_DATE_PATTERN.sub("", _normalize_page_text(page.extract_text()))
+            if not text and any(stream.get("/Subtype") == "/Image" for stream in _page_xobjects(page).values()):
+                return None
+            texts.append(re.sub(r"\s+", " ", text).strip())
+    except Exception:
+        return None
+    finally:
+        pdf_stream.seek(0)
+    if not texts:
+        return None
     
-    # Initialize session state variables
-    for key in ["pdf_processed", "feedback_submitted", "feedback_skipped", 
-                "uploaded_file_name", "pdf_bytes", "drive_upload_status"]:
-        if key not in st.session_state:
-            st.session_state[key] = False if key in ["pdf_processed", "feedback_submitted", "feedback_skipped"] else None
+    return {
+        "student_key": _student_key(texts[0]),
+        "page_digests": [hashlib.sha1(text.encode("utf-8")).hexdigest()[:16] if text else "" for text in texts],
+        "explanation_pages": [index for index, text in enumerate(texts)
+                              if any(marker in text for marker in EXPLANATION_PAGE_MARKERS)],
+        "heading_pages": [index for index, text in enumerate(texts) if TERM_HEADING_PATTERN.search(text)],
+        "page_terms": [[_heading_term_key(match.group(0)) for match in TERM_HEADING_PATTERN.finditer(text)]
+                       for text in texts],
+    }
+
+def _heading_term_key(heading):
+    """The _term_key of a TERM_HEADING_PATTERN match."""
+    season = re.search(r"fall|spring|summer|winter", heading).group(0)
+    return get_term_code(season) or season, re.search(r"(?:19|20)\d{2}", heading).group(0)
+
+def _term_page_spans(page_terms, explanation_pages):
+    """(first, last) page of each headed term: from its heading to the next other term's heading.
+
+    The page holding the next heading is included, since the term may run on
+    above it; the last term runs to the end of the transcript.
+    """
+    occurrences = [(index, key) for index, keys in enumerate(page_terms) if index not in explanation_pages
+                   for key in keys]
+    spans = {}
+    for position, (index, key) in enumerate(occurrences):
+        end = next((page for page, other in occurrences[position + 1:] if other != key), len(page_terms) - 1)
+        start, last = spans.get(key, (index, end))
+        spans[key] = (min(start, index), max(last, end))
+    return spans
+
+def plan_incremental_extraction(fingerprint, audit_store):
+    """Pages to re-extract when this PDF is a newer version of a stored transcript; None when it isn't.
+
+    It is a newer version when the latest run for the same student key shares
+    at least one identical (non-explanation) page. Each run of changed pages
+    is sent together with the pages back to the last term heading before it,
+    so courses continuing a term started earlier still get their heading
+    (just the page before when no headings are recognized), plus the first
+    explanation page. An empty page list means nothing changed.
+    ``replace_terms`` are the keys of headed terms whose pages are all sent;
+    merge_transcript_terms replaces those instead of merging them.
+    """
+    if not fingerprint or not fingerprint["student_key"]:
+        return None
+    previous = audit_store.latest_version(fingerprint["student_key"])
+    if previous is None or not previous["result"]:
+        return None
+    previous_digests = set(previous["page_digests"])
+    digests = fingerprint["page_digests"]
+    explanation_pages = fingerprint["explanation_pages"]
+    if not any(digest and digest in previous_digests
+               for index, digest in enumerate(digests) if index not in explanation_pages):
+        return None
     
-    # Step 1: Ask for password
-    if not check_password():
-        st.warning("Please enter the password to access the transcript analyzer.")
-        st.stop()  # Don't run the rest of the app until the correct password is entered
+    changed = [index for index, digest in enumerate(digests)
+               if digest and digest not in previous_digests and index not in explanation_pages]
+    heading_pages = [index for index in fingerprint.get("heading_pages", []) if index not in explanation_pages]
+    pages = set(changed)
+    for index in changed:
+        if index > 0 and index - 1 not in changed:
+            earlier = [page for page in heading_pages if page < index]
+            start = earlier[-1] if earlier else 0 if heading_pages else index - 1
+            pages.update(range(start, index))
+    if pages and explanation_pages:
+        pages.add(explanation_pages[0])
+    spans = _term_page_spans(fingerprint.get("page_terms", []), explanation_pages) if pages else {}
+    replace_terms = sorted(key for key, (start, end) in spans.items()
+                           if all(page in pages or page in explanation_pages for page in range(start, end + 1)))
+    return {
+        "run_id": previous["run_id"],
+        "previous": previous["result"],
+        "mapping_version": previous["mapping_version"],
+        "pages": sorted(pages),
+        "changed_pages": changed,
+        "replace_terms": replace_terms,
+        "total_pages": len(digests),
+    }
 
-    st.success("Access granted. You may now upload and analyze transcripts.")
+def select_pdf_pages(pdf_stream, pages):
+    """A new PDF holding only the given (0-based) pages."""
+    from PyPDF2 import PdfReader, PdfWriter
+    pdf_stream.seek(0)
+    reader = PdfReader(pdf_stream)
+    writer = PdfWriter()
+    for index in pages:
+        writer.add_page(reader.pages[index])
+    output = io.BytesIO()
+    writer.write(output)
+    output.seek(0)
+    pdf_stream.seek(0)
+    return output
+
+def _term_key(term):
+    name = str(term.get("term", ""))
+    return get_term_code(name) or name.strip().lower(), str(term.get("year", "")).strip()
+
+def _term_sort_key(term):
+    code, year = _term_key(term)
+    return int(year) if year.isdigit() else 0, TERM_SEQUENCE.get(code, 1)
+
+def merge_transcript_terms(previous, extracted, replace_terms=()):
+    """Merge a partial re-extraction into a previously processed term list.
+
+    A re-extracted term whose key (see _term_key) is in ``replace_terms``,
+    i.e. all of whose pages were sent, replaces the stored term outright.
+    Any other re-extracted term replaces the stored one course by course:
+    courses it lists replace their stored copies (matched by course code),
+    and stored courses it doesn't list are kept, since they sit on pages that
+    were not sent. New terms are added and the list is put in chronological
+    order. ``previous`` is modified. Returns (merged, touched) where
+    ``touched`` are the merged terms that hold re-extracted courses.
+    """
+    for key in ("match_statistics", "credit_summary", "transcript_version", "validation"):
+        if previous:
+            previous[0].pop(key, None)
+    institution = previous[0].get("institution", "") if previous else ""
+    positions = {_term_key(term): index for index, term in enumerate(previous)}
+    merged = list(previous)
+    touched = []
+    for term in extracted:
+        if not term.get("institution"):
+            term["institution"] = institution
+        position = positions.get(_term_key(term))
+        if position is None:
+            positions[_term_key(term)] = len(merged)
+            merged.append(term)
+        elif _term_key(term) in replace_terms:
+            merged[position] = term
+        else:
+            remaining = {}
+            for course in term.get("courses", []):
+                code = normalize_course_text(course.get("course_code", ""))
+                remaining[code] = remaining.get(code, 0) + 1
+            kept = []
+            for course in merged[position].get("courses", []):
+                code = normalize_course_text(course.get("course_code", ""))
+                if remaining.get(code):
+                    remaining[code] -= 1
+                else:
+                    kept.append(course)
+            term["courses"] = kept + term.get("courses", [])
+            merged[position] = term
+        touched.append(term)
+    merged.sort(key=_term_sort_key)
+    return merged, touched
+
+def run_transcript_pipeline(pdf_stream, mapping_cache, prompt=PROMPT, timings=None):
+    """Extract, post-process and enrich one transcript.
+
+    When the PDF is a newer version of a transcript already in the audit
+    store (see plan_incremental_extraction), only its new or changed pages
+    are extracted and enriched and the stored terms are reused. The PDF is
+    pruned and downsampled locally before the model call (see
+    preprocess_pdf). The mapping data is loaded by the cache's own background
+    thread, so it is fetched and prepared while the model call is in flight;
+    enrichment waits only for whichever of the two finishes last. Returns
+    (json_data, claude_response, token_usage); json_data is None when either
+    branch failed, after the error has been reported. Stage durations in
+    seconds are written to ``timings`` when given.
+    """
+    timings = {} if timings is None else timings
     
-    # Show upload status from previous submission if available
-    if st.session_state.get("drive_upload_status") == "success":
-        st.success("Previous PDF was successfully saved to Google Drive.")
-        # Clear the status to avoid showing it repeatedly
-        st.session_state["drive_upload_status"] = None
+    fingerprint = plan = None
+    if st.secrets.get("incremental_reprocessing", True):
+        stage_start = time.perf_counter()
+        fingerprint = transcript_fingerprint(pdf_stream)
+        try:
+            plan = plan_incremental_extraction(fingerprint, get_audit_store())
+        except Exception as e:
+            report_warning(f"Could not look up earlier versions of this transcript: {str(e)}")
+        timings["version_lookup"] = time.perf_counter() - stage_start
+    
+    if plan is not None and not plan["pages"]:
+        # Same transcript as last time; nothing to send to the model
+        json_data, claude_response = [], ""
+        token_usage = {
+            "calls": [],
+            "routing": {"tier": "none", "reason": "unchanged since the previous version", "escalated": False,
+                        "estimate": {"pages": 0, "est_input_tokens": 0, "est_output_tokens": 0}},
+            "total_tokens": 0,
+            "total_cost": 0.0,
+        }
+    else:
+        source = select_pdf_pages(pdf_stream, plan["pages"]) if plan is not None else pdf_stream
+        stage_start = time.perf_counter()
+        source, preprocessing = preprocess_pdf(
+            source,
+            target_dpi=st.secrets.get("pdf_target_dpi", PDF_TARGET_DPI),
+            prune_pages=st.secrets.get("pdf_prune_pages", True)
+        )
+        timings["preprocessing"] = time.perf_counter() - stage_start
+        
+        stage_start = time.perf_counter()
+        json_data, claude_response, token_usage = extract_transcript(
+            source, prompt + INCREMENTAL_PROMPT_NOTE if plan is not None else prompt
+        )
+        timings["extraction"] = time.perf_counter() - stage_start
+        if claude_response is None:
+            return None, None, None
+        token_usage["preprocessing"] = preprocessing
+        # A partial extraction may legitimately hold no terms (e.g. only a header changed)
+        if json_data is None or (not json_data and plan is None):
+            return None, claude_response, token_usage
+        json_data = post_process_transcript_data(json_data)
     
-    # Load institution mappings ONCE and store in session state
-    if "institution_df" not in st.session_state:
-        with st.spinner("Loading institution data..."):
-            institution_df = load_institution_mappings()
-            st.session_state["institution_df"] = institution_df
-            if not institution_df.empty:
-                st.success(f"Loaded institution mappings: {len(institution_df)} entries")
+    stage_start = time.perf_counter()
+    try:
+        mapping_snapshot = mapping_cache.snapshot()
+    except Exception as e:
+        report_error(f"Failed to load course mapping data: {str(e)}")
+        return None, claude_response, token_usage
+    timings["mapping_wait"] = time.perf_counter() - stage_start
+    for error in mapping_snapshot.errors:
+        report_warning(f"Mapping data: {error}")
     
-    # Always show the file uploader
-    st.write("Upload a PDF transcript to extract course information.")
-    uploaded_file = st.file_uploader("Choose a transcript PDF file", type="pdf")
+    stage_start = time.perf_counter()
+    to_enrich = json_data
+    if plan is not None:
+        previous_statistics = plan["previous"][0].get("match_statistics")
+        validation = json_data[0].pop("validation", None) if json_data else None
+        json_data, touched = merge_transcript_terms(plan["previous"], json_data,
+                                                    replace_terms={tuple(key) for key in plan["replace_terms"]})
+        if json_data and validation:
+            json_data[0]["validation"] = validation
+        # Stored terms keep their matches unless the mapping data changed since
+        to_enrich = touched if plan["mapping_version"] == mapping_snapshot.version else json_data
+        token_usage["incremental"] = {
+            "previous_run_id": plan["run_id"],
+            "pages_sent": [index + 1 for index in plan["pages"]],
+            "total_pages": plan["total_pages"],
+            "reused_terms": sum(1 for term in json_data if not any(term is other for other in to_enrich)),
+        }
+    to_enrich = enrich_with_macu_data(
+        to_enrich,
+        mapping_snapshot.macu_df,
+        mapping_snapshot.ceqmacu_df,
+        cep_catalog=mapping_snapshot.cep_catalog,
+        match_memo=get_match_memo(),
+        mapping_version=mapping_snapshot.version,
+        institution_df=mapping_snapshot.institution_df,
+        global_fallback=st.secrets.get("cep_global_fallback", False),
+        approximate_threshold=st.secrets.get("approximate_match_threshold", APPROXIMATE_MATCH_THRESHOLD)
+    )
+    if plan is not None and json_data:
+        # Statistics cover every merged term; memo hits are this run's
+        statistics = (to_enrich[0].pop("match_statistics", None) if to_enrich else None) or previous_statistics or {}
+        json_data[0]["match_statistics"] = summarize_matches(
+            json_data,
+            memo_hits=statistics.get("memo_hits", 0) if to_enrich else 0,
+            partition=statistics.get("institution_partition")
+        )
+    else:
+        json_data = to_enrich
+    json_data = add_transcript_rollups(json_data)
+    if json_data and fingerprint and fingerprint["student_key"]:
+        json_data[0]["transcript_version"] = {
+            "student_key": fingerprint["student_key"],
+            "page_digests": fingerprint["page_digests"],
+            "previous_run_id": plan["run_id"] if plan is not None else None,
+        }
+    timings["enrichment"] = time.perf_counter() - stage_start
+    return json_data, claude_response, token_usage
+
+API_POLL_WAIT = 10      # seconds each status request long-polls the transcript service
+API_JOB_TIMEOUT = 15 * 60
+
+def _api_request(api_url, path, data=None, timeout=API_POLL_WAIT + 30):
+    """Call the transcript service; JSON responses are decoded, anything else is returned as text."""
+    from urllib.request import Request, urlopen
+    headers = {"Content-Type": "application/pdf"} if data is not None else {}
+    if st.secrets.get("pipeline_api_token"):
+        headers["Authorization"] = f"Bearer {st.secrets['pipeline_api_token']}"
+    with urlopen(Request(api_url.rstrip("/") + path, data=data, headers=headers), timeout=timeout) as response:
+        body = response.read()
+        if response.headers.get_content_type() == "application/json":
+            return json.loads(body)
+        return body.decode("utf-8")
+
+def run_transcript_pipeline_remote(pdf_stream, api_url, file_name=None, timings=None):
+    """Run the pipeline on the headless transcript service (api_server.py) instead of in this process.
+
+    Like run_transcript_pipeline, but returns (json_data, claude_response,
+    token_usage, audit_run_id): the service records the run in its own audit
+    store, so the caller must not record it again. The service's errors and
+    warnings are reported here and its stage timings are copied into
+    ``timings``.
+    """
+    from urllib.error import HTTPError
+    from urllib.parse import urlencode
+    timings = {} if timings is None else timings
+    stage_start = time.perf_counter()
+    try:
+        with st.spinner("Analyzing transcript... This may take a moment."):
+            job = _api_request(api_url, "/v1/jobs?" + urlencode({"file_name": file_name or "transcript.pdf"}),
+                               data=pdf_stream.read())
+            deadline = time.monotonic() + API_JOB_TIMEOUT
+            while job["status"] in ("queued", "running"):
+                if time.monotonic() > deadline:
+                    st.error("⚠️ The transcript service did not finish in time. Please try again later.")
+                    return None, None, None, None
+                job = _api_request(api_url, f"/v1/jobs/{job['job_id']}?wait={API_POLL_WAIT}")
+            claude_response = None
+            try:
+                claude_response = _api_request(api_url, f"/v1/jobs/{job['job_id']}/response")
+            except HTTPError as e:
+                if e.code != 404:
+                    raise
+            json_data = _api_request(api_url, f"/v1/jobs/{job['job_id']}/result") if job["status"] == "done" else None
+    except HTTPError as e:
+        st.error(f"⚠️ Transcript service error {e.code}: {e.read().decode('utf-8', 'replace')}")
+        return None, None, None, None
+    except (OSError, ValueError) as e:
+        st.error(f"⚠️ Could not reach the transcript service: {str(e)}")
+        return None, None, None, None
+    
+    for warning in job["warnings"]:
+        st.warning(warning)
+    for error in job["errors"]:
+        st.error(error)
+    timings.update(job["timings"])
+    timings["service_round_trip"] = time.perf_counter() - stage_start
+    return json_data, claude_response, job["token_usage"], job.get("audit_run_id")
+
+def show_results():
+    json_data = get_artifact_store().get_json(st.session_state["json_handle"])
+    if json_data is None:
+        st.warning("The processed results have expired from temporary storage. Please process the transcript again.")
+        return
+    
+    file_name = st.session_state.get("results_file_name") or "transcript.pdf"
+    st.download_button(
+        label="Download JSON Data",
+        data=json.dumps(json_data, indent=4),
+        file_name=f"{file_name.split('.')[0]}_processed.json",
+        mime="application/json"
+    )
+    
+    # Display token usage details in an expander
+    with st.expander("API Token Usage Details"):
+        st.markdown(format_token_usage(st.session_state.get("token_usage")))
+        timings = st.session_state.get("timings") or {}
+        if timings:
+            st.caption(" | ".join(f"{stage.replace('_', ' ')}: {seconds:.2f}s" for stage, seconds in timings.items()))
     
+    display_transcript_data(json_data, st.session_state.get("json_digest"))
+    
+    with st.expander("View Raw JSON Data"):
+        st.json(json_data)
+
+@fragment
+def feedback_panel():
+    """Feedback form and persistence; typing or submitting reruns only this fragment."""
     # Handle feedback dialog for previously processed PDF without blocking new uploads
     if st.session_state.get("pdf_processed", False) and not st.session_state.get("feedback_submitted", False) and not st.session_state.get("feedback_skipped", False):
         st.markdown("---")
@@ -1022,9 +3721,13 @@ def main():
         if feedback_result == True:  # Feedback submitted
             st.session_state["feedback_submitted"] = True
             # After feedback is submitted, save the PDF to Google Drive
-            if st.session_state.get("pdf_bytes") and st.session_state.get("uploaded_file_name"):
+            artifact_store = get_artifact_store()
+            pdf_stream = artifact_store.open(st.session_state.get("pdf_handle"))
+            if pdf_stream is None and st.session_state.get("pdf_handle"):
+                st.error("The uploaded PDF has expired from temporary storage. Please upload it again.")
+            elif pdf_stream is not None and st.session_state.get("uploaded_file_name"):
                 success, message, file_url = save_pdf_to_drive(
-                    st.session_state["pdf_bytes"], 
+                    pdf_stream, 
                     st.session_state["uploaded_file_name"]
                 )
                 
@@ -1034,34 +3737,62 @@ def main():
                     sheet_success = False
                     sheet_message = ""
                     
-                    if "json_data" in st.session_state and file_url:
-                        st.write("Attempting to save data to Google Sheet...")
-                        sheet_success, sheet_message = save_to_google_sheet(
-                            file_url, 
-                            st.session_state["json_data"], 
-                            feedback_text
-                        )
-                        
-                    if sheet_success:
-                        st.success(sheet_message)
-                    else:
-                        st.error(sheet_message)
-                        st.error("Failed to save data to Google Sheet. Please check the logs for details.")
+                    record_audit_feedback("submitted", feedback_text, file_url)
+                    
+                    # The Google Sheet is an optional mirror of the audit store
+                    if st.secrets.get("mirror_to_google_sheet", True):
+                        json_data = artifact_store.get_json(st.session_state.get("json_handle"))
+                        if json_data is not None and file_url:
+                            st.write("Attempting to save data to Google Sheet...")
+                            sheet_success, sheet_message = save_to_google_sheet(
+                                file_url, 
+                                json_data, 
+                                feedback_text
+                            )
+                            
+                        if sheet_success:
+                            st.success(sheet_message)
+                        else:
+                            st.error(sheet_message)
+                            st.error("Failed to save data to Google Sheet. Please check the logs for details.")
                     if file_url:
                         st.markdown(f"[View the file in Google Drive]({file_url})")
                 else:
+                    record_audit_feedback("submitted", feedback_text)
                     st.session_state["drive_upload_status"] = "error"
                     st.error(f"Failed to save PDF to Google Drive: {message}")
         
         elif feedback_result == "skipped":  # Feedback skipped
+            record_audit_feedback("skipped")
             st.session_state["feedback_skipped"] = True
             st.info("Feedback skipped. You can process another transcript.")
             st.markdown("---")
+
+@fragment
+def upload_panel():
+    """Uploader and Process Transcript button."""
+    # Always show the file uploader
+    st.write("Upload a PDF transcript to extract course information.")
+    uploaded_file = st.file_uploader("Choose a transcript PDF file", type="pdf")
     
     # Process the uploaded file (if any)
     if uploaded_file is not None:
-        pdf_bytes = uploaded_file.getvalue()
-        st.session_state["pdf_bytes"] = pdf_bytes
+        artifact_store = get_artifact_store()
+        # Copy each upload into the shared store once; reruns reuse the handle
+        upload_key = getattr(uploaded_file, "file_id", None) or f"{uploaded_file.name}:{uploaded_file.size}"
+        if (st.session_state.get("uploaded_file_key") != upload_key
+                or artifact_store.size(st.session_state.get("pdf_handle")) is None):
+            if st.session_state.get("pdf_handle"):
+                artifact_store.discard(st.session_state["pdf_handle"])
+                st.session_state["pdf_handle"] = None
+            try:
+                st.session_state["pdf_handle"] = artifact_store.put_stream(uploaded_file, kind="pdf")
+            except ValueError as e:
+                st.session_state["uploaded_file_key"] = None
+                st.error(f"This PDF is too large to process: {e}")
+                return
+            st.session_state["pdf_sha256"] = sha256_stream(uploaded_file)
+            st.session_state["uploaded_file_key"] = upload_key
         st.session_state["uploaded_file_name"] = uploaded_file.name
         
         # Process the transcript button
@@ -1071,41 +3802,190 @@ def main():
             st.session_state["feedback_skipped"] = False
             st.session_state["pdf_processed"] = False
             
-            claude_response, token_usage = analyze_pdf(pdf_bytes, PROMPT)
-            json_data = extract_json(claude_response)
+            pdf_stream = artifact_store.open(st.session_state["pdf_handle"])
+            if pdf_stream is None:
+                st.error("The uploaded PDF has expired from temporary storage. Please upload it again.")
+                return
+            # Creating/getting the cache keeps the mapping load running alongside extraction
+            mapping_cache = get_mapping_cache()
+            timings = {}
+            profiler = None
+            if st.session_state.get("is_admin") and st.session_state.get("profile_next_run"):
+                profiler = RunProfiler(uploaded_file.name)
+                # Load the sheets on this thread so the profile covers them
+                with profiler.stage("mapping_load"):
+                    mapping_cache.refresh(block=True)
+            api_url = st.secrets.get("pipeline_api_url")
+            with pdf_stream, (profiler.stage("pipeline") if profiler else nullcontext()):
+                if api_url:
+                    # Thin client: extraction and enrichment run on the transcript service
+                    json_data, claude_response, token_usage, audit_run_id = run_transcript_pipeline_remote(
+                        pdf_stream, api_url, file_name=uploaded_file.name, timings=timings
+                    )
+                else:
+                    json_data, claude_response, token_usage = run_transcript_pipeline(
+                        pdf_stream, mapping_cache, timings=timings
+                    )
+                    audit_run_id = None
             
             if json_data:
-                json_data = post_process_transcript_data(json_data)
-                macu_df = load_macu_mappings_from_sheets()
-                ceqmacu_df = load_ceqmacu_mappings()
-                json_data = enrich_with_macu_data(json_data, macu_df, ceqmacu_df)
-                st.session_state["json_data"] = json_data
+                if st.session_state.get("json_handle"):
+                    artifact_store.discard(st.session_state["json_handle"])
+                st.session_state["json_handle"] = artifact_store.put_json(json_data)
+                st.session_state["json_digest"] = json_data_digest(json_data)
+                st.session_state["token_usage"] = token_usage
+                st.session_state["timings"] = timings
+                st.session_state["results_file_name"] = uploaded_file.name
+                if not api_url:
+                    # Remote runs are recorded by the transcript service itself
+                    audit_run_id = record_audit_run(
+                        json_data, st.session_state.get("pdf_sha256"), uploaded_file.name, timings, token_usage
+                    )
+                st.session_state["audit_run_id"] = audit_run_id
                 
                 st.success("Transcript processed successfully!")
-                st.download_button(
-                    label="Download JSON Data",
-                    data=json.dumps(json_data, indent=4),
-                    file_name=f"{uploaded_file.name.split('.')[0]}_processed.json",
-                    mime="application/json"
-                )
-                
-                # Display token usage details in an expander
-                with st.expander("API Token Usage Details"):
-                    st.markdown(token_usage)
-                
-                # Use the display function without passing institution_df
-                # as it's now accessed from session state
-                display_transcript_data(json_data)
-                
-                with st.expander("View Raw JSON Data"):
-                    st.json(json_data)
                 
                 # Set the state to show that a PDF has been processed
                 st.session_state["pdf_processed"] = True
+                if profiler is not None:
+                    # Rendering happens in results_panel on the rerun; it finishes the profile
+                    st.session_state["run_profiler"] = profiler
+                # Full rerun so the feedback and results fragments pick up the new result
+                st.rerun()
             else:
                 st.error("Failed to extract data from the transcript.")
-                st.text(claude_response)
+                if claude_response:
+                    st.text(claude_response)
+                if profiler is not None:
+                    st.session_state["profile_reports"] = profiler.finish(get_profile_dir())
+
+@fragment
+def bulk_export_panel():
+    """Flatten many downloaded result files into one course table for SIS import."""
+    with st.expander("Bulk export for SIS import"):
+        result_files = st.file_uploader(
+            "Processed JSON files (from 'Download JSON Data')",
+            type="json",
+            accept_multiple_files=True,
+            key="bulk_export_files"
+        )
+        export_format = st.radio("Format", ["parquet", "csv"], horizontal=True, key="bulk_export_format")
+        if result_files and st.button("Build export"):
+            mapping_snapshot = get_mapping_cache().current()
+            institution_df = mapping_snapshot.institution_df if mapping_snapshot else None
+            export_path = os.path.join(get_artifact_store().spill_dir, f"export_{uuid.uuid4().hex}.{export_format}")
+            with st.spinner("Building export..."):
+                row_count = export_course_table(
+                    iter_transcript_files(result_files), export_path,
+                    fmt=export_format, institution_df=institution_df
+                )
+            st.success(f"Exported {row_count} course rows from {len(result_files)} files.")
+            with open(export_path, "rb") as export_file:
+                st.download_button(
+                    label=f"Download {export_format.upper()}",
+                    data=export_file,
+                    file_name=f"sis_course_export.{export_format}",
+                    mime="application/octet-stream" if export_format == "parquet" else "text/csv"
+                )
+            os.remove(export_path)
+
+@fragment
+def audit_panel():
+    """Admin-only review of unmatched courses and export from the audit store."""
+    with st.expander("Audit log: unmatched courses"):
+        audit_store = get_audit_store()
+        col1, col2, col3 = st.columns([2, 1, 1])
+        with col1:
+            institution = st.selectbox("Institution", [""] + audit_store.institutions(), key="audit_institution",
+                                       format_func=lambda name: name or "All institutions")
+        with col2:
+            year = st.text_input("Year", key="audit_year")
+        with col3:
+            term_code = st.selectbox("Term", ["", "TF", "TS", "TU"], key="audit_term_code",
+                                     format_func=lambda code: code or "All terms")
+        rows = audit_store.unmatched_courses(institution=institution, year=year.strip(), term_code=term_code)
+        st.caption(f"{len(rows)} unmatched courses")
+        st.dataframe(pd.DataFrame(rows), hide_index=True, width="stretch")
+        
+        if st.button("Export all stored runs (Parquet)"):
+            export_path = os.path.join(get_artifact_store().spill_dir, f"audit_export_{uuid.uuid4().hex}.parquet")
+            mapping_snapshot = get_mapping_cache().current()
+            with st.spinner("Building export..."):
+                row_count = export_course_table(
+                    audit_store.iter_transcripts(institution=institution or None), export_path,
+                    institution_df=mapping_snapshot.institution_df if mapping_snapshot else None
+                )
+            with open(export_path, "rb") as export_file:
+                st.download_button(f"Download {row_count} course rows", data=export_file,
+                                   file_name="audit_course_export.parquet", mime="application/octet-stream")
+            os.remove(export_path)
+
+@fragment
+def results_panel():
+    """Results view; filter interactions rerun only this fragment."""
+    # Results stay on screen across reruns; the display model is cached per result
+    if st.session_state.get("pdf_processed") and st.session_state.get("json_handle"):
+        profiler = st.session_state.pop("run_profiler", None)
+        if profiler is None:
+            show_results()
+        else:
+            with profiler.stage("render"):
+                show_results()
+            st.session_state["profile_reports"] = profiler.finish(get_profile_dir())
+    if st.session_state.get("is_admin") and st.session_state.get("profile_reports"):
+        show_profile_reports()
+
+def main():
+    st.set_page_config(page_title="Transcript Analyzer", layout="wide")
+    st.title("🔍 Academic Transcript Analyzer")
+    
+    # Initialize session state variables
+    for key in ["pdf_processed", "feedback_submitted", "feedback_skipped", 
+                "uploaded_file_name", "uploaded_file_key", "pdf_handle", "json_handle", "drive_upload_status"]:
+        if key not in st.session_state:
+            st.session_state[key] = False if key in ["pdf_processed", "feedback_submitted", "feedback_skipped"] else None
+    
+    # Step 1: Ask for password
+    if not check_password():
+        st.warning("Please enter the password to access the transcript analyzer.")
+        st.stop()  # Don't run the rest of the app until the correct password is entered
+
+    st.success("Access granted. You may now upload and analyze transcripts.")
+    
+    # Show upload status from previous submission if available
+    if st.session_state.get("drive_upload_status") == "success":
+        st.success("Previous PDF was successfully saved to Google Drive.")
+        # Clear the status to avoid showing it repeatedly
+        st.session_state["drive_upload_status"] = None
+    
+    # Mapping data is loaded once per process, in the background, and shared by
+    # every session; creating the cache starts the first load without waiting on it
+    mapping_cache = get_mapping_cache()
+    mapping_snapshot = mapping_cache.current()
+    if mapping_snapshot is None:
+        if mapping_cache.last_error:
+            st.error(f"⚠️ Could not load the course mapping data: {mapping_cache.last_error}")
+        else:
+            st.info("Loading institution and course mapping data in the background...")
+    elif mapping_snapshot.errors:
+        st.warning(
+            "⚠️ Some course mapping data could not be loaded, so matches may be incomplete or out of date:\n\n"
+            + "\n".join(f"- {error}" for error in mapping_snapshot.errors)
+        )
+    if mapping_snapshot is not None and not st.session_state.get("mapping_load_reported"):
+        st.session_state["mapping_load_reported"] = True
+        if not mapping_snapshot.institution_df.empty:
+            st.success(f"Loaded institution mappings: {len(mapping_snapshot.institution_df)} entries")
+    
+    if is_admin():
+        show_admin_tools()
+    
+    upload_panel()
+    feedback_panel()
+    results_panel()
+    bulk_export_panel()
+    if st.session_state.get("is_admin"):
+        audit_panel()
                 
 if __name__ == "__main__":
     main()
-                
@@ -0,0 +1,55 @@
+import base64
+import io
+
+import pytest
+
+import testing
+
+
+@pytest.mark.parametrize("size", [0, 1, 2, 3, 4, 5, 8, 9, 10, 299, 300, 301])
+@pytest.mark.parametrize("chunk_size", [3, 6, 9, 30])
+def test_base64_encode_stream_matches_b64encode(size, chunk_size):
+    data = bytes(range(256)) * 2
+    data = data[:size]
+    assert testing.base64_encode_stream(io.BytesIO(data), chunk_size=chunk_size) == base64.b64encode(data).decode("ascii")
+
+
+def test_base64_encode_stream_reads_from_start():
+    stream = io.BytesIO(b"transcript bytes")
+    stream.seek(5)
+    assert testing.base64_encode_stream(stream) == base64.b64encode(b"transcript bytes").decode("ascii")
+
+
+def test_artifact_store_spills_and_evicts_least_recently_used(tmp_path):
+    store = testing.ArtifactStore(memory_budget=10, spill_threshold=8, total_budget=30, spill_dir=str(tmp_path))
+    first = store.put_bytes(b"a" * 6)
+    second = store.put_bytes(b"b" * 9)  # above the spill threshold
+    assert store.stats() == {"entries": 2, "memory_bytes": 6, "disk_bytes": 9}
+    assert store.get_bytes(first) == b"a" * 6
+    third = store.put_bytes(b"c" * 20)
+    # second is now least recently used and goes first
+    assert store.get_bytes(second) is None
+    assert store.get_bytes(first) == b"a" * 6
+    assert store.get_bytes(third) == b"c" * 20
+
+
+def test_artifact_store_rejects_artifact_over_total_budget(tmp_path):
+    store = testing.ArtifactStore(memory_budget=10, spill_threshold=8, total_budget=30, spill_dir=str(tmp_path))
+    kept = store.put_bytes(b"a" * 6)
+    with pytest.raises(ValueError):
+        store.put_bytes(b"x" * 31)
+    assert store.get_bytes(kept) == b"a" * 6
+    assert store.stats()["entries"] == 1
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_artifact_store_ages_entries_from_last_access(tmp_path, monkeypatch):
+    store = testing.ArtifactStore(max_age=100, spill_dir=str(tmp_path))
+    now = [1000.0]
+    monkeypatch.setattr(testing.time, "time", lambda: now[0])
+    read, unread = store.put_bytes(b"read"), store.put_bytes(b"unread")
+    now[0] += 80
+    assert store.get_bytes(read) == b"read"
+    now[0] += 80  # 160s after creation, 80s after the last read
+    assert store.get_bytes(read) == b"read"
+    assert store.get_bytes(unread) is None
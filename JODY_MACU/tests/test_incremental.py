@@ -0,0 +1,155 @@
+import pandas as pd
+
+import testing
+
+
+class FakeAuditStore:
+    def __init__(self, previous):
+        self.previous = previous
+
+    def latest_version(self, student_key):
+        return self.previous
+
+
+def _fingerprint(digests, explanation_pages=(), heading_pages=(), page_terms=None):
+    return {
+        "student_key": "student",
+        "page_digests": list(digests),
+        "explanation_pages": list(explanation_pages),
+        "heading_pages": list(heading_pages),
+        "page_terms": page_terms or [[] for _ in digests],
+    }
+
+
+def _store(digests):
+    return FakeAuditStore({"run_id": 7, "page_digests": list(digests),
+                           "result": [{"term": "Fall", "year": "2020", "courses": []}],
+                           "mapping_version": 3})
+
+
+def test_plan_sends_changed_pages_back_to_their_term_heading():
+    # Pages 0-3 hold one term started on page 0; only page 3 changed
+    plan = testing.plan_incremental_extraction(
+        _fingerprint(["a", "b", "c", "d2", "e"], heading_pages=[0, 4]), _store(["a", "b", "c", "d", "e"])
+    )
+    assert plan["pages"] == [0, 1, 2, 3]
+    assert plan["changed_pages"] == [3]
+    assert (plan["run_id"], plan["mapping_version"], plan["total_pages"]) == (7, 3, 5)
+
+
+def test_plan_without_headings_sends_the_page_before():
+    plan = testing.plan_incremental_extraction(_fingerprint(["a", "b", "c", "d2"]), _store(["a", "b", "c", "d"]))
+    assert plan["pages"] == [2, 3]
+
+
+def test_plan_adds_explanation_page_and_ignores_it_for_matching():
+    plan = testing.plan_incremental_extraction(
+        _fingerprint(["a", "b", "new", "legend"], explanation_pages=[3], heading_pages=[0, 1]),
+        _store(["a", "b", "legend-old"])
+    )
+    assert plan["pages"] == [1, 2, 3]
+    # Only the explanation page in common: not a newer version
+    assert testing.plan_incremental_extraction(
+        _fingerprint(["x", "legend"], explanation_pages=[1]), _store(["a", "legend"])
+    ) is None
+
+
+def test_plan_unchanged_and_unrelated_transcripts():
+    assert testing.plan_incremental_extraction(_fingerprint(["a", "b"]), _store(["a", "b"]))["pages"] == []
+    assert testing.plan_incremental_extraction(_fingerprint(["x", "y"]), _store(["a", "b"])) is None
+    assert testing.plan_incremental_extraction(_fingerprint(["a"]), FakeAuditStore(None)) is None
+    assert testing.plan_incremental_extraction(None, _store(["a"])) is None
+
+
+def test_merge_replaces_listed_courses_and_keeps_the_rest():
+    previous = [
+        {"institution": "Test College", "term": "Fall", "year": "2020", "match_statistics": {"total": 2},
+         "credit_summary": {}, "courses": [{"course_code": "ENG 101", "grade": "IP"}, {"course_code": "MTH 120", "grade": "B"}]},
+        {"institution": "Test College", "term": "Fall", "year": "2021", "courses": [{"course_code": "BIO 110"}]},
+    ]
+    extracted = [
+        {"term": "Fall", "year": "2020", "courses": [{"course_code": "eng 101", "grade": "A"}]},
+        {"term": "Spring", "year": "2021", "courses": [{"course_code": "HIS 201"}]},
+    ]
+    merged, touched = testing.merge_transcript_terms(previous, extracted)
+    assert [(term["term"], term["year"]) for term in merged] == [("Fall", "2020"), ("Spring", "2021"), ("Fall", "2021")]
+    assert merged[0]["courses"] == [{"course_code": "MTH 120", "grade": "B"}, {"course_code": "eng 101", "grade": "A"}]
+    assert "match_statistics" not in merged[0] and "credit_summary" not in merged[0]
+    assert merged[1]["institution"] == "Test College"
+    assert touched == [merged[0], merged[1]]
+
+
+def test_plan_replaces_terms_whose_pages_were_all_sent():
+    # Fall 2020 on pages 0-1, Spring 2021 starts on page 1 and runs to page 2, Fall 2021 on page 3
+    page_terms = [[("TF", "2020")], [("TS", "2021")], [], [("TF", "2021")]]
+    plan = testing.plan_incremental_extraction(
+        _fingerprint(["a", "b", "c2", "d"], heading_pages=[0, 1, 3], page_terms=page_terms),
+        _store(["a", "b", "c", "d"])
+    )
+    assert plan["pages"] == [1, 2]
+    # Spring 2021 may run on above the Fall 2021 heading on page 3, which wasn't sent
+    assert plan["replace_terms"] == []
+    plan = testing.plan_incremental_extraction(
+        _fingerprint(["a", "b", "c", "d2"], heading_pages=[0, 1, 3], page_terms=page_terms),
+        _store(["a", "b", "c", "d"])
+    )
+    assert plan["pages"] == [1, 2, 3]
+    assert plan["replace_terms"] == [("TF", "2021"), ("TS", "2021")]
+
+
+def test_term_page_spans_skip_explanation_pages():
+    spans = testing._term_page_spans([[("TF", "2020")], [], [("TS", "2021")], [("TF", "2020")]], [3])
+    assert spans == {("TF", "2020"): (0, 2), ("TS", "2021"): (2, 3)}
+    assert testing._heading_term_key("spring semester 2021") == ("TS", "2021")
+    assert testing._heading_term_key("2019 winter") == ("winter", "2019")
+
+
+def test_merge_replaces_fully_extracted_terms():
+    previous = [{"institution": "Test College", "term": "Fall", "year": "2020",
+                 "courses": [{"course_code": "ENG 101"}, {"course_code": "MTH 120"}]}]
+    extracted = [{"term": "Fall", "year": "2020", "courses": [{"course_code": "ENG 101", "grade": "A"}]}]
+    merged, touched = testing.merge_transcript_terms(previous, extracted, replace_terms={("TF", "2020")})
+    assert merged[0]["courses"] == [{"course_code": "ENG 101", "grade": "A"}]
+    assert touched == [merged[0]]
+
+
+def _catalog():
+    macu_df = pd.DataFrame([
+        {"Institution": "Test College", "CourseCode": "ENG 101", "CombineTitleCode": "ENG 101 English Composition I",
+         "CommonCode": "ENGL 1113", "CommonCourseTitle": "Composition I", "source_sheet": "2022-2023"},
+        {"Institution": "MACU", "CourseCode": "ENG 1113", "CombineTitleCode": "ENG 1113 English Composition I",
+         "CommonCode": "ENGL 1113", "CommonCourseTitle": "Composition I", "source_sheet": "2022-2023"},
+    ])
+    return macu_df, testing.prepare_cep_catalog(macu_df)
+
+
+def test_reenrichment_clears_stale_match_fields():
+    macu_df, cep_catalog = _catalog()
+    json_data = [{"institution": "Test College", "term": "Fall", "year": "2022", "courses": [
+        {"course_code": "ENG 101", "title": "English Composition I", "credits": 3, "grade": "A"},
+    ]}]
+    testing.enrich_with_macu_data(json_data, macu_df, cep_catalog=cep_catalog)
+    course = json_data[0]["courses"][0]
+    assert course["data_from"] == "CEP"
+    assert course["macu_course_code"] == "ENG1113"
+    
+    # A newer version of the transcript corrected the course; the old match must not survive
+    course.update({"course_code": "XYZ 999", "title": "Underwater Basketry"})
+    testing.enrich_with_macu_data(json_data, macu_df, cep_catalog=cep_catalog)
+    assert course["data_from"].strip() == ""
+    assert course["cep_match"] is False
+    for field in ("common_code", "source_sheet", "matched_on", "match_scope", "macu_course_code",
+                  "macu_course_title", "macu_credits"):
+        assert field not in course
+
+
+def test_student_key_includes_the_school():
+    tulsa = testing._student_key("tulsa community college official transcript student id: 1234567")
+    rose = testing._student_key("rose state college official transcript student id: 1234567")
+    assert tulsa and rose and tulsa != rose
+    assert tulsa == testing._student_key("official transcript tulsa community college student id: 1234567 fall 2021")
+
+
+def test_student_key_needs_an_id_and_a_school():
+    assert testing._student_key("tulsa community college name: jane doe") is None
+    assert testing._student_key("official transcript student id: 1234567") is None
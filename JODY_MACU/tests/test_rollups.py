@@ -0,0 +1,64 @@
+import testing
+
+
+def _transcript():
+    return [
+        {"term": "Fall", "year": "2021", "courses": [
+            {"course_code": "ENG 101", "credits": 3, "grade": "A", "data_from": "CEP", "macu_credits": 3},
+            {"course_code": "MTH 120", "credits": 4, "grade": "C", "data_from": " "},
+            {"course_code": "HIS 201", "credits": 3, "grade": "W", "data_from": " "},
+        ]},
+        {"term": "Spring", "year": "2022", "courses": [
+            {"course_code": "BIO 110", "credits": 4, "grade": "F", "data_from": "CEQMACU", "macu_credits": 4},
+            {"course_code": "PED 100", "credits": 1, "grade": "P", "data_from": "CEP", "macu_credits": 2},
+            # Credits back-filled from points / grade value
+            {"course_code": "ART 105", "credits": "", "points": "9", "grade": "B", "data_from": " "},
+        ]},
+    ]
+
+
+def test_compute_rollups_term_and_cumulative_totals():
+    terms, transcripts = testing.compute_rollups(testing.flatten_courses([("t", _transcript())]))
+    fall, spring = terms.to_dict("records")
+    assert (fall["attempted_credits"], fall["earned_credits"], fall["gpa_credits"]) == (7, 7, 7)
+    assert fall["quality_points"] == 20
+    assert fall["term_gpa"] == round(20 / 7, 2)
+    assert (spring["attempted_credits"], spring["earned_credits"], spring["gpa_credits"]) == (8, 4, 7)
+    assert spring["quality_points"] == 9
+    assert spring["term_gpa"] == round(9 / 7, 2)
+    assert spring["cumulative_attempted_credits"] == 15
+    assert spring["cumulative_earned_credits"] == 11
+    assert spring["cumulative_gpa"] == round(29 / 14, 2)
+    
+    summary = transcripts.to_dict("records")[0]
+    assert summary["cumulative_gpa"] == round(29 / 14, 2)
+    # Earned courses only, MACU credits where known
+    assert summary["transfer_credits_CEP"] == 5
+    assert summary["transfer_credits_CEQMACU"] == 0
+    assert summary["transfer_credits_unmatched"] == 7
+
+
+def test_compute_rollups_keeps_transcripts_separate():
+    other = [{"term": "Fall", "year": "2020", "courses": [{"course_code": "X 1", "credits": 3, "grade": "B"}]}]
+    terms, transcripts = testing.compute_rollups(testing.flatten_courses([("a", _transcript()), ("b", other)]))
+    assert terms.groupby("transcript").size().to_dict() == {"a": 2, "b": 1}
+    b = transcripts.set_index("transcript").loc["b"]
+    assert (b["attempted_credits"], b["cumulative_gpa"]) == (3, 3.0)
+
+
+def test_compute_rollups_term_without_gpa_credits():
+    data = [{"term": "Fall", "year": "2020", "courses": [{"course_code": "X 1", "credits": 3, "grade": "P"}]}]
+    terms, transcripts = testing.compute_rollups(testing.flatten_courses([(0, data)]))
+    row = terms.to_dict("records")[0]
+    assert row["earned_credits"] == 3
+    assert row["term_gpa"] != row["term_gpa"]  # NaN: no graded credits
+
+
+def test_add_transcript_rollups_carries_cumulative_totals_over_empty_terms():
+    data = _transcript()
+    data.insert(1, {"term": "Summer", "year": "2022", "courses": []})
+    testing.add_transcript_rollups(data)
+    assert data[1]["term_rollup"]["term_gpa"] is None
+    assert data[1]["term_rollup"]["cumulative_gpa"] == data[0]["term_rollup"]["cumulative_gpa"]
+    assert data[0]["credit_summary"]["earned_credits"] == 11
+    assert data[0]["credit_summary"]["transfer_credits"] == {"CEP": 5.0, "CEQMACU": 0.0, "unmatched": 7.0}
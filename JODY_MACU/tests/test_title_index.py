@@ -0,0 +1,70 @@
+import numpy as np
+
+import testing
+
+
+CATALOG = [
+    "eng 101 english composition i",
+    "eng 102 english composition ii",
+    "bio 110 general biology",
+    "mth 120 college algebra",
+    "his 201 american history i",
+]
+
+
+def _cosine(a, b, n=testing.TITLE_INDEX_NGRAM):
+    """Reference sublinear TF-IDF cosine computed the slow way."""
+    def grams(text):
+        padded = f" {text} ".encode("utf-8")
+        counts = {}
+        for start in range(len(padded) - n + 1):
+            gram = padded[start:start + n]
+            counts[gram] = counts.get(gram, 0) + 1
+        return counts
+    catalog_grams = [grams(text) for text in CATALOG]
+    frequency = {}
+    for counts in catalog_grams:
+        for gram in counts:
+            frequency[gram] = frequency.get(gram, 0) + 1
+    def vector(counts):
+        weights = {gram: (1 + np.log(count)) * (np.log((1 + len(CATALOG)) / (1 + frequency[gram])) + 1)
+                   for gram, count in counts.items() if gram in frequency}
+        norm = np.sqrt(sum(value ** 2 for value in weights.values()))
+        return {gram: value / norm for gram, value in weights.items()}
+    va, vb = vector(grams(a)), vector(grams(b))
+    return sum(value * vb.get(gram, 0.0) for gram, value in va.items())
+
+
+def test_best_matches_finds_near_miss_titles():
+    index = testing.TitleIndex(CATALOG)
+    rows, scores = index.best_matches([
+        "eng 101 english compostion i",
+        "bio 110 gen biology",
+        "mth 120 college algebra",
+    ])
+    assert rows.tolist() == [0, 2, 3]
+    assert abs(scores[2] - 1.0) < 1e-9
+    assert all(0 < score <= 1 + 1e-9 for score in scores)
+
+
+def test_best_matches_scores_are_exact_cosine():
+    index = testing.TitleIndex(CATALOG)
+    queries = ["english composition", "american history"]
+    rows, scores = index.best_matches(queries)
+    for query, row, score in zip(queries, rows, scores):
+        assert abs(score - _cosine(query, CATALOG[row])) < 1e-9
+        assert score >= max(_cosine(query, text) for text in CATALOG) - 1e-9
+
+
+def test_best_matches_without_shared_ngrams():
+    index = testing.TitleIndex(CATALOG)
+    rows, scores = index.best_matches(["zzz", ""])
+    assert rows.tolist() == [-1, -1]
+    assert scores.tolist() == [0.0, 0.0]
+
+
+def test_best_matches_on_empty_index_or_batch():
+    rows, scores = testing.TitleIndex([]).best_matches(["eng 101"])
+    assert rows.tolist() == [-1] and scores.tolist() == [0.0]
+    rows, scores = testing.TitleIndex(CATALOG).best_matches([])
+    assert len(rows) == 0 and len(scores) == 0
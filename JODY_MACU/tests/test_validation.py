@@ -0,0 +1,37 @@
+import testing
+
+
+def _course(code, grade="A", credits=3, points=12):
+    return {"course_code": code, "title": f"{code} title", "credits": credits, "grade": grade, "points": points}
+
+
+def _term(*courses, year="2021"):
+    return {"term": "Fall", "year": year, "courses": list(courses)}
+
+
+def test_repair_accepted_when_it_fixes_problems_and_keeps_courses():
+    old = _term(_course("ENG 101"), _course("MTH 120", grade="Q"))
+    candidate = _term(_course("ENG 101"), _course("MTH 120", grade="B", points=9))
+    assert testing._repair_is_better(old, candidate)
+
+
+def test_repair_rejected_when_it_drops_courses():
+    old = _term(_course("ENG 101"), _course("MTH 120", grade="Q"), _course("BIO 110"))
+    # Fewer problems only because the broken course is gone
+    candidate = _term(_course("ENG 101"), _course("BIO 110"))
+    assert not testing._repair_is_better(old, candidate)
+
+
+def test_repair_rejected_without_improvement_or_with_lower_score():
+    old = _term(_course("ENG 101"), _course("MTH 120", grade="Q"))
+    assert not testing._repair_is_better(old, _term(_course("ENG 101"), _course("MTH 120", grade="Z?")))
+    # One problem fewer, but a bad year makes the whole term score 0
+    old = _term(_course("ENG 101", grade="Q"), _course("MTH 120", grade="Q"), _course("BIO 110"), _course("HIS 201"))
+    worse = _term(_course("ENG 101"), _course("MTH 120"), _course("BIO 110"), _course("HIS 201"), year="21")
+    assert len(testing._term_problems(worse)) < len(testing._term_problems(old))
+    assert not testing._repair_is_better(old, worse)
+
+
+def test_repair_of_structurally_invalid_term_may_change_courses():
+    old = {"term": "Fall", "year": "21", "courses": [_course("ENG 101"), _course("ENG 1O1", grade="Q")]}
+    assert testing._repair_is_better(old, _term(_course("ENG 101")))